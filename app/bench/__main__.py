@@ -0,0 +1,44 @@
+import asyncio
+import argparse
+
+from app.bench import load, micro, watch
+
+def get_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog='python -m app.bench', description='Load generator and microbenchmarks, as redis-benchmark.')
+    parser.add_argument('--host', type=str, default='localhost')
+    parser.add_argument('-p', '--port', type=int, default=6379)
+    parser.add_argument('-c', '--clients', type=int, default=50, help='concurrent connections')
+    parser.add_argument('-n', '--requests', type=int, default=100_000, help='total requests')
+    parser.add_argument('-P', '--pipeline', type=int, default=1, help='requests sent per round trip')
+    parser.add_argument('-r', '--keyspace', type=int, default=10_000, help='distinct keys the commands use')
+    parser.add_argument('-d', '--data-size', type=int, default=16, help='bytes per SET and XADD value')
+    parser.add_argument('--mix', type=str, default='get=50,set=30,incr=10,xadd=5,xrange=5',
+                        help='weights of the commands, among ' + ', '.join(load.COMMANDS).lower())
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--cluster', action='store_true', help='spread the clients over the nodes of the cluster the server belongs to')
+    parser.add_argument('--in-process', action='store_true', help='call process_command directly instead of connecting')
+    parser.add_argument('--micro', action='store_true', help='run the parser and encoder microbenchmarks instead')
+    parser.add_argument('--watch', action='store_true', help='run the WATCH contention benchmark instead, incrementing -r counters')
+    return parser.parse_args()
+
+def main():
+    args = get_args()
+    if args.micro:
+        micro.run()
+        return
+    if args.watch:
+        asyncio.run(watch.run_server(args.host, args.port, args.clients, args.requests, args.keyspace, args.seed))
+        return
+
+    workload = load.Workload(load.parse_mix(args.mix), args.keyspace, args.data_size, args.seed)
+    target = 'in process' if args.in_process else f'{args.host}:{args.port}' + (' cluster' if args.cluster else '')
+    print(f'{args.requests} requests from {args.clients} clients to {target}, pipeline {args.pipeline}, '
+          f'{args.keyspace} keys, {args.data_size} byte values, mix {args.mix}')
+    if args.in_process:
+        stats = load.run_in_process(workload, args.clients, args.requests, args.pipeline)
+    else:
+        stats = asyncio.run(load.run_server(args.host, args.port, workload, args.clients, args.requests, args.pipeline, args.cluster))
+    stats.report()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+import sys
+import time
+
+from app.bench.resp import encode_command
+from app.controllers import BaseController
+
+BATCH = 100
+
+def single_key(name: bytes, keys: list, values: list = None) -> bytes:
+    if values is None:
+        return b''.join(encode_command(name, key) for key in keys)
+    return b''.join(encode_command(name, key, value) for key, value in zip(keys, values))
+
+def multi_key(name: bytes, keys: list, values: list = None) -> bytes:
+    batches = []
+    for i in range(0, len(keys), BATCH):
+        args = keys[i:i + BATCH] if values is None else [arg for pair in zip(keys[i:i + BATCH], values[i:i + BATCH]) for arg in pair]
+        batches.append(encode_command(name, *args))
+    return b''.join(batches)
+
+def serve(controller: BaseController, payload: bytes) -> float:
+    """Run a pipeline through the path a connection takes, minus the socket: parse, dispatch, encode replies."""
+    start = time.perf_counter()
+    controller.parser.feed(payload)
+    for args, _ in controller.parser.read_commands():
+        for reply in controller.process_command(controller.decode_command(args)):
+            controller.output.write(reply)
+    controller.output.drain()
+    return time.perf_counter() - start
+
+def main():
+    keys_count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    # State parses the server's command line
+    del sys.argv[1:]
+    from app.context import State
+    controller = BaseController(State())
+
+    keys = [b'key:%d' % i for i in range(keys_count)]
+    values = [b'value:%d' % i for i in range(keys_count)]
+    workloads = [
+        ('SET / MSET', single_key(b'SET', keys, values), multi_key(b'MSET', keys, values)),
+        ('GET / MGET', single_key(b'GET', keys), multi_key(b'MGET', keys)),
+        ('EXISTS / EXISTS', single_key(b'EXISTS', keys), multi_key(b'EXISTS', keys)),
+        ('DEL / DEL', single_key(b'DEL', keys), multi_key(b'DEL', keys)),
+    ]
+
+    print(f'{keys_count} keys, {BATCH} keys per multi-key command')
+    print(f"{'commands':<18}{'pipelined':>12}{'multi-key':>12}{'speedup':>10}")
+    for name, pipelined, batched in workloads:
+        # DEL empties the keyspace, refill it before each run
+        controller.state.save_many(keys, values)
+        single = serve(controller, pipelined)
+        controller.state.save_many(keys, values)
+        multi = serve(controller, batched)
+        print(f'{name:<18}{single * 1000:>10.1f}ms{multi * 1000:>10.1f}ms{single / multi:>9.1f}x')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,203 @@
+import sys
+import time
+import random
+import asyncio
+
+from app.bench.resp import encode_command
+from app.utils import RESPParser, key_hash_slot
+
+COMMANDS = ('GET', 'SET', 'INCR', 'XADD', 'XRANGE')
+READ_SIZE = 64 * 1024
+
+def parse_mix(value: str) -> dict[str, int]:
+    """Parse a command mix such as 'get=50,set=50' into weights by command name."""
+    mix = {}
+    for item in value.split(','):
+        name, _, weight = item.partition('=')
+        name = name.strip().upper()
+        if name not in COMMANDS:
+            raise ValueError(f"Unknown command '{name}' in mix, expected one of {', '.join(COMMANDS)}")
+        mix[name] = int(weight or 1)
+    return mix
+
+class Workload:
+    """
+    Commands of a run in the configured mix, on keys drawn uniformly from the key space,
+    or from its keys hashing to slots, the ones of a cluster node, when given.
+    """
+
+    def __init__(self, mix: dict[str, int], keyspace: int, value_size: int, seed: int = None, slots: range = None) -> None:
+        self.names = list(mix)
+        self.weights = list(mix.values())
+        self.keyspace = keyspace
+        self.value = b'x' * value_size
+        self.slots = slots
+        # streams are fewer than keys so XRANGE finds entries to read
+        streams = max(1, keyspace // 1000)
+        self.stream_keys = [key for key in (b'stream:%d' % i for i in range(streams * 100)) if self.owns(key)][:streams]
+        self.random = random.Random(seed)
+
+    def owns(self, key: bytes) -> bool:
+        return self.slots is None or key_hash_slot(key) in self.slots
+
+    def key(self, prefix: bytes) -> bytes:
+        while not self.owns(key := prefix + b'%d' % self.random.randrange(self.keyspace)):
+            pass
+        return key
+
+    def command(self, name: str) -> bytes:
+        if name == 'GET':
+            return encode_command(b'GET', self.key(b'key:'))
+        if name == 'SET':
+            return encode_command(b'SET', self.key(b'key:'), self.value)
+        if name == 'INCR':
+            return encode_command(b'INCR', self.key(b'counter:'))
+        stream = self.stream_keys[self.random.randrange(len(self.stream_keys))]
+        if name == 'XADD':
+            return encode_command(b'XADD', stream, b'*', b'field', self.value)
+        return encode_command(b'XRANGE', stream, b'-', b'+', b'COUNT', b'10')
+
+    def pipeline(self, depth: int) -> tuple[list[str], bytes]:
+        names = self.random.choices(self.names, self.weights, k=depth)
+        return names, b''.join(self.command(name) for name in names)
+
+class Stats:
+    """Latencies of every request by command, in seconds."""
+
+    def __init__(self) -> None:
+        self.latencies: dict[str, list[float]] = {}
+        self.errors = 0
+        self.elapsed = 0.0
+
+    def record(self, name: str, latency: float) -> None:
+        self.latencies.setdefault(name, []).append(latency)
+
+    @staticmethod
+    def percentile(values: list[float], percent: float) -> float:
+        return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+    def report(self) -> None:
+        total = sum(len(values) for values in self.latencies.values())
+        print(f'{total} requests in {self.elapsed:.2f}s, {total / self.elapsed:,.0f} ops/sec, {self.errors} errors')
+        print(f"{'command':<10}{'requests':>10}{'ops/sec':>12}{'p50':>10}{'p99':>10}{'p99.9':>10}{'max':>10}  (ms)")
+        everything = []
+        for name, values in sorted(self.latencies.items()) + [('ALL', everything)]:
+            if name != 'ALL':
+                everything += values
+            values.sort()
+            print(f'{name:<10}{len(values):>10}{len(values) / self.elapsed:>12,.0f}'
+                  f'{Stats.percentile(values, 50) * 1000:>10.3f}{Stats.percentile(values, 99) * 1000:>10.3f}'
+                  f'{Stats.percentile(values, 99.9) * 1000:>10.3f}{values[-1] * 1000:>10.3f}')
+
+def reply_end(buffer: bytearray, pos: int) -> int:
+    """Offset just past the RESP reply starting at pos, -1 while it is not complete."""
+    end = buffer.find(b'\r\n', pos)
+    if end == -1:
+        return -1
+    kind = buffer[pos]
+    if kind == 0x24:  # '$'
+        length = int(buffer[pos + 1:end])
+        end = end + 2 if length < 0 else end + length + 4
+        return end if end <= len(buffer) else -1
+    if kind == 0x2a:  # '*'
+        count = int(buffer[pos + 1:end])
+        pos = end + 2
+        for _ in range(count):
+            pos = reply_end(buffer, pos)
+            if pos == -1:
+                return -1
+        return pos
+    return end + 2
+
+async def run_client(host: str, port: int, workload: Workload, plan: list, depth: int, stats: Stats) -> None:
+    reader, writer = await asyncio.open_connection(host, port)
+    buffer = bytearray()
+    while plan[0] > 0:
+        count = min(depth, plan[0])
+        plan[0] -= count
+        names, payload = workload.pipeline(count)
+
+        start = time.perf_counter()
+        writer.write(payload)
+        pos, received = 0, 0
+        while received < count:
+            data = await reader.read(READ_SIZE)
+            if not data:
+                raise ConnectionError('Server closed the connection')
+            buffer += data
+            now = time.perf_counter()
+            # every reply completed by this read is stamped with its arrival
+            while received < count and (end := reply_end(buffer, pos)) != -1:
+                stats.errors += buffer[pos] == 0x2d  # '-'
+                stats.record(names[received], now - start)
+                pos, received = end, received + 1
+        del buffer[:pos]
+    writer.close()
+
+async def cluster_nodes(host: str, port: int) -> list[tuple[str, int, range]]:
+    """Address and slots of each node of the cluster the node at host:port belongs to, from CLUSTER SLOTS."""
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(encode_command(b'CLUSTER', b'SLOTS'))
+    buffer = bytearray()
+    while (end := reply_end(buffer, 0)) == -1:
+        data = await reader.read(READ_SIZE)
+        if not data:
+            raise ConnectionError('Server closed the connection')
+        buffer += data
+    writer.close()
+    if buffer[:1] == b'-':
+        raise ConnectionError(buffer[1:end - 2].decode())
+    (slots, _), = RESPParser.decode(bytes(buffer[:end]))[0]
+    return [(node_host.decode(), node_port, range(start, end_slot + 1)) for start, end_slot, [node_host, node_port, *_] in slots]
+
+async def run_server(host: str, port: int, workload: Workload, clients: int, requests: int, depth: int, cluster: bool = False) -> Stats:
+    """
+    Drive a running server from concurrent connections, sharing one budget of requests.
+    With cluster, the clients are spread over the nodes, each sending the keys of its node's slots only.
+    """
+    stats, plan = Stats(), [requests]
+    targets = [(host, port, workload)] * clients
+    if cluster:
+        nodes = await cluster_nodes(host, port)
+        workloads = [Workload(dict(zip(workload.names, workload.weights)), workload.keyspace, len(workload.value),
+                              workload.random.random(), slots) for _, _, slots in nodes]
+        targets = [(*nodes[i % len(nodes)][:2], workloads[i % len(nodes)]) for i in range(clients)]
+    start = time.perf_counter()
+    await asyncio.gather(*(run_client(node_host, node_port, node_workload, plan, depth, stats)
+                           for node_host, node_port, node_workload in targets))
+    stats.elapsed = time.perf_counter() - start
+    return stats
+
+def run_in_process(workload: Workload, clients: int, requests: int, depth: int) -> Stats:
+    """
+    Drive process_command directly, without sockets: each client's pipelines go through its own
+    controller's reader, the command table and its output buffer, clients taking turns.
+    """
+    # State parses the server's command line
+    del sys.argv[1:]
+    from app.context import State
+    from app.controllers import BaseController
+
+    state = State()
+    controllers = [BaseController(state) for _ in range(clients)]
+    stats, remaining = Stats(), requests
+    start = time.perf_counter()
+    while remaining > 0:
+        for controller in controllers:
+            count = min(depth, remaining)
+            if count == 0:
+                break
+            remaining -= count
+            names, payload = workload.pipeline(count)
+
+            batch_start = time.perf_counter()
+            controller.parser.feed(payload)
+            for args, _ in controller.parser.read_commands():
+                for reply in controller.process_command(controller.decode_command(args)):
+                    controller.output.write(reply)
+            controller.output.drain()
+            latency = time.perf_counter() - batch_start
+            for name in names:
+                stats.record(name, latency)
+    stats.elapsed = time.perf_counter() - start
+    return stats
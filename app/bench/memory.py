@@ -0,0 +1,44 @@
+import sys
+import time
+import tracemalloc
+
+from app.context.store import Store
+
+def counters(keys: int, max_value: int = 1000):
+    return ((b'counter:%d' % i, b'%d' % (i % max_value)) for i in range(keys))
+
+def tuple_layout(keys: int) -> dict:
+    # every key mapped to a (value, ttl) tuple, TTL-less keys carrying None
+    return {key: (value, None) for key, value in counters(keys)}
+
+def bytes_layout(keys: int) -> dict:
+    return {key: value for key, value in counters(keys)}
+
+def encoded_layout(keys: int) -> Store:
+    store = Store()
+    for key, value in counters(keys):
+        store.save(key, value)
+    return store
+
+def measure(build, keys: int) -> tuple[float, float]:
+    """Bytes allocated per key by build, and the seconds it took."""
+    tracemalloc.start()
+    start = time.perf_counter()
+    keyspace = build(keys)
+    elapsed = time.perf_counter() - start
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del keyspace
+    return size / keys, elapsed
+
+def main():
+    keys = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    print(f'{keys} counter keys with values below 1000')
+    baseline = None
+    for name, build in (('(value, ttl) tuples', tuple_layout), ('bytes values', bytes_layout), ('integer encoded', encoded_layout)):
+        per_key, elapsed = measure(build, keys)
+        baseline = baseline or per_key
+        print(f'{name:<22}{per_key:>8.1f} bytes/key{1 - per_key / baseline:>8.1%} saved{elapsed:>8.2f}s')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+import os
+import time
+import tempfile
+
+from app.bench.resp import set_pipeline
+from app.context.stream import Stream
+from app.utils import RDBParser, RDBWriter, RESPParser, RESPReader, RESPWriter
+
+REPEAT = 5
+
+def best_of(fn, repeat: int = REPEAT) -> float:
+    """Fastest of repeat runs, the one least disturbed by the rest of the machine."""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def replies(count: int) -> list:
+    # the shapes GET, INCR and XRANGE reply with
+    entry = [b'1700000000000-0', [b'field', b'value']]
+    return [[b'x' * 16, count, [entry] * 10][i % 3] for i in range(count)]
+
+def rdb_file(directory: str, keys: int) -> str:
+    path = os.path.join(directory, 'dump.rdb')
+    stream = Stream()
+    for i in range(1000):
+        stream.append((1700000000000 + i, 0), [b'field', b'value:%d' % i])
+    items = [(b'key:%d' % i, b'value:%d' % i if i % 2 else i) for i in range(keys)] + [(b'stream', stream)]
+    RDBWriter.dump(path, items, {})
+    return path
+
+def parse_rdb(path: str) -> int:
+    data = RDBParser.read_rdb(path)
+    try:
+        return sum(1 for _ in RDBParser().parse(data))
+    finally:
+        data.close()
+
+def run(count: int = 10_000, keys: int = 100_000) -> None:
+    pipeline = set_pipeline(count)
+    values = replies(count)
+
+    def read_commands():
+        reader = RESPReader()
+        reader.feed(pipeline)
+        reader.read_commands()
+
+    def write_replies():
+        writer = RESPWriter()
+        for value in values:
+            writer.write(value)
+        writer.drain()
+
+    benchmarks = [
+        ('RESPParser.decode', count, lambda: RESPParser.decode(pipeline)),
+        ('RESPReader.read_commands', count, read_commands),
+        ('RESPParser.encode', count, lambda: [RESPParser.encode(value) for value in values]),
+        ('RESPWriter.write', count, write_replies),
+    ]
+    with tempfile.TemporaryDirectory() as directory:
+        path = rdb_file(directory, keys)
+        benchmarks.append(('RDBParser.parse', keys + 1, lambda: parse_rdb(path)))
+
+        print(f"{'benchmark':<28}{'ops':>10}{'best':>12}{'ops/sec':>14}{'ns/op':>10}")
+        for name, ops, fn in benchmarks:
+            elapsed = best_of(fn)
+            print(f'{name:<28}{ops:>10}{elapsed * 1000:>10.2f}ms{ops / elapsed:>14,.0f}{elapsed / ops * 1e9:>10.0f}')
@@ -0,0 +1,48 @@
+import os
+import sys
+import time
+import tempfile
+
+from app.utils import RDBWriter
+
+def dataset(keys: int, value_size: int = 16) -> dict:
+    value = b'x' * value_size
+    return {b'key:%d' % i: value for i in range(keys)}
+
+def expires_for(store: dict, every: int = 10) -> dict:
+    # one key in `every` carries a TTL
+    expire_at = int(time.time() * 1000) + 3_600_000
+    return {key: expire_at for i, key in enumerate(store) if i % every == 0}
+
+def dump(store: dict, expires: dict, path: str, checksum: bool) -> tuple[float, int]:
+    start = time.perf_counter()
+    RDBWriter.dump(path, store.items(), expires, checksum=checksum)
+    return time.perf_counter() - start, os.path.getsize(path)
+
+def fork_latency(store: dict, path: str) -> float:
+    """Time the parent is blocked forking a child that writes the snapshot, as BGSAVE does."""
+    start = time.perf_counter()
+    pid = os.fork()
+    if pid == 0:
+        RDBWriter.dump(path, store.items(), {})
+        os._exit(0)
+    elapsed = time.perf_counter() - start
+    os.waitpid(pid, 0)
+    return elapsed
+
+def main():
+    keys = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    store = dataset(keys)
+    expires = expires_for(store)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'dump.rdb')
+        print(f'{keys} keys, {len(expires)} with a TTL')
+        for checksum in (False, True):
+            elapsed, size = dump(store, expires, path, checksum)
+            print(f"SAVE checksum={'yes' if checksum else 'no':<4}{elapsed:>8.2f}s"
+                  f"{keys / elapsed:>12,.0f} keys/s{size / elapsed / 2**20:>8.1f} MB/s ({size / 2**20:.1f} MB)")
+        print(f'BGSAVE fork latency {fork_latency(store, path) * 1000:.2f}ms')
+
+if __name__ == '__main__':
+    main()
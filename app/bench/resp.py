@@ -0,0 +1,56 @@
+import time
+
+from app.utils import RESPParser, RESPReader
+
+READ_SIZE = 8000
+
+def encode_command(*args: bytes) -> bytes:
+    return b''.join([b'*%d\r\n' % len(args), *(b'$%d\r\n%s\r\n' % (len(arg), arg) for arg in args)])
+
+def set_pipeline(count: int, value_size: int = 16) -> bytes:
+    value = b'x' * value_size
+    return b''.join(encode_command(b'SET', b'key:%d' % i, value) for i in range(count))
+
+def chunks(payload: bytes, size: int = READ_SIZE):
+    return [payload[i:i + size] for i in range(0, len(payload), size)]
+
+def decode_with_resp_parser(reads: list) -> int:
+    buffer, decoded = b'', 0
+    for data in reads:
+        buffer += data
+        commands, buffer = RESPParser.decode(buffer)
+        decoded += len(commands)
+    return decoded
+
+def decode_with_resp_reader(reads: list) -> int:
+    reader, decoded = RESPReader(), 0
+    for data in reads:
+        reader.feed(data)
+        decoded += len(reader.read_commands())
+    return decoded
+
+def timed(fn, reads: list) -> tuple[float, int]:
+    start = time.perf_counter()
+    decoded = fn(reads)
+    return time.perf_counter() - start, decoded
+
+def run(workloads: dict) -> None:
+    print(f"{'workload':<28}{'RESPParser':>14}{'RESPReader':>14}{'speedup':>10}")
+    for name, payload in workloads.items():
+        reads = chunks(payload)
+        old, old_count = timed(decode_with_resp_parser, reads)
+        new, new_count = timed(decode_with_resp_reader, reads)
+        assert old_count == new_count, f'{name}: decoded {old_count} vs {new_count} commands'
+        print(f'{name:<28}{old * 1000:>12.1f}ms{new * 1000:>12.1f}ms{old / new:>9.1f}x')
+
+def main():
+    run({
+        '1k SET pipeline': set_pipeline(1_000),
+        '10k SET pipeline': set_pipeline(10_000),
+        '100k SET pipeline': set_pipeline(100_000),
+        'SET 1MB value': encode_command(b'SET', b'big', b'x' * 1_000_000),
+        'SET 4MB value': encode_command(b'SET', b'big', b'x' * 4_000_000),
+    })
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+import time
+import random
+import asyncio
+
+from app.bench.load import READ_SIZE, Stats, reply_end
+from app.bench.resp import encode_command
+from app.utils import RESPParser
+
+async def read_replies(reader: asyncio.StreamReader, buffer: bytearray, count: int) -> list[bytes]:
+    replies, pos = [], 0
+    while len(replies) < count:
+        end = reply_end(buffer, pos)
+        if end == -1:
+            data = await reader.read(READ_SIZE)
+            if not data:
+                raise ConnectionError('Server closed the connection')
+            buffer += data
+            continue
+        replies.append(bytes(buffer[pos:end]))
+        pos = end
+    del buffer[:pos]
+    return replies
+
+async def run_client(host: str, port: int, keys: list, plan: list, aborts: list, stats: Stats, seed: float) -> None:
+    """
+    Increment random counters as a client without INCR would: WATCH the key, GET it, then SET it to
+    the value plus one in MULTI/EXEC, starting over when EXEC aborts because another client got there first.
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    rng, buffer = random.Random(seed), bytearray()
+    while plan[0] > 0:
+        plan[0] -= 1
+        key = keys[rng.randrange(len(keys))]
+        start = time.perf_counter()
+        while True:
+            writer.write(encode_command(b'WATCH', key) + encode_command(b'GET', key))
+            _, value = await read_replies(reader, buffer, 2)
+            count = 0 if value == b'$-1\r\n' else int(value.split(b'\r\n')[1])
+            writer.write(encode_command(b'MULTI') + encode_command(b'SET', key, b'%d' % (count + 1)) + encode_command(b'EXEC'))
+            *_, result = await read_replies(reader, buffer, 3)
+            if result != b'*-1\r\n':
+                stats.errors += result[:1] == b'-'
+                break
+            aborts[0] += 1
+        stats.record('INCR', time.perf_counter() - start)
+    writer.close()
+
+async def send_command(host: str, port: int, *args: bytes) -> bytes:
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(encode_command(*args))
+    reply, = await read_replies(reader, bytearray(), 1)
+    writer.close()
+    return reply
+
+async def run_server(host: str, port: int, clients: int, increments: int, counters: int, seed: int = None) -> None:
+    """
+    Contention benchmark of optimistic transactions: clients incrementing counters through WATCH and
+    MULTI/EXEC, the fewer the counters the more transactions abort. The counters must add up to the
+    increments made, a lost update would mean a transaction ran over a concurrent write.
+    """
+    keys = [b'watch:counter:%d' % i for i in range(counters)]
+    await send_command(host, port, b'DEL', *keys)
+
+    rng = random.Random(seed)
+    stats, plan, aborts = Stats(), [increments], [0]
+    start = time.perf_counter()
+    await asyncio.gather(*(run_client(host, port, keys, plan, aborts, stats, rng.random()) for _ in range(clients)))
+    stats.elapsed = time.perf_counter() - start
+
+    (values, _), = RESPParser.decode(await send_command(host, port, b'MGET', *keys))[0]
+    total = sum(int(value) for value in values if value is not None)
+    print(f'{increments} increments of {counters} counters from {clients} clients to {host}:{port}, WATCH, GET, MULTI, SET, EXEC')
+    stats.report()
+    print(f'{aborts[0]} aborted EXECs, {aborts[0] / (increments + aborts[0]):.1%} of the transactions, '
+          f'{(increments + aborts[0]) / increments:.2f} attempts per increment')
+    print(f'counters total {total}, ' + ('no lost update' if total == increments else f'{increments - total} LOST UPDATES'))
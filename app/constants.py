@@ -1,9 +1,14 @@
+from app.utils.resp_writer import RawReply
+
 class Constants:
     PING = 'PING'
     ECHO = 'ECHO'
     GET = 'GET'
     SET = 'SET'
     DEL = 'DEL'
+    MGET = 'MGET'
+    MSET = 'MSET'
+    EXISTS = 'EXISTS'
     CONFIG = 'CONFIG'
     KEYS = 'KEYS'
     INFO = 'INFO'
@@ -12,32 +17,118 @@ class Constants:
     PYSNC = 'PSYNC'
     LISTENING_PORT = 'listening-port'
     REPLICATION = 'replication'
-    PX = 'px'
+    PX = 'PX'
+    EX = 'EX'
+    PXAT = 'PXAT'
+    EXAT = 'EXAT'
     CAPABILITY = 'capa'
     MASTER = 'master'
     SLAVE = 'slave'
+    ASYNCIO = 'asyncio'
+    THREADED = 'threaded'
     GETACK = 'GETACK'
     ACK = 'ACK'
     WAIT = 'WAIT'
     XADD = 'XADD'
     XRANGE = 'XRANGE'
+    XREVRANGE = 'XREVRANGE'
     XREAD = 'XREAD'
-    BLOCK = 'block'
+    BLOCK = 'BLOCK'
+    STREAMS = 'STREAMS'
     INCR = 'INCR'
+    INCRBY = 'INCRBY'
+    DECR = 'DECR'
+    DECRBY = 'DECRBY'
+    MEMORY = 'MEMORY'
+    USAGE = 'USAGE'
+    SAMPLES = 'SAMPLES'
+    SLOWLOG = 'SLOWLOG'
+    LATENCY = 'LATENCY'
+    HISTOGRAM = 'HISTOGRAM'
+    RESET = 'RESET'
+    LEN = 'LEN'
     MULTI = 'MULTI'
     EXEC = 'EXEC'
     DISCARD = 'DISCARD'
-    QUEUED = b'+QUEUED\r\n'
-    OK = b'+OK\r\n'
-    NULL = b'$-1\r\n'
-    EMPTY_RDB = b'$88\r\nREDIS0011\xfa\tredis-ver\x057.2.0\xfa\nredis-bits\xc0@\xfa\x05ctime\xc2m\x08\xbce\xfa\x08used-mem\xc2\xb0\xc4\x10\x00\xfa\x08aof-base\xc0\x00\xff\xf0n;\xfe\xc0\xffZ\xa2'
-    ERROR_MIN_STREAM_ID = b'-ERR The ID specified in XADD must be greater than 0-0\r\n'
-    ERROR_STREAM_KEY = b'-ERR The ID specified in XADD is equal or smaller than the target stream top item\r\n'
-    ERROR_NON_INT = b'-ERR value is not an integer or out of range\r\n'
-    ERROR_EXEC = b'-ERR EXEC without MULTI\r\n'
-    ERROR_DISCARD = b'-ERR DISCARD without MULTI\r\n'
+    WATCH = 'WATCH'
+    UNWATCH = 'UNWATCH'
+    COMMAND = 'COMMAND'
+    SAVE = 'SAVE'
+    BGSAVE = 'BGSAVE'
+    LASTSAVE = 'LASTSAVE'
+    BGREWRITEAOF = 'BGREWRITEAOF'
+    COUNT = 'COUNT'
+    SCAN = 'SCAN'
+    MATCH = 'MATCH'
+    CLUSTER = 'CLUSTER'
+    SLOTS = 'SLOTS'
+    SHARDS = 'SHARDS'
+    NODES = 'NODES'
+    MYID = 'MYID'
+    KEYSLOT = 'KEYSLOT'
+    COUNTKEYSINSLOT = 'COUNTKEYSINSLOT'
+    GETKEYSINSLOT = 'GETKEYSINSLOT'
+    CLIENT = 'CLIENT'
+    ID = 'ID'
+    GETNAME = 'GETNAME'
+    SETNAME = 'SETNAME'
+    LIST = 'LIST'
+    KILL = 'KILL'
+    ADDR = 'ADDR'
+    LADDR = 'LADDR'
+    SKIPME = 'SKIPME'
+    MAXAGE = 'MAXAGE'
+    YES = 'YES'
+    NO = 'NO'
+    QUEUED = RawReply(b'+QUEUED\r\n')
+    OK = RawReply(b'+OK\r\n')
+    PONG = RawReply(b'+PONG\r\n')
+    NULL = RawReply(b'$-1\r\n')
+    NULL_ARRAY = RawReply(b'*-1\r\n')
+    BGSAVE_STARTED = RawReply(b'+Background saving started\r\n')
+    BGREWRITEAOF_STARTED = RawReply(b'+Background append only file rewriting started\r\n')
+    BGREWRITEAOF_SCHEDULED = RawReply(b'+Background append only file rewriting scheduled\r\n')
+    ERROR_MIN_STREAM_ID = RawReply(b'-ERR The ID specified in XADD must be greater than 0-0\r\n')
+    ERROR_STREAM_KEY = RawReply(b'-ERR The ID specified in XADD is equal or smaller than the target stream top item\r\n')
+    ERROR_STREAM_ID = RawReply(b'-ERR Invalid stream ID specified as stream command argument\r\n')
+    ERROR_XREAD_STREAMS = RawReply(b"-ERR Unbalanced 'xread' list of streams: for each stream key an ID or '$' must be specified.\r\n")
+    ERROR_NON_INT = RawReply(b'-ERR value is not an integer or out of range\r\n')
+    ERROR_OVERFLOW = RawReply(b'-ERR increment or decrement would overflow\r\n')
+    ERROR_WRONGTYPE = RawReply(b'-WRONGTYPE Operation against a key holding the wrong kind of value\r\n')
+    ERROR_EXEC = RawReply(b'-ERR EXEC without MULTI\r\n')
+    ERROR_DISCARD = RawReply(b'-ERR DISCARD without MULTI\r\n')
+    ERROR_NESTED_MULTI = RawReply(b'-ERR MULTI calls can not be nested\r\n')
+    ERROR_WATCH_IN_MULTI = RawReply(b'-ERR WATCH inside MULTI is not allowed\r\n')
+    ERROR_EXECABORT = RawReply(b'-EXECABORT Transaction discarded because of previous errors.\r\n')
+    ERROR_INVALID_CURSOR = RawReply(b'-ERR invalid cursor\r\n')
+    ERROR_SYNTAX = RawReply(b'-ERR syntax error\r\n')
+    ERROR_BGSAVE_IN_PROGRESS = RawReply(b'-ERR Background save already in progress\r\n')
+    ERROR_SAVE = RawReply(b'-ERR Error saving DB on disk, check the server logs\r\n')
+    ERROR_BGSAVE_AOF_REWRITE = RawReply(b"-ERR Another child process is active (AOF?): can't BGSAVE right now.\r\n")
+    ERROR_BGREWRITEAOF_IN_PROGRESS = RawReply(b'-ERR Background append only file rewriting already in progress\r\n')
+    ERROR_BGREWRITEAOF = RawReply(b"-ERR Can't execute an AOF background rewriting. Please check the server logs for more information.\r\n")
+    ERROR_LOADING = RawReply(b'-LOADING Redis is loading the dataset in memory\r\n')
+    ERROR_OOM = RawReply(b"-OOM command not allowed when used memory > 'maxmemory'.\r\n")
+    ERROR_NEGATIVE_TIMEOUT = RawReply(b'-ERR timeout is negative\r\n')
+    ERROR_CROSSSLOT = RawReply(b"-CROSSSLOT Keys in request don't hash to the same slot\r\n")
+    ERROR_CLUSTER_DISABLED = RawReply(b'-ERR This instance has cluster support disabled\r\n')
+    ERROR_INVALID_SLOT = RawReply(b'-ERR Invalid or out of range slot\r\n')
+    ERROR_INVALID_CLIENT_ID = RawReply(b'-ERR client-id should be greater than 0\r\n')
+    ERROR_NO_SUCH_CLIENT = RawReply(b'-ERR No such client\r\n')
+    ERROR_CLIENT_NAME = RawReply(b'-ERR Client names cannot contain spaces, newlines or special characters.\r\n')
 
 class ValueTypes:
     STRING = 'string'
     STREAM = 'stream'
-    NONE = 'none'
\ No newline at end of file
+    NONE = 'none'
+
+class CommandFlags:
+    WRITE = 'write'
+    READONLY = 'readonly'
+    DENYOOM = 'denyoom'
+    ADMIN = 'admin'
+    BLOCKING = 'blocking'
+    FAST = 'fast'
+    LOADING = 'loading'
+    STALE = 'stale'
+    MOVABLE_KEYS = 'movablekeys'
\ No newline at end of file
@@ -0,0 +1,235 @@
+import os
+import time
+import threading
+
+from app.constants import Constants
+from app.context.stream import Stream, format_id
+from app.utils import RESPReader, RESPWriter
+
+class AppendOnlyFile:
+    """
+    The append only file: every write command, in RESP, in the order it was executed.
+
+    Commands are buffered as they execute and written before the replies go out. With
+    appendfsync always that write is fsynced too, once for all the commands buffered by then,
+    with everysec a background thread fsyncs once per second, with no the OS decides.
+    """
+
+    FSYNC_ALWAYS = 'always'
+    FSYNC_EVERYSEC = 'everysec'
+    FSYNC_NO = 'no'
+    READ_SIZE = 64 * 1024
+    REWRITE_BATCH = 64 * 1024
+
+    def __init__(self):
+        self.aof_file = None
+        self.aof_buffer = bytearray()
+        self.aof_buffer_lock = threading.Lock()
+        # serializes writes, fsyncs and the swap to a rewritten file
+        self.aof_write_lock = threading.Lock()
+        # held across each background fsync, so the file is not closed under it
+        self.aof_fsync_lock = threading.Lock()
+        self.aof_fsync_pending = False
+        self.aof_last_fsync = time.time()
+        self.aof_last_write_ok = True
+        self.aof_child_pid = None
+        self.aof_rewrite_buffer = None
+        self.aof_rewrite_scheduled = False
+        self.aof_rewrite_time_start = 0
+        self.aof_last_bgrewrite_ok = True
+
+    def aof_path(self) -> str:
+        return os.path.join(self.config['dir'], self.config['appendfilename'])
+
+    def open_append_only_file(self) -> None:
+        self.aof_file = open(self.aof_path(), 'ab')
+        if self.config['appendfsync'] == AppendOnlyFile.FSYNC_EVERYSEC:
+            threading.Thread(target=self.run_aof_fsync, daemon=True).start()
+
+    def feed_append_only_file(self, data: bytes) -> None:
+        with self.aof_buffer_lock:
+            self.aof_buffer += data
+            # a rewrite in progress only sees the keyspace as it was when it forked
+            if self.aof_rewrite_buffer is not None:
+                self.aof_rewrite_buffer += data
+
+    def flush_append_only_file(self) -> None:
+        """Write the buffered commands, called before replies are sent so clients never see an unlogged write."""
+        if not self.aof_buffer:
+            return
+
+        with self.aof_write_lock:
+            with self.aof_buffer_lock:
+                data, self.aof_buffer = self.aof_buffer, bytearray()
+            if not data:
+                return
+
+            try:
+                self.aof_file.write(data)
+                self.aof_file.flush()
+                if self.config['appendfsync'] == AppendOnlyFile.FSYNC_ALWAYS:
+                    os.fsync(self.aof_file.fileno())
+                else:
+                    self.aof_fsync_pending = True
+                self.aof_last_write_ok = True
+            except OSError as e:
+                print(f'Error writing to the AOF file: {e}')
+                self.aof_last_write_ok = False
+
+    def run_aof_fsync(self) -> None:
+        # one fsync per second covers every write made by every client in that second
+        while True:
+            time.sleep(1)
+            if not self.aof_fsync_pending:
+                continue
+            with self.aof_fsync_lock:
+                self.aof_fsync_pending = False
+                try:
+                    os.fsync(self.aof_file.fileno())
+                    self.aof_last_fsync = time.time()
+                except OSError as e:
+                    print(f'Error fsyncing the AOF file: {e}')
+
+    def load_append_only_file(self, execute) -> int:
+        """
+        Replay the AOF at startup. A truncated last command is dropped and the file cut before it.
+        :param execute: Called with the arguments of each command.
+        :return: Number of commands replayed.
+        """
+        path = self.aof_path()
+        if not os.path.exists(path):
+            return 0
+
+        reader = RESPReader()
+        commands, valid_length = 0, 0
+        self.loading_total_bytes = os.path.getsize(path)
+        with open(path, 'rb') as file:
+            while data := file.read(AppendOnlyFile.READ_SIZE):
+                reader.feed(data)
+                for args, bytes_processed in reader.read_commands():
+                    valid_length += bytes_processed
+                    if args:
+                        execute(args)
+                        commands += 1
+                self.loading_loaded_bytes = valid_length
+
+        size = os.path.getsize(path)
+        if valid_length < size:
+            print(f'AOF {path} ends with a truncated command, discarding the last {size - valid_length} bytes')
+            os.truncate(path, valid_length)
+        print(f'Finished replaying AOF with {commands} commands')
+        return commands
+
+    def rewrite_append_only_file(self, path: str) -> None:
+        """Write the commands that rebuild the current keyspace to path."""
+        now = time.time() * 1000
+        with open(path, 'wb') as file:
+            batch = bytearray()
+            for key, value in self.store.items():
+                ttl = self.expires.get(key)
+                if ttl is not None and ttl < now:
+                    continue
+
+                if isinstance(value, Stream):
+                    for i in range(len(value)):
+                        batch += RESPWriter.encode_command([Constants.XADD, key, format_id((value.ms[i], value.seqs[i])), *value.fields[i]])
+                else:
+                    command = [Constants.SET, key, value]
+                    if ttl is not None:
+                        command += [Constants.PXAT, str(int(ttl))]
+                    batch += RESPWriter.encode_command(command)
+
+                if len(batch) >= AppendOnlyFile.REWRITE_BATCH:
+                    file.write(batch)
+                    batch = bytearray()
+            file.write(batch)
+            file.flush()
+            os.fsync(file.fileno())
+
+    def temp_rewrite_path(self, pid: int) -> str:
+        return os.path.join(self.config['dir'], f'temp-rewriteaof-bg-{pid}.aof')
+
+    def bgrewriteaof(self) -> bool:
+        """
+        Fork a child that rewrites the AOF from the keyspace. Commands executed meanwhile are
+        kept in the rewrite buffer and appended to the new file before it replaces the old one.
+        :return: False when the fork failed.
+        """
+        with self.aof_buffer_lock:
+            self.aof_rewrite_buffer = bytearray()
+        try:
+            pid = os.fork()
+        except OSError as e:
+            print(f"Can't rewrite append only file in background: fork: {e}")
+            self.aof_rewrite_buffer = None
+            self.aof_last_bgrewrite_ok = False
+            return False
+
+        if pid == 0:
+            code = 0
+            try:
+                self.rewrite_append_only_file(self.temp_rewrite_path(os.getpid()))
+            except BaseException as e:
+                print(f'Error rewriting the AOF: {e}')
+                code = 1
+            os._exit(code)
+
+        self.aof_child_pid = pid
+        self.aof_rewrite_scheduled = False
+        self.aof_rewrite_time_start = time.time()
+        return True
+
+    def check_aof_child_done(self) -> None:
+        pid, status = os.waitpid(self.aof_child_pid, os.WNOHANG)
+        if pid == 0:
+            return
+
+        temp_path = self.temp_rewrite_path(pid)
+        self.aof_child_pid = None
+        self.aof_last_bgrewrite_ok = os.waitstatus_to_exitcode(status) == 0
+        if not self.aof_last_bgrewrite_ok:
+            self.aof_rewrite_buffer = None
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return
+
+        with self.aof_write_lock, self.aof_fsync_lock:
+            with self.aof_buffer_lock:
+                # the commands buffered but not yet written are in the rewrite buffer as well
+                data, self.aof_rewrite_buffer = self.aof_rewrite_buffer, None
+                pending, self.aof_buffer = self.aof_buffer, bytearray()
+            try:
+                with open(temp_path, 'ab') as file:
+                    file.write(data)
+                    file.flush()
+                    os.fsync(file.fileno())
+                os.replace(temp_path, self.aof_path())
+            except OSError as e:
+                print(f'Error finishing the AOF rewrite: {e}')
+                self.aof_last_bgrewrite_ok = False
+                with self.aof_buffer_lock:
+                    self.aof_buffer[:0] = pending
+                return
+            # with appendonly no the rewrite only writes the file, as in Redis, there is none to reopen
+            if self.aof_file is not None:
+                self.aof_file.close()
+                self.aof_file = open(self.aof_path(), 'ab')
+        print('Background AOF rewrite finished successfully')
+
+    def aof_cron(self) -> None:
+        if self.aof_child_pid is not None:
+            self.check_aof_child_done()
+        elif self.aof_rewrite_scheduled and self.rdb_child_pid is None:
+            self.bgrewriteaof()
+
+    def get_aof_info(self) -> str:
+        in_progress = self.aof_child_pid is not None
+        return ''.join([
+            f'aof_enabled:{int(self.aof_file is not None)}\r\n',
+            f'aof_rewrite_in_progress:{int(in_progress)}\r\n',
+            f'aof_rewrite_scheduled:{int(self.aof_rewrite_scheduled)}\r\n',
+            f'aof_current_rewrite_time_sec:{int(time.time() - self.aof_rewrite_time_start) if in_progress else -1}\r\n',
+            f'aof_last_bgrewrite_status:{"ok" if self.aof_last_bgrewrite_ok else "err"}\r\n',
+            f'aof_last_write_status:{"ok" if self.aof_last_write_ok else "err"}\r\n',
+            f'aof_current_size:{self.aof_file.tell() if self.aof_file else 0}\r\n',
+        ])
@@ -0,0 +1,70 @@
+import time
+import threading
+
+# classes with output buffer limits of their own, as Redis's client-output-buffer-limit
+CLIENT_CLASSES = ('normal', 'replica', 'pubsub')
+
+class Clients:
+    """
+    The connected clients by ID, for CLIENT LIST and CLIENT KILL, and the limits on their output buffers.
+
+    A client that does not read its replies holds them in memory, a slow replica the whole replication
+    stream. As Redis does, each class of clients has a hard limit, over which the client is disconnected
+    right away, and a soft limit, over which it is disconnected once it stayed there for some seconds.
+    """
+
+    def __init__(self):
+        self.clients = {}
+        self.next_client_id = 1
+        # clients connect and disconnect from their own threads in the threaded model
+        self.clients_lock = threading.Lock()
+        self.client_output_buffer_limit_disconnections = 0
+
+    def link_client(self, client) -> None:
+        with self.clients_lock:
+            client.id = self.next_client_id
+            self.next_client_id += 1
+            self.clients[client.id] = client
+
+    def unlink_client(self, client) -> None:
+        with self.clients_lock:
+            self.clients.pop(client.id, None)
+
+    def get_clients(self) -> list:
+        with self.clients_lock:
+            return list(self.clients.values())
+
+    def check_output_buffer_limits(self, client) -> bool:
+        """
+        Kill a client whose output buffer is over the hard limit of its class, or was over the soft
+        limit for longer than the soft seconds, as Redis's checkClientOutputBufferLimits.
+        :return: True when the client was killed.
+        """
+        # the link to the master is limited as a normal client, as in Redis
+        limit_class = 'replica' if client.talking_to_replica else 'normal'
+        hard, soft, seconds = self.config['client_output_buffer_limit'][limit_class]
+        if not hard and not soft or client.killed:
+            return False
+
+        size = client.output_buffer_size()
+        reached = hard and size >= hard
+        if soft and size >= soft:
+            now = time.monotonic()
+            # the soft limit counts from the first time it is seen reached
+            if not client.obuf_soft_limit_reached_time:
+                client.obuf_soft_limit_reached_time = now
+            elif now - client.obuf_soft_limit_reached_time > seconds:
+                reached = True
+        else:
+            client.obuf_soft_limit_reached_time = 0
+
+        if reached:
+            self.client_output_buffer_limit_disconnections += 1
+            print(f'Client {client.client_info()} closed for overcoming of output buffer limits.')
+            client.kill()
+        return bool(reached)
+
+    def clients_cron(self) -> None:
+        # clients stalled in a write never reach the checks on their replies, the soft limits need a clock
+        for client in self.get_clients():
+            self.check_output_buffer_limits(client)
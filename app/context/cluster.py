@@ -0,0 +1,105 @@
+import hashlib
+from array import array
+
+from app.constants import Constants
+from app.utils import CLUSTER_SLOTS, RawReply, key_hash_slot
+
+class ClusterNode:
+    """A master of the local cluster and the range of slots it serves."""
+
+    __slots__ = ('id', 'host', 'port', 'start', 'end')
+
+    def __init__(self, host: str, port: int, start: int, end: int) -> None:
+        # stable across restarts, as the topology is derived from the command line
+        self.id = hashlib.sha1(f'{host}:{port}'.encode()).hexdigest()
+        self.host = host
+        self.port = port
+        self.start = start
+        self.end = end
+
+    def address(self) -> str:
+        return f'{self.host}:{self.port}'
+
+class Cluster:
+    """
+    Cluster mode over processes on one host: the node at index i of cluster_workers listens on
+    port + i and owns the i-th share of the 16384 hash slots. Every node derives the same
+    topology from its command line, so no gossip is needed, and replies -MOVED to commands whose
+    keys hash to a slot it does not own, -CROSSSLOT when they hash to more than one slot.
+    """
+
+    def __init__(self):
+        self.cluster_nodes: list[ClusterNode] = []
+        self.cluster_myself: ClusterNode = None
+        # index in cluster_nodes of the owner of each slot, None outside cluster mode
+        self.cluster_slot_owner = None
+
+    def configure_cluster(self) -> None:
+        if not self.config['cluster_enabled']:
+            return
+        count, index = self.config['cluster_workers'], self.config['cluster_node'] or 0
+        host, base_port = self.config['host'], self.config['port'] - index
+        self.cluster_slot_owner = array('H', bytes(2 * CLUSTER_SLOTS))
+        for i in range(count):
+            start, end = i * CLUSTER_SLOTS // count, (i + 1) * CLUSTER_SLOTS // count - 1
+            self.cluster_nodes.append(ClusterNode(host, base_port + i, start, end))
+            self.cluster_slot_owner[start:end + 1] = array('H', [i]) * (end - start + 1)
+        self.cluster_myself = self.cluster_nodes[index]
+
+    def cluster_redirect(self, keys: list) -> RawReply | None:
+        """The error redirecting a command on keys to the node serving them, None when it is this one."""
+        if not keys:
+            return None
+        slot = key_hash_slot(keys[0])
+        for key in keys[1:]:
+            if key_hash_slot(key) != slot:
+                return Constants.ERROR_CROSSSLOT
+        node = self.cluster_nodes[self.cluster_slot_owner[slot]]
+        if node is self.cluster_myself:
+            return None
+        return RawReply(b'-MOVED %d %s:%d\r\n' % (slot, node.host.encode(), node.port))
+
+    def keys_in_slot(self, slot: int) -> list[bytes]:
+        # every key is hashed, there is no index by slot
+        return [key for key in self.keys() if key_hash_slot(key) == slot]
+
+    def get_cluster_slots(self) -> list:
+        return [[node.start, node.end, [node.host.encode(), node.port, node.id.encode(), []]] for node in self.cluster_nodes]
+
+    def get_cluster_shards(self) -> list:
+        return [
+            [b'slots', [node.start, node.end], b'nodes', [[
+                b'id', node.id.encode(),
+                b'port', node.port,
+                b'ip', node.host.encode(),
+                b'endpoint', node.host.encode(),
+                b'role', b'master',
+                b'replication-offset', self.master_repl_offset if node is self.cluster_myself else 0,
+                b'health', b'online',
+            ]]]
+            for node in self.cluster_nodes
+        ]
+
+    def get_cluster_nodes(self) -> str:
+        return ''.join(
+            f'{node.id} {node.address()}@{node.port + 10000} {"myself," if node is self.cluster_myself else ""}master - 0 0 '
+            f'{i + 1} connected {node.start}-{node.end}\n'
+            for i, node in enumerate(self.cluster_nodes)
+        )
+
+    def get_cluster_info(self) -> str:
+        nodes = len(self.cluster_nodes)
+        return ''.join([
+            'cluster_state:ok\r\n',
+            f'cluster_slots_assigned:{CLUSTER_SLOTS}\r\n',
+            f'cluster_slots_ok:{CLUSTER_SLOTS}\r\n',
+            'cluster_slots_pfail:0\r\n',
+            'cluster_slots_fail:0\r\n',
+            f'cluster_known_nodes:{nodes}\r\n',
+            f'cluster_size:{nodes}\r\n',
+            f'cluster_current_epoch:{nodes}\r\n',
+            f'cluster_my_epoch:{self.cluster_nodes.index(self.cluster_myself) + 1}\r\n',
+        ])
+
+    def get_cluster_section_info(self) -> str:
+        return f'cluster_enabled:{int(self.cluster_slot_owner is not None)}\r\n'
@@ -1,5 +1,7 @@
 import argparse
-from app.utils import generate_alphanumeric_string
+from app.utils import generate_alphanumeric_string, parse_memory
+from app.context.eviction import EVICTION_POLICIES
+from app.context.clients import CLIENT_CLASSES
 
 
 def load_config():
@@ -7,19 +9,90 @@ def load_config():
     return {
         "host": 'localhost',
         "port": args.port or 6379,
-        "dir": args.dir,
-        "dbfilename": args.dbfilename,
+        "dir": args.dir or '.',
+        "dbfilename": args.dbfilename or 'dump.rdb',
         "master_host": args.replicaof.split(' ')[0] if args.replicaof else None,
         "master_port": int(args.replicaof.split(' ')[1]) if args.replicaof else None,
         "is_replica": bool(args.replicaof),
         "master_replid": generate_alphanumeric_string(40) if not args.replicaof else '',
+        "io_model": args.io_model or 'asyncio',
+        "repl_backlog_size": parse_memory(args.repl_backlog_size or '1mb'),
+        "repl_diskless_sync": args.repl_diskless_sync == 'yes',
+        "save": parse_save_params(args.save or ''),
+        "rdbchecksum": (args.rdbchecksum or 'yes') == 'yes',
+        "appendonly": args.appendonly == 'yes',
+        "appendfsync": args.appendfsync or 'everysec',
+        "appendfilename": args.appendfilename or 'appendonly.aof',
+        "slowlog_log_slower_than": args.slowlog_log_slower_than if args.slowlog_log_slower_than is not None else 10000,
+        "client_output_buffer_limit": parse_client_output_buffer_limit(args.client_output_buffer_limit or ''),
+        "slowlog_max_len": args.slowlog_max_len if args.slowlog_max_len is not None else 128,
+        "maxmemory": parse_memory(args.maxmemory or '0'),
+        "maxmemory_policy": args.maxmemory_policy or 'noeviction',
+        "maxmemory_samples": args.maxmemory_samples or 5,
+        "cluster_enabled": args.cluster_enabled == 'yes',
+        "cluster_workers": args.cluster_workers or 1,
+        "cluster_node": args.cluster_node,
     }
 
+def parse_save_params(value: str) -> list[tuple[int, int]]:
+    """Parse 'save' as pairs of <seconds> <changes>, an empty value disables snapshotting."""
+    numbers = [int(number) for number in value.split()]
+    if len(numbers) % 2:
+        raise ValueError(f"Invalid save parameters '{value}'")
+    return list(zip(numbers[::2], numbers[1::2]))
+
+def parse_client_output_buffer_limit(value: str) -> dict[str, tuple[int, int, int]]:
+    """
+    Parse 'client-output-buffer-limit' as <class> <hard> <soft> <soft seconds> groups, over the defaults of Redis.
+    :return: (hard, soft, soft seconds) limits of each class, 0 meaning no limit.
+    """
+    limits = {'normal': (0, 0, 0), 'replica': (256 * 1024**2, 64 * 1024**2, 60), 'pubsub': (32 * 1024**2, 8 * 1024**2, 60)}
+    words = value.split()
+    if len(words) % 4:
+        raise ValueError(f"Invalid client-output-buffer-limit '{value}'")
+    for i in range(0, len(words), 4):
+        name, hard, soft, seconds = words[i:i + 4]
+        # slave is the old name of the replica class
+        name = 'replica' if name.lower() == 'slave' else name.lower()
+        if name not in CLIENT_CLASSES:
+            raise ValueError(f"Invalid client class '{name}' in client-output-buffer-limit")
+        limits[name] = (parse_memory(hard), parse_memory(soft), int(seconds))
+    return limits
+
+def format_config_value(value) -> str:
+    """A config value as CONFIG GET replies it, in the syntax its option is given in, as Redis does."""
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 'yes' if value else 'no'
+    if isinstance(value, dict):
+        return ' '.join(f'{name} {hard} {soft} {seconds}' for name, (hard, soft, seconds) in value.items())
+    if isinstance(value, list):
+        return ' '.join(f'{seconds} {changes}' for seconds, changes in value)
+    return str(value)
+
 def getArgs() -> argparse.Namespace:
     parser = argparse.ArgumentParser()
     parser.add_argument('--port', type=int)
     parser.add_argument('--dir', type=str)
     parser.add_argument('--dbfilename', type=str)
     parser.add_argument('--replicaof', type=str)
+    parser.add_argument('--io-model', type=str, choices=['asyncio', 'threaded'])
+    parser.add_argument('--repl-backlog-size', type=str)
+    parser.add_argument('--repl-diskless-sync', type=str, choices=['yes', 'no'], help='send full resync snapshots to replicas without writing the RDB file')
+    parser.add_argument('--save', type=str)
+    parser.add_argument('--rdbchecksum', type=str, choices=['yes', 'no'])
+    parser.add_argument('--appendonly', type=str, choices=['yes', 'no'])
+    parser.add_argument('--appendfsync', type=str, choices=['always', 'everysec', 'no'])
+    parser.add_argument('--appendfilename', type=str)
+    parser.add_argument('--client-output-buffer-limit', type=str, help="'<class> <hard> <soft> <seconds>' for each of normal, replica and pubsub")
+    parser.add_argument('--slowlog-log-slower-than', type=int)
+    parser.add_argument('--slowlog-max-len', type=int)
+    parser.add_argument('--maxmemory', type=str)
+    parser.add_argument('--maxmemory-policy', type=str, choices=EVICTION_POLICIES)
+    parser.add_argument('--maxmemory-samples', type=int)
+    parser.add_argument('--cluster-enabled', type=str, choices=['yes', 'no'])
+    parser.add_argument('--cluster-workers', type=int, help='nodes of the local cluster, on consecutive ports from --port')
+    parser.add_argument('--cluster-node', type=int, help='index of this node among the workers, set by the launcher')
 
-    return parser.parse_args() or argparse.Namespace(port=6379, dir=None, dbfilename=None, replicaof=None)
+    return parser.parse_args() or argparse.Namespace(port=6379, dir=None, dbfilename=None, replicaof=None, io_model=None, repl_backlog_size=None, repl_diskless_sync=None, save=None, rdbchecksum=None, appendonly=None, appendfsync=None, appendfilename=None, client_output_buffer_limit=None, slowlog_log_slower_than=None, slowlog_max_len=None, maxmemory=None, maxmemory_policy=None, maxmemory_samples=None, cluster_enabled=None, cluster_workers=None, cluster_node=None)
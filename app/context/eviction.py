@@ -0,0 +1,156 @@
+import time
+import random
+import bisect
+
+from app.constants import Constants
+
+# allkeys policies pick from every key, volatile ones from the keys with a TTL only
+EVICTION_POLICIES = ('noeviction', 'allkeys-lru', 'volatile-lru', 'allkeys-lfu', 'volatile-lfu', 'allkeys-random', 'volatile-random', 'volatile-ttl')
+
+# resolution of the LRU clock in ms, the cron refreshes it so lookups read an attribute, not the time
+LRU_CLOCK_RESOLUTION = 100
+
+# logarithmic access counters of LFU, as Redis's: 8 bits, new keys start at LFU_INIT_VAL so they are
+# not evicted before having a chance to be read, an access increments the counter with probability
+# 1 / ((counter - LFU_INIT_VAL) * LFU_LOG_FACTOR + 1) and it loses one every LFU_DECAY_TIME minutes without access
+LFU_INIT_VAL = 5
+LFU_LOG_FACTOR = 10
+LFU_DECAY_TIME = 1
+LFU_COUNTER_MAX = 255
+
+def lru_clock() -> int:
+    return int(time.monotonic() * 1000) // LRU_CLOCK_RESOLUTION
+
+def lfu_minutes() -> int:
+    return int(time.monotonic()) // 60
+
+def lfu_counter(access: int, now: int) -> int:
+    """
+    The counter of an access value, decayed by the minutes since it was last accessed.
+    :param access: The minute of the last access shifted left by 8 bits, or-ed with the counter.
+    """
+    counter = access & LFU_COUNTER_MAX
+    periods = (now - (access >> 8)) // LFU_DECAY_TIME
+    return max(0, counter - periods) if periods > 0 else counter
+
+def lfu_access(access: int | None, now: int) -> int:
+    """The access value of a key after one more access at minute now."""
+    counter = LFU_INIT_VAL if access is None else lfu_counter(access, now)
+    if counter < LFU_COUNTER_MAX and random.random() < 1.0 / (max(0, counter - LFU_INIT_VAL) * LFU_LOG_FACTOR + 1):
+        counter += 1
+    return (now << 8) | counter
+
+class Eviction:
+    """
+    Keeps the keyspace under maxmemory by evicting keys with the configured policy, as Redis does:
+    no ordering of the keys is kept, each eviction samples a few random keys into a small pool
+    of the best candidates seen so far and evicts the best of them.
+
+    Memory is the dataset size the store accounts on every write, see Store.used_memory.
+    """
+
+    # candidates kept between evictions, as Redis's EVPOOL_SIZE
+    EVICTION_POOL_SIZE = 16
+    # sampling rounds after which an eviction gives up, when every sampled key was already gone
+    EVICTION_MAX_ROUNDS = 16
+
+    def __init__(self):
+        # (idle score, key) pairs in ascending order, the best candidate last, and their keys
+        self.eviction_pool = []
+        self.eviction_pool_keys = set()
+
+    def configure_eviction(self) -> None:
+        """Track the per key access values the policy needs, none for the others."""
+        policy = self.config['maxmemory_policy']
+        if policy.endswith(('-lru', '-lfu')):
+            self.access = {}
+            self.access_lfu = policy.endswith('-lfu')
+            self.access_clock = lfu_minutes() if self.access_lfu else lru_clock()
+
+    def eviction_cron(self) -> None:
+        if self.access is not None:
+            self.access_clock = lfu_minutes() if self.access_lfu else lru_clock()
+
+    def free_memory_if_needed(self) -> bool:
+        """
+        Evict keys until the dataset fits in maxmemory.
+        :return: False when it still does not, with noeviction or once no key is left to evict.
+        """
+        maxmemory = self.config['maxmemory']
+        if not maxmemory or self.used_memory <= maxmemory:
+            return True
+        policy = self.config['maxmemory_policy']
+        if policy == 'noeviction':
+            return False
+
+        while self.used_memory > maxmemory:
+            key = self.eviction_candidate(policy)
+            if key is None:
+                return False
+            self.delete(key)
+            self.evicted_keys += 1
+            # replicas and the AOF never evict by themselves, they are told which keys went
+            self.propagate([Constants.DEL, key])
+        return True
+
+    def eviction_candidate(self, policy: str) -> bytes | None:
+        volatile = policy.startswith('volatile')
+        if volatile and not self.expires or not self.store:
+            return None
+        if policy.endswith('-random'):
+            return self.sample_key(volatile)
+
+        pool, pool_keys = self.eviction_pool, self.eviction_pool_keys
+        for _ in range(Eviction.EVICTION_MAX_ROUNDS):
+            self.populate_eviction_pool(policy, volatile)
+            while pool:
+                _, key = pool.pop()
+                pool_keys.discard(key)
+                if key in (self.expires if volatile else self.store):
+                    return key
+        return None
+
+    def populate_eviction_pool(self, policy: str, volatile: bool) -> None:
+        pool, pool_keys = self.eviction_pool, self.eviction_pool_keys
+        for _ in range(self.config['maxmemory_samples']):
+            key = self.sample_key(volatile)
+            if key is None or key in pool_keys:
+                continue
+            if policy == 'volatile-ttl':
+                # the sooner it expires, the better it is to evict
+                score = -self.expires[key]
+            elif self.access_lfu:
+                access = self.access.get(key)
+                score = LFU_COUNTER_MAX - (LFU_INIT_VAL if access is None else lfu_counter(access, self.access_clock))
+            else:
+                score = self.access_clock - self.access.get(key, 0)
+
+            if len(pool) == Eviction.EVICTION_POOL_SIZE:
+                if score <= pool[0][0]:
+                    continue
+                pool_keys.discard(pool.pop(0)[1])
+            bisect.insort(pool, (score, key))
+            pool_keys.add(key)
+
+    def sample_key(self, volatile: bool) -> bytes | None:
+        """
+        A random live key, drawn from the SCAN key index or from the expires heap for the ones with a TTL.
+        Both may hold stale entries, which are redrawn a few times before settling for the oldest live key,
+        so that a key is found whenever there is one to evict.
+        """
+        for _ in range(Eviction.EVICTION_MAX_ROUNDS):
+            if volatile:
+                with self.expires_lock:
+                    heap = self.expires_heap
+                    if not heap:
+                        return None
+                    ttl, key = heap[int(random.random() * len(heap))]
+                if self.expires.get(key) == ttl:
+                    return key
+            else:
+                key = self.key_index.random_key()
+                if key is None:
+                    return None
+                if key in self.store:
+                    return key
+        return next(iter(self.expires if volatile else self.store), None)
@@ -0,0 +1,97 @@
+from random import random
+import threading
+from bisect import bisect_left
+
+class KeyIndex:
+    """
+    Keys in the order they entered the keyspace, split into blocks that SCAN cursors point at.
+
+    A key is appended when it is added and left in place when it is deleted, so readers skip
+    the keys no longer in the keyspace. Once stale entries outnumber live keys the blocks are
+    compacted, a few of them per cron tick. A cursor is the ID of the next block to visit: IDs
+    only grow and a block merged from several takes the ID of the last of them, so a cursor
+    handed out before a compaction resumes at or before every key it had not reached yet.
+    """
+
+    BLOCK_SIZE = 64
+
+    def __init__(self) -> None:
+        self.blocks = []
+        self.ids = []
+        self.next_id = 1
+        self.entries = 0
+        self.compaction = None
+        self.lock = threading.Lock()
+
+    def add(self, key: bytes) -> None:
+        with self.lock:
+            if not self.blocks or len(self.blocks[-1]) >= KeyIndex.BLOCK_SIZE:
+                self.blocks.append([])
+                self.ids.append(self.next_id)
+                self.next_id += 1
+            self.blocks[-1].append(key)
+            self.entries += 1
+
+    def clear(self) -> None:
+        with self.lock:
+            self.blocks, self.ids, self.entries = [], [], 0
+            self.compaction = None
+
+    def scan(self, cursor: int, count: int) -> tuple[int, list]:
+        """
+        Visit whole blocks from cursor until at least count entries were seen.
+        :return: The next cursor, 0 once the last block was visited, and the keys seen, deleted ones included.
+        """
+        with self.lock:
+            i = bisect_left(self.ids, cursor)
+            keys = []
+            while i < len(self.blocks) and len(keys) < count:
+                keys += self.blocks[i]
+                i += 1
+            return (self.ids[i] if i < len(self.ids) else 0), keys
+
+    def random_key(self) -> bytes | None:
+        """An entry drawn at random, possibly of a deleted key. Keys of smaller blocks are a little more likely."""
+        with self.lock:
+            if not self.blocks:
+                return None
+            # random() scaled is several times cheaper than randrange()
+            block = self.blocks[int(random() * len(self.blocks))]
+            return block[int(random() * len(block))]
+
+    def compact(self, live: dict, budget: int) -> bool:
+        """
+        Compact the next blocks, up to budget entries: drop the keys not in live and repeated ones,
+        merging consecutive blocks back to BLOCK_SIZE. A pass runs over as many calls as it takes.
+        :return: True once the pass reached the last block.
+        """
+        with self.lock:
+            if self.compaction is None:
+                # keys kept so far and the number of blocks already compacted
+                self.compaction = (set(), 0)
+            seen, write = self.compaction
+            read = write
+            while read < len(self.blocks) and budget > 0:
+                block, block_id = self.blocks[read], self.ids[read]
+                read += 1
+                budget -= len(block) + 1
+                survivors = [key for key in block if key in live and key not in seen]
+                seen.update(survivors)
+                self.entries -= len(block) - len(survivors)
+                if not survivors:
+                    continue
+                if write and len(self.blocks[write - 1]) < KeyIndex.BLOCK_SIZE:
+                    # the merged block takes the later ID, cursors to either one land on it
+                    self.blocks[write - 1] += survivors
+                    self.ids[write - 1] = block_id
+                else:
+                    self.blocks[write], self.ids[write] = survivors, block_id
+                    write += 1
+            del self.blocks[write:read]
+            del self.ids[write:read]
+
+            if write < len(self.blocks):
+                self.compaction = (seen, write)
+                return False
+            self.compaction = None
+            return True
@@ -0,0 +1,169 @@
+import os
+import time
+
+from app.utils import RDBWriter
+from app.context.replication_manager import SnapshotPipes
+
+class Persistence:
+    """
+    RDB snapshots: SAVE in the foreground, BGSAVE in a forked child, and the save <seconds> <changes> triggers.
+    Also the loading state the server is in while the dataset is loaded at startup or from a master.
+    """
+
+    # delay before a failed background save may be triggered again, as Redis's CONFIG_BGSAVE_RETRY_DELAY
+    BGSAVE_RETRY_DELAY = 5
+
+    def __init__(self):
+        self.rdb_child_pid = None
+        # the child writes to the pipes of a diskless replica sync, not the RDB file
+        self.rdb_child_diskless = False
+        self.rdb_save_time_start = 0
+        self.dirty_before_bgsave = 0
+        self.lastsave = int(time.time())
+        self.lastbgsave_try = 0
+        self.lastbgsave_ok = True
+        self.loading_start_time = 0
+        self.loading_total_bytes = 0
+        self.loading_loaded_bytes = 0
+        # the parser of an RDB being loaded, which counts the bytes it decoded
+        self.loading_parser = None
+
+    def rdb_path(self) -> str:
+        return os.path.join(self.config['dir'], self.config['dbfilename'])
+
+    def rdb_save(self, items, file=None) -> int:
+        """Write the snapshot to the RDB file, or to file when given."""
+        aux = {'redis-ver': '7.2.0', 'redis-bits': 64, 'ctime': int(time.time())}
+        if file is not None:
+            return RDBWriter.write_snapshot(file, items, self.expires, aux, self.config['rdbchecksum'])
+        return RDBWriter.dump(self.rdb_path(), items, self.expires, aux, self.config['rdbchecksum'])
+
+    def save_snapshot(self) -> bool:
+        """Write the snapshot from this process, blocking it until done."""
+        try:
+            # other connections may write meanwhile, so iterate over a copy
+            self.rdb_save(list(self.store.items()))
+        except OSError as e:
+            print(f'Error saving DB on disk: {e}')
+            return False
+        self.dirty = 0
+        self.lastsave = int(time.time())
+        return True
+
+    def bgsave(self, pipes: list[tuple[int, int]] = None) -> bool:
+        """
+        Fork a child that writes the snapshot from its copy-on-write view of the keyspace.
+        :param pipes: (read, write) ends of the pipes of a diskless replica sync, which the child
+                      writes the snapshot into instead of the RDB file.
+        :return: False when the fork failed.
+        """
+        self.lastbgsave_try = time.time()
+        try:
+            pid = os.fork()
+        except OSError as e:
+            print(f"Can't save in background: fork: {e}")
+            self.lastbgsave_ok = False
+            return False
+
+        if pid == 0:
+            code = 0
+            try:
+                if pipes:
+                    # a replica closing its end must break the pipe, so the child does not hold it open
+                    for read_fd, _ in pipes:
+                        os.close(read_fd)
+                    file = SnapshotPipes([write_fd for _, write_fd in pipes])
+                    self.rdb_save(self.store.items(), file)
+                    file.close()
+                else:
+                    self.rdb_save(self.store.items())
+            except BaseException as e:
+                print(f'Error saving DB on {"replica sockets" if pipes else "disk"}: {e}')
+                code = 1
+            # skip the parent's cleanup handlers, threads and event loop are not the child's
+            os._exit(code)
+
+        if pipes:
+            for _, write_fd in pipes:
+                os.close(write_fd)
+        self.rdb_child_pid = pid
+        self.rdb_child_diskless = bool(pipes)
+        self.rdb_save_time_start = time.time()
+        self.dirty_before_bgsave = self.dirty
+        return True
+
+    def check_child_done(self) -> None:
+        pid, status = os.waitpid(self.rdb_child_pid, os.WNOHANG)
+        if pid == 0:
+            return
+
+        self.rdb_child_pid = None
+        ok = os.waitstatus_to_exitcode(status) == 0
+        if self.rdb_child_diskless:
+            # nothing was saved, a replica whose snapshot was cut short fails to load it and syncs again
+            return
+        self.lastbgsave_ok = ok
+        if ok:
+            # writes made while the child was saving are still unsaved
+            self.dirty -= self.dirty_before_bgsave
+            self.lastsave = int(time.time())
+        self.finish_full_sync(ok)
+
+    def persistence_cron(self) -> None:
+        if self.rdb_child_pid is not None:
+            self.check_child_done()
+            return
+        if self.aof_child_pid is not None:
+            return
+
+        now = time.time()
+        for seconds, changes in self.config['save']:
+            if self.dirty < changes or now - self.lastsave < seconds:
+                continue
+            if not self.lastbgsave_ok and now - self.lastbgsave_try < Persistence.BGSAVE_RETRY_DELAY:
+                continue
+            print(f'{changes} changes in {seconds} seconds. Saving...')
+            self.bgsave()
+            break
+
+    def start_loading(self, total_bytes: int = 0) -> None:
+        """
+        Refuse the commands that need the dataset until stop_loading.
+        :param total_bytes: Size of the data to load, for the progress INFO reports, loaders set it once known.
+        """
+        self.loading_start_time = time.time()
+        self.loading_total_bytes = total_bytes
+        self.loading_loaded_bytes = 0
+        self.loading = True
+
+    def stop_loading(self) -> None:
+        self.loading = False
+
+    def get_loading_info(self) -> str:
+        if not self.loading:
+            return 'loading:0\r\n'
+        parser = self.loading_parser
+        loaded = parser.loaded_bytes if parser is not None else self.loading_loaded_bytes
+        total = self.loading_total_bytes
+        elapsed = time.time() - self.loading_start_time
+        # as Redis, the time left at the rate so far, 1 until there is a rate
+        eta = int(elapsed * total / loaded - elapsed) if loaded and total else 1
+        return ''.join([
+            'loading:1\r\n',
+            f'loading_start_time:{int(self.loading_start_time)}\r\n',
+            f'loading_total_bytes:{total}\r\n',
+            f'loading_loaded_bytes:{loaded}\r\n',
+            f'loading_loaded_perc:{loaded / total * 100 if total else 0:.2f}\r\n',
+            f'loading_loaded_keys:{len(self.store)}\r\n',
+            f'loading_eta_seconds:{eta}\r\n',
+        ])
+
+    def get_persistence_info(self) -> str:
+        in_progress = self.rdb_child_pid is not None
+        return self.get_loading_info() + ''.join([
+            f'rdb_changes_since_last_save:{self.dirty}\r\n',
+            f'rdb_bgsave_in_progress:{int(in_progress)}\r\n',
+            f'rdb_last_save_time:{self.lastsave}\r\n',
+            f'rdb_last_bgsave_status:{"ok" if self.lastbgsave_ok else "err"}\r\n',
+            f'rdb_current_bgsave_time_sec:{int(time.time() - self.rdb_save_time_start) if in_progress else -1}\r\n',
+        ])
@@ -1,41 +1,327 @@
+import os
+import time
 import socket
 import threading
 import collections
 
+from app.constants import Constants
+from app.context.waiter import Waiter
+from app.utils import RESPWriter, generate_alphanumeric_string
+
+class ReplicaSnapshot:
+    """
+    The RDB payload a full resync starts with, written by a forked child: to the RDB file, sent
+    once the child is done, or with a diskless sync into a pipe, forwarded to the replica as it comes.
+    """
+
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, replid: str, offset: int, path: str, pipe: int | None) -> None:
+        self.header = f'+FULLRESYNC {replid} {offset}\r\n'.encode()
+        self.path = path
+        # read end of the pipe, None when the snapshot goes through the file
+        self.pipe = pipe
+        self.file = None
+        # the length of a diskless snapshot is not known in advance, a random mark ends it instead
+        self.eof_mark = generate_alphanumeric_string(40).encode() if pipe is not None else None
+        # set when the child exits, only a snapshot to the file needs to wait for it
+        self.done = pipe is not None
+        self.ok = True
+
+    def finish(self, ok: bool) -> None:
+        self.done, self.ok = True, ok
+
+    def preamble(self) -> bytes:
+        """The FULLRESYNC reply and the header of the payload, once the payload can be read."""
+        if not self.ok:
+            raise ConnectionError('the child writing the snapshot failed')
+        if self.pipe is not None:
+            return self.header + b'$EOF:' + self.eof_mark + b'\r\n'
+        # opened now, a later BGSAVE replacing the file does not affect the open one
+        self.file = open(self.path, 'rb')
+        return self.header + b'$%d\r\n' % os.fstat(self.file.fileno()).st_size
+
+    def read(self) -> bytes:
+        """The next chunk of the payload, blocking until there is one, b'' at the end."""
+        if self.pipe is not None:
+            return os.read(self.pipe, ReplicaSnapshot.CHUNK_SIZE)
+        return self.file.read(ReplicaSnapshot.CHUNK_SIZE)
+
+    def trailer(self) -> bytes:
+        return self.eof_mark or b''
+
+    def close(self) -> None:
+        if self.pipe is not None:
+            os.close(self.pipe)
+            self.pipe = None
+        if self.file is not None:
+            self.file.close()
+
+class SnapshotPipes:
+    """The write ends of the pipes of a diskless sync, as one file to the child writing the snapshot."""
+
+    def __init__(self, fds: list[int]) -> None:
+        self.files = [os.fdopen(fd, 'wb') for fd in fds]
+
+    def write(self, data: bytes) -> None:
+        # a replica that went away does not stop the sync of the others
+        for file in list(self.files):
+            try:
+                file.write(data)
+            except BrokenPipeError:
+                self.files.remove(file)
+        if not self.files:
+            raise BrokenPipeError('every replica went away')
+
+    def close(self) -> None:
+        for file in self.files:
+            file.close()
+
+class ReplicaBuffer:
+    """Replication bytes waiting to be written to one replica."""
+
+    def __init__(self, wake, full_sync: bool = False, limit: int = 0) -> None:
+        self.chunks = collections.deque()
+        self.size = 0
+        # the hard output buffer limit of replicas, past it the stream is dropped and the replica disconnected
+        self.limit = limit
+        self.overflowed = False
+        # called after each append so the replica's writer picks the data up
+        self.wake = wake
+        # a full resync waits for a child to be forked for its snapshot, the stream sent after it starts there
+        self.waiting_snapshot = full_sync
+        self.snapshot: ReplicaSnapshot | None = None
+
+    def __len__(self) -> int:
+        return len(self.chunks)
+
+    def append(self, data: bytes) -> None:
+        if self.overflowed:
+            return
+        if self.limit and self.size + len(data) > self.limit:
+            # a replica missing part of the stream cannot go on, it is disconnected by its writer or the
+            # clients cron, whichever sees it first; the size still counts what it would have held
+            self.overflowed = True
+        else:
+            self.chunks.append(data)
+        self.size += len(data)
+        self.wake()
+
+    def drain(self) -> list[bytes]:
+        chunks = []
+        while self.chunks:
+            chunks.append(self.chunks.popleft())
+        self.size -= sum(len(chunk) for chunk in chunks)
+        return chunks
+
+    def start_snapshot(self, snapshot: ReplicaSnapshot) -> None:
+        # queued before the fork, so already part of the snapshot
+        self.chunks.clear()
+        self.size = 0
+        self.waiting_snapshot = False
+        self.snapshot = snapshot
+        self.wake()
+
+class ReplicationBacklog:
+    """
+    Circular buffer holding the last `size` bytes of the replication stream.
+
+    Bytes are addressed by replication offset: the last byte written has offset `offset`,
+    the oldest one still held has offset `first_byte_offset`.
+    """
+
+    def __init__(self, size: int, offset: int) -> None:
+        self.buffer = bytearray(size)
+        self.size = size
+        self.index = 0
+        self.histlen = 0
+        self.offset = offset
+
+    @property
+    def first_byte_offset(self) -> int:
+        return self.offset - self.histlen + 1
+
+    def write(self, data: bytes) -> None:
+        self.offset += len(data)
+        if len(data) >= self.size:
+            self.buffer[:] = data[-self.size:]
+            self.index, self.histlen = 0, self.size
+            return
+
+        end = self.index + len(data)
+        if end <= self.size:
+            self.buffer[self.index:end] = data
+        else:
+            split = self.size - self.index
+            self.buffer[self.index:] = data[:split]
+            self.buffer[:end - self.size] = data[split:]
+        self.index = end % self.size
+        self.histlen = min(self.size, self.histlen + len(data))
+
+    def read_from(self, offset: int) -> bytes | None:
+        """
+        Bytes of the stream from offset up to the latest one.
+        :return: None when offset is no longer, or not yet, covered by the backlog.
+        """
+        if offset < self.first_byte_offset or offset > self.offset + 1:
+            return None
+
+        skip = offset - self.first_byte_offset
+        length = self.histlen - skip
+        start = (self.index - self.histlen + skip) % self.size
+        if start + length <= self.size:
+            return bytes(self.buffer[start:start + length])
+        return bytes(self.buffer[start:]) + bytes(self.buffer[:start + length - self.size])
+
 class ReplicationManager:
+    # seconds between the REPLCONF ACKs a replica sends its master unasked, as Redis's replicationCron
+    REPL_ACK_PERIOD = 1
+
     def __init__(self):
+        self.repl_backlog: ReplicationBacklog | None = None
         self.replica_present = False
         self.offset_lock = threading.Lock()
         self.master_repl_offset = 0
         self.repl_connections_lock = threading.Lock()
         self.repl_connections: list[socket.socket] = []
-        self.ack_count_lock = threading.Lock()
-        self.ack_count = 0
-        self.buffers: dict[socket.socket, collections.deque] = {}
+        self.buffers: dict[socket.socket, ReplicaBuffer] = {}
+        # the last offset each replica acknowledged, and the clients in WAIT woken by every new one
+        self.replica_ack_offsets: dict[socket.socket, int] = {}
+        self.ack_waiters: set[Waiter] = set()
+        # master offset right after the last REPLCONF GETACK, WAITs blocking before another write share it
+        self.getack_offset = -1
+        # on a replica, the controller of the link to the master, which sends the periodic ACKs
+        self.master_link = None
+        self.last_ack_sent = 0.0
 
     def add_command_buffer(self, command):
-        for k, _ in self.buffers.items():
-            self.buffers[k].append(command)        
+        self.feed_replication_stream(RESPWriter.encode_command(command))
+
+    def feed_replication_stream(self, data: bytes) -> None:
+        # the same bytes object is queued for every replica
+        with self.offset_lock:
+            self.master_repl_offset += len(data)
+            self.repl_backlog.write(data)
+            for buffer in list(self.buffers.values()):
+                buffer.append(data)
+
+    def add_new_replica(self, connection: socket.socket, wake, replid: str, offset: int) -> bytes | None:
+        """
+        Register a replica that sent PSYNC.
+        :param replid: Replication ID the replica asked to continue, or '?'.
+        :param offset: First offset the replica is missing, or -1.
+        :return: The bytes to resend for a partial resync, None for a full one, which waits for start_full_sync.
+        """
+        with self.offset_lock:
+            if self.repl_backlog is None:
+                self.repl_backlog = ReplicationBacklog(self.config['repl_backlog_size'], self.master_repl_offset)
+
+            missing = None
+            if replid == self.config['master_replid']:
+                missing = self.repl_backlog.read_from(offset)
+
+            # registering under offset_lock keeps the resent backlog and the buffered stream contiguous
+            with self.repl_connections_lock:
+                limit = self.config['client_output_buffer_limit']['replica'][0]
+                self.buffers[connection] = ReplicaBuffer(wake, full_sync=missing is None, limit=limit)
+                self.repl_connections.append(connection)
+                # as Redis's repl_ack_off, nothing counts as acknowledged before its first REPLCONF ACK
+                self.replica_ack_offsets[connection] = 0
+            self.replica_present = True
+            return missing
 
-    def add_new_replica(self, connection: socket.socket) -> int:
-        self.replica_present = True
+    def start_full_sync(self) -> None:
+        """
+        Fork a child writing the snapshot for the replicas waiting for a full resync, unless another
+        child runs, in which case the cron tries again once it is done. Like BGSAVE, the child writes
+        the RDB file, or with repl_diskless_sync a pipe to each replica, forwarded by its writer.
+        """
+        if not self.replica_present or self.rdb_child_pid is not None or self.aof_child_pid is not None:
+            return
+        # the snapshot is of the keyspace at the offset the buffered stream starts from
+        with self.offset_lock:
+            with self.repl_connections_lock:
+                waiting = [buffer for buffer in self.buffers.values() if buffer.waiting_snapshot]
+            if not waiting:
+                return
+
+            pipes = [os.pipe() for _ in waiting] if self.config['repl_diskless_sync'] else None
+            if not self.bgsave(pipes):
+                if pipes:
+                    for read_fd, _ in pipes:
+                        os.close(read_fd)
+                return
+
+            replid = self.config['master_replid']
+            for i, buffer in enumerate(waiting):
+                buffer.start_snapshot(ReplicaSnapshot(replid, self.master_repl_offset, self.rdb_path(), pipes[i][0] if pipes else None))
+
+    def finish_full_sync(self, ok: bool) -> None:
+        """Let the replicas waiting for the child that wrote their snapshot to the RDB file send it."""
+        with self.repl_connections_lock:
+            buffers = list(self.buffers.values())
+        for buffer in buffers:
+            if buffer.snapshot is not None and not buffer.snapshot.done:
+                buffer.snapshot.finish(ok)
+                buffer.wake()
+
+    def remove_replica(self, connection: socket.socket) -> None:
         with self.repl_connections_lock:
-            self.buffers[connection] = collections.deque([])
-            self.repl_connections.append(connection)
-        return id
+            self.buffers.pop(connection, None)
+            self.replica_ack_offsets.pop(connection, None)
+            if connection in self.repl_connections:
+                self.repl_connections.remove(connection)
+            self.replica_present = bool(self.repl_connections)
 
     def increment_repl_offset(self, bytes_processed: int):
         with self.offset_lock:
             self.master_repl_offset += bytes_processed
 
-    def increment_ack_count(self):
-        with self.ack_count_lock:
-            self.ack_count += 1
+    def acknowledge_replica(self, connection: socket.socket, offset: int) -> None:
+        """Record the offset a replica reported with REPLCONF ACK and wake the clients in WAIT."""
+        with self.repl_connections_lock:
+            if offset <= self.replica_ack_offsets.get(connection, offset):
+                return
+            self.replica_ack_offsets[connection] = offset
+            waiters = tuple(self.ack_waiters)
+        for waiter in waiters:
+            waiter.wake()
+
+    def count_replica_acks(self, offset: int) -> int:
+        """Number of replicas that acknowledged the stream up to offset."""
+        with self.repl_connections_lock:
+            return sum(1 for acked in self.replica_ack_offsets.values() if acked >= offset)
 
-    def reset_ack_count(self):
-        with self.ack_count_lock:
-            self.ack_count = 0
+    def request_replica_acks(self) -> None:
+        # queued behind the pending writes, so the ACKs answering it cover them
+        if self.repl_backlog is None or self.getack_offset == self.master_repl_offset:
+            return
+        self.add_command_buffer([Constants.REPL_CONF, Constants.GETACK, '*'])
+        self.getack_offset = self.master_repl_offset
+
+    async def wait_for_replicas(self, count: int, offset: int, timeout: float | None) -> int:
+        """
+        Block until count replicas acknowledged offset, or timeout seconds passed.
+        :return: Number of replicas that acknowledged offset.
+        """
+        waiter = Waiter()
+        with self.repl_connections_lock:
+            self.ack_waiters.add(waiter)
+        try:
+            self.request_replica_acks()
+            deadline = time.monotonic() + timeout if timeout else None
+            while (acked := self.count_replica_acks(offset)) < count:
+                remaining = deadline - time.monotonic() if deadline else None
+                if remaining is not None and remaining <= 0 or not await waiter.wait(remaining):
+                    return self.count_replica_acks(offset)
+            return acked
+        finally:
+            with self.repl_connections_lock:
+                self.ack_waiters.discard(waiter)
 
-    def get_ack_count(self):
-        with self.ack_count_lock:
-            return self.ack_count
+    def replication_cron(self) -> None:
+        self.start_full_sync()
+        # a replica reports its offset every REPL_ACK_PERIOD even when not asked, as WAIT relies on it
+        if self.master_link is not None and time.monotonic() - self.last_ack_sent >= ReplicationManager.REPL_ACK_PERIOD:
+            self.last_ack_sent = time.monotonic()
+            self.master_link.send_replication_ack()
@@ -1,103 +1,261 @@
+import os
+import sys
 import time
-import asyncio
+import resource
 
 from app.constants import Constants, ValueTypes
-from app.context.config import load_config
+from app.context.config import format_config_value, load_config
+from app.context.stream import Stream, parse_id
 from app.context.stream_store import StreamStore
+from app.context.waiter import Waiter
 from app.context.replication_manager import ReplicationManager
-from app.utils import RDBParser, is_numeric
+from app.context.persistence import Persistence
+from app.context.aof import AppendOnlyFile
+from app.context.stats import ServerStats
+from app.context.eviction import Eviction
+from app.context.cluster import Cluster
+from app.context.clients import Clients
+from app.context.transactions import Transactions
+from app.utils import RDBParser, RESPWriter, format_memory, parse_int, process_rss
+
+class State(StreamStore, ReplicationManager, Persistence, AppendOnlyFile, ServerStats, Eviction, Cluster, Clients, Transactions):
+    CRON_HZ = 10
+    # share of each cron tick the active expire cycle may spend, as Redis's 25%
+    ACTIVE_EXPIRE_CYCLE_TIME_PERC = 25
 
-class State(StreamStore, ReplicationManager):
     def __init__(self):
         StreamStore.__init__(self)
         ReplicationManager.__init__(self)
-        
+        Persistence.__init__(self)
+        AppendOnlyFile.__init__(self)
+        ServerStats.__init__(self)
+        Eviction.__init__(self)
+        Cluster.__init__(self)
+        Clients.__init__(self)
+        Transactions.__init__(self)
+
         self.config = load_config()
+        self.configure_eviction()
+        self.configure_cluster()
         self.role = Constants.SLAVE if self.config.get("is_replica") else Constants.MASTER
-        self.load_rdb_file()
+        self.dirty = 0
     
     def is_master(self) -> bool:
         return self.role == Constants.MASTER
 
     def get_config(self, key: str) -> str | None:
-        return self.config.get(key, "")
+        """The value of a config option as Redis formats it, None for an unknown one."""
+        key = key.lower().replace('-', '_')
+        return format_config_value(self.config[key]) if key in self.config else None
+
+    def cron(self) -> None:
+        """Periodic housekeeping, run CRON_HZ times per second by the server loop."""
+        self.clients_cron()
+        # the keyspace belongs to the loader until it is done
+        if self.loading:
+            return
+        # expiring keys and forking children that snapshot the keyspace must not interleave with a command
+        with self.execution_lock:
+            self.active_expire_cycle(State.ACTIVE_EXPIRE_CYCLE_TIME_PERC / 100 / State.CRON_HZ)
+            self.compact_key_index()
+            self.stats_cron()
+            self.eviction_cron()
+            self.replication_cron()
+            self.persistence_cron()
+            self.aof_cron()
+
+    def propagate(self, command: list) -> None:
+        """Feed an executed write command to the AOF and to the replicas, encoding it once for both."""
+        to_replicas = self.role == Constants.MASTER and self.repl_backlog is not None
+        if self.aof_file is None and not to_replicas:
+            return
 
-    def get_info(self):
+        data = RESPWriter.encode_command(command)
+        if self.aof_file is not None:
+            self.feed_append_only_file(data)
+        # once a replica attached, the backlog keeps recording for the ones that reconnect
+        if to_replicas:
+            self.feed_replication_stream(data)
+
+    def get_info(self, section: str = None) -> str:
+        sections = {
+            'clients': self.get_clients_info,
+            'memory': self.get_memory_info,
+            'persistence': lambda: self.get_persistence_info() + self.get_aof_info(),
+            'replication': self.get_replication_info,
+            'stats': self.get_stats_info,
+            'keyspace': self.get_keyspace_info,
+            'cluster': self.get_cluster_section_info,
+            'commandstats': self.get_commandstats_info,
+        }
+        section = section.lower() if section else 'default'
+        if section in ('all', 'everything'):
+            names = sections
+        elif section == 'default':
+            # per command statistics are only reported when asked for
+            names = [name for name in sections if name != 'commandstats']
+        else:
+            names = [section]
+        return '\r\n'.join(f'# {name.capitalize()}\r\n' + sections[name]() for name in names if name in sections)
+
+    def get_replication_info(self) -> str:
+        backlog = self.repl_backlog
         return ''.join([
             f'role:{self.role}\r\n',
+            f'connected_slaves:{len(self.repl_connections)}\r\n',
             f'master_replid:{self.config.get("master_replid", "")}\r\n',
-            f'master_repl_offset:{self.master_repl_offset}\r\n'
+            f'master_repl_offset:{self.master_repl_offset}\r\n',
+            f'repl_backlog_active:{int(backlog is not None)}\r\n',
+            f'repl_backlog_size:{self.config["repl_backlog_size"]}\r\n',
+            f'repl_backlog_first_byte_offset:{backlog.first_byte_offset if backlog else 0}\r\n',
+            f'repl_backlog_histlen:{backlog.histlen if backlog else 0}\r\n',
+        ])
+
+    def get_memory_info(self) -> str:
+        rss = process_rss()
+        peak = max(rss, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024)
+        # the dict tables themselves, the keys and values they point to are the dataset the store accounts
+        overhead = sys.getsizeof(self.store) + sys.getsizeof(self.expires) + sys.getsizeof(self.expires_heap)
+        dataset = self.used_memory
+        maxmemory = self.config['maxmemory']
+        return ''.join([
+            f'used_memory:{rss}\r\n',
+            f'used_memory_human:{format_memory(rss)}\r\n',
+            f'used_memory_rss:{rss}\r\n',
+            f'used_memory_peak:{peak}\r\n',
+            f'used_memory_peak_human:{format_memory(peak)}\r\n',
+            f'used_memory_overhead:{overhead}\r\n',
+            f'used_memory_dataset:{dataset}\r\n',
+            f'used_memory_per_key:{dataset // len(self.store) if self.store else 0}\r\n',
+            f'maxmemory:{maxmemory}\r\n',
+            f'maxmemory_human:{format_memory(maxmemory)}\r\n',
+            f'maxmemory_policy:{self.config["maxmemory_policy"]}\r\n',
+            'mem_allocator:pymalloc\r\n',
         ])
+
+    def get_keyspace_info(self) -> str:
+        if not self.store:
+            return ''
+        return f'db0:keys={len(self.store)},expires={len(self.expires)},avg_ttl=0\r\n'
     
-    def get_type(self, key: str) -> str:
-        if self.is_expired(key) or self.get(key) is None:
+    def get_type(self, key: bytes) -> str:
+        value = self.get(key)
+        if value is None:
             return ValueTypes.NONE
-        
-        return ValueTypes.STREAM if isinstance(self.store[key][0], list) else ValueTypes.STRING
+
+        return ValueTypes.STREAM if isinstance(value, Stream) else ValueTypes.STRING
 
     def load_rdb_file(self):
-        if not self.config['dir'] or not self.config['dbfilename']:
+        # the file SAVE and BGSAVE write, by default ./dump.rdb, as in Redis a fresh server has none
+        filepath = self.rdb_path()
+        if not os.path.exists(filepath):
             return
-        filepath = f"{self.config['dir']}/{self.config['dbfilename']}"
         data = RDBParser.read_rdb(filepath)
-        self.load_rdb(data)
-    
+        self.loading_total_bytes = len(data) if data else 0
+        try:
+            self.load_rdb(data)
+        finally:
+            if hasattr(data, 'close'):
+                data.close()
+
     def load_rdb(self, data: bytes):
         parser = RDBParser()
-        items = parser.parse(data)
-    
-        for key, (value, ttl) in items.items():
-            self.save(key, value, ttl)
-
-    def incr(self, key: str) -> int | str:
-        if self.get_type(key) == ValueTypes.NONE:
-            self.save(key, '1')
-            return 1
+        self.load_rdb_entries(parser, parser.parse(data))
 
-        value, ttl = self.store[key]
-        
-        if is_numeric(value):
-            new_value = int(value) + 1
-            self.save(key, str(new_value), ttl)
-            return new_value
+    def load_rdb_stream(self, chunks, total_bytes: int = 0):
+        """
+        Load a snapshot as its chunks arrive, as the one a master sends, without ever holding all of it.
+        :param total_bytes: Length of the snapshot, 0 when it is not known in advance.
+        """
+        parser = RDBParser()
+        self.start_loading(total_bytes)
+        try:
+            self.load_rdb_entries(parser, parser.parse_stream(chunks))
+        finally:
+            self.stop_loading()
 
-        return Constants.ERROR_NON_INT
+    def load_rdb_entries(self, parser: RDBParser, entries):
+        # INFO reads the progress from the parser as it goes
+        self.loading_parser = parser
+        try:
+            skipped = self.bulk_load(self.build_values(entries))
+        finally:
+            self.loading_parser = None
+        print(f"Finished parsing RDB with {parser.keys} keys, {skipped} expired keys skipped")
 
+    @staticmethod
+    def build_values(items):
+        for key, value, ttl in items:
+            if isinstance(value, list):
+                stream = Stream()
+                for entry_id, fields in value:
+                    stream.append(entry_id, fields)
+                value = stream
+            yield key, value, ttl
 
-    def read_multiple_streams(self, keys_and_ids: list) -> list:
-        streams = []
-        n = len(keys_and_ids) // 2
+    def incr(self, key: bytes, amount: int = 1) -> int | bytes:
+        value = self.get(key)
+        if value is None:
+            value = 0
+        elif isinstance(value, Stream):
+            return Constants.ERROR_WRONGTYPE
+        elif not isinstance(value, int) and (value := parse_int(value)) is None:
+            return Constants.ERROR_NON_INT
 
-        for i in range(n):
-            key = keys_and_ids[i]
-            id = keys_and_ids[n + i]
-            streams.append((key, id))
+        new_value = value + amount
+        if not -2**63 <= new_value < 2**63:
+            return Constants.ERROR_OVERFLOW
+        # the key keeps its TTL
+        self.set_value(key, self.shared_integer(new_value))
+        return new_value
 
+    def read_multiple_streams(self, keys: list, ids: list, count: int = None) -> list | bytes | None:
         result = []
-        for stream_key, id in streams:
-            entries = self.get_stream_entries(stream_key, id, '+')
-            result.append([stream_key, entries])
-        return result
-
-    async def read_blocking_streams(self, keys_and_ids: list, timeout: int) -> list:
-        task = asyncio.create_task(self.read_stream_task(keys_and_ids, timeout))
-        return await task
-        
-    async def read_stream_task(self, keys_and_ids: list, timeout: int) -> list:
-            current_time = int(time.time() * 1000)
-            stream_key = keys_and_ids[0]
-            last_entry = None
-
-            
-            if timeout == 0:
-                timeout = float('inf') # block until new entry is added
-
-            while int(time.time() * 1000) - current_time < timeout:
-                all_entries = self.store[stream_key][0]
-                last_entry = all_entries[-1] if len(all_entries) > 0 else None
-                if last_entry and last_entry[2] > current_time:
-                    break
-                last_entry = None
-                await asyncio.sleep(0.05)
-            
-            return [[stream_key, [last_entry[:2]]]] if last_entry else None
\ No newline at end of file
+        for stream_key, id in zip(keys, ids):
+            stream = self.read_stream(stream_key)
+            if not stream:
+                continue
+            try:
+                entries = stream.read_after(stream.last_id if id == b'$' else parse_id(id), count)
+            except ValueError:
+                return Constants.ERROR_STREAM_ID
+            if entries:
+                result.append([stream_key, entries])
+        return result or None
+
+    def block_on_streams(self, keys: list, ids: list) -> tuple[list, Waiter] | bytes:
+        """
+        Resolve the IDs to read after and register a waiter for keys, both before the client blocks and
+        the others run, so no entry added in between is missed. read_blocking_streams unregisters it.
+        :return: The IDs and the waiter, or an error.
+        """
+        try:
+            # '$' means entries added from now on
+            after = []
+            for key, id in zip(keys, ids):
+                stream = self.get_stream(key)
+                after.append((stream.last_id if stream else (0, 0)) if id == b'$' else parse_id(id))
+        except ValueError:
+            return Constants.ERROR_STREAM_ID
+
+        waiter = Waiter()
+        self.add_stream_waiter(keys, waiter)
+        return after, waiter
+
+    async def read_blocking_streams(self, keys: list, after: list, waiter: Waiter, timeout: int, count: int = None) -> list | None:
+        try:
+            deadline = time.monotonic() + timeout / 1000 if timeout else None
+            while True:
+                result = []
+                for key, entry_id in zip(keys, after):
+                    stream = self.get_stream(key)
+                    if stream and (entries := stream.read_after(entry_id, count)):
+                        result.append([key, entries])
+                if result:
+                    return result
+
+                remaining = deadline - time.monotonic() if deadline else None
+                if remaining is not None and remaining <= 0 or not await waiter.wait(remaining):
+                    return None
+        finally:
+            self.remove_stream_waiter(keys, waiter)
@@ -0,0 +1,113 @@
+import time
+import collections
+
+class CommandStats:
+    """Calls and time spent in one command, with a histogram of its latencies in power of two buckets."""
+
+    __slots__ = ('calls', 'usec', 'rejected_calls', 'failed_calls', 'histogram')
+
+    # bucket i counts calls that took less than 2**i microseconds and at least half of that,
+    # 64 buckets cover any duration so recording needs no bounds check
+    HISTOGRAM_BUCKETS = 64
+
+    def __init__(self) -> None:
+        self.calls = 0
+        self.usec = 0
+        self.rejected_calls = 0
+        self.failed_calls = 0
+        self.histogram = [0] * CommandStats.HISTOGRAM_BUCKETS
+
+    def cumulative_histogram(self) -> list:
+        """Flattened (upper bound in usec, calls up to it) pairs, one per non-empty bucket, as LATENCY HISTOGRAM replies."""
+        pairs, total = [], 0
+        for i, count in enumerate(self.histogram):
+            if count:
+                total += count
+                pairs += [1 << i, total]
+        return pairs
+
+class ServerStats:
+    """Counters behind INFO stats, clients and commandstats, LATENCY HISTOGRAM and the SLOWLOG."""
+
+    # samples the instantaneous metrics average over, as Redis's STATS_METRIC_SAMPLES
+    METRIC_SAMPLES = 16
+    # arguments and bytes per argument kept in a slow log entry
+    SLOWLOG_ENTRY_MAX_ARGS = 32
+    SLOWLOG_ENTRY_MAX_STRING = 128
+
+    def __init__(self):
+        self.command_stats: dict[str, CommandStats] = {}
+        self.total_connections_received = 0
+        self.connected_clients = 0
+        self.net_input_bytes = 0
+        self.net_output_bytes = 0
+        self.metric_samples = {name: collections.deque(maxlen=ServerStats.METRIC_SAMPLES) for name in ('ops', 'input', 'output')}
+        self.metric_last = (time.monotonic(), 0, 0, 0)
+        self.slowlog = collections.deque()
+        self.slowlog_next_id = 0
+
+    def add_command_stats(self, name: str) -> CommandStats:
+        """Stats of a command, created on its first call. The dispatch path updates them in place."""
+        return self.command_stats.setdefault(name, CommandStats())
+
+    @property
+    def total_commands_processed(self) -> int:
+        return sum(stats.calls for stats in list(self.command_stats.values()))
+
+    def slowlog_push(self, command: list, usec: int, address: str) -> None:
+        args = command[:ServerStats.SLOWLOG_ENTRY_MAX_ARGS]
+        if len(command) > ServerStats.SLOWLOG_ENTRY_MAX_ARGS:
+            args[-1] = b'... (%d more arguments)' % (len(command) - ServerStats.SLOWLOG_ENTRY_MAX_ARGS + 1)
+        args = [arg.encode() if isinstance(arg, str) else arg for arg in args]
+        args = [arg if len(arg) <= ServerStats.SLOWLOG_ENTRY_MAX_STRING
+                else arg[:ServerStats.SLOWLOG_ENTRY_MAX_STRING] + b'... (%d more bytes)' % (len(arg) - ServerStats.SLOWLOG_ENTRY_MAX_STRING)
+                for arg in args]
+
+        self.slowlog.appendleft([self.slowlog_next_id, int(time.time()), usec, args, address.encode(), b''])
+        self.slowlog_next_id += 1
+        while len(self.slowlog) > self.config['slowlog_max_len']:
+            self.slowlog.pop()
+
+    def stats_cron(self) -> None:
+        """Sample the per second rates the instantaneous metrics report."""
+        now = time.monotonic()
+        last_time, last_ops, last_input, last_output = self.metric_last
+        elapsed = now - last_time
+        if elapsed <= 0:
+            return
+        ops = self.total_commands_processed
+        self.metric_samples['ops'].append((ops - last_ops) / elapsed)
+        self.metric_samples['input'].append((self.net_input_bytes - last_input) / elapsed)
+        self.metric_samples['output'].append((self.net_output_bytes - last_output) / elapsed)
+        self.metric_last = (now, ops, self.net_input_bytes, self.net_output_bytes)
+
+    def instantaneous_metric(self, name: str) -> float:
+        samples = self.metric_samples[name]
+        return sum(samples) / len(samples) if samples else 0
+
+    def get_clients_info(self) -> str:
+        return f'connected_clients:{self.connected_clients}\r\n'
+
+    def get_stats_info(self) -> str:
+        return ''.join([
+            f'total_connections_received:{self.total_connections_received}\r\n',
+            f'total_commands_processed:{self.total_commands_processed}\r\n',
+            f'instantaneous_ops_per_sec:{int(self.instantaneous_metric("ops"))}\r\n',
+            f'total_net_input_bytes:{self.net_input_bytes}\r\n',
+            f'total_net_output_bytes:{self.net_output_bytes}\r\n',
+            f'instantaneous_input_kbps:{self.instantaneous_metric("input") / 1024:.2f}\r\n',
+            f'instantaneous_output_kbps:{self.instantaneous_metric("output") / 1024:.2f}\r\n',
+            f'expired_keys:{self.expired_keys}\r\n',
+            f'evicted_keys:{self.evicted_keys}\r\n',
+            f'client_output_buffer_limit_disconnections:{self.client_output_buffer_limit_disconnections}\r\n',
+            f'keyspace_hits:{self.keyspace_hits}\r\n',
+            f'keyspace_misses:{self.keyspace_misses}\r\n',
+        ])
+
+    def get_commandstats_info(self) -> str:
+        return ''.join(
+            f'cmdstat_{name.lower()}:calls={stats.calls},usec={stats.usec},'
+            f'usec_per_call={stats.usec / stats.calls if stats.calls else 0:.2f},'
+            f'rejected_calls={stats.rejected_calls},failed_calls={stats.failed_calls}\r\n'
+            for name, stats in sorted(self.command_stats.items())
+        )
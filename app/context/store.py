@@ -1,31 +1,336 @@
+import sys
 import time
-import collections
+import heapq
+import threading
+
+from app.context.key_index import KeyIndex
+from app.context.eviction import lfu_access
+from app.utils import compile_glob, parse_int
+from app.constants import Constants
 
 class Store:
+    """
+    The keyspace: a dict of keys to values plus a side table of the keys that have a TTL.
+
+    String values that are integers are stored as ints, the ones below SHARED_INTEGERS as one
+    shared object each, as Redis's shared integers, so a small counter costs its key and dict slot only.
+
+    Every write keeps used_memory, the estimated bytes of the keys and values, up to date at the cost
+    of a len() or two, so maxmemory can be checked before any command.
+    """
+
+    ACTIVE_EXPIRE_KEYS_PER_LOOP = 20
+    # key index entries compacted per cron tick
+    KEY_INDEX_COMPACT_ENTRIES = 10000
+    SHARED_INTEGERS = tuple(range(10000))
+    # a bytes object's header, sizes of keys and strings are computed from it, sys.getsizeof() is several times slower
+    BYTES_HEADER = sys.getsizeof(b'')
+    # bytes of a key besides its key and value objects: its dict slot and its key index entry
+    KEY_OVERHEAD = 48
+    # and of its TTL: the expires slot, the expiry and its heap entry
+    EXPIRE_OVERHEAD = 136
+
     def __init__(self) -> None:
-        self.store = collections.defaultdict(lambda: (None, None))
-    
-    def save(self, key: str, value: str, ttl: int = None):
-        self.store[key] = (value, ttl)
-    
-    def get(self, key: str) -> str | None:
-        return self.store[key][0] if not self.is_expired(key) else None
-
-    def delete(self, key: str) -> None:
-        self.store.pop(key, None)
-    
-    def is_expired(self, key: str) -> bool:
-        ttl = self.store[key][1]
-        if ttl and ttl < time.time() * 1000:
-            self.delete(key)
+        self.store = {}
+        # keys with a TTL only, mapped to their unix expiry time in ms
+        self.expires = {}
+        # (expiry, key) pairs ordered by expiry; entries of keys deleted or given another TTL go stale
+        self.expires_heap = []
+        self.expires_lock = threading.Lock()
+        self.expired_keys = 0
+        self.evicted_keys = 0
+        self.keyspace_hits = 0
+        self.keyspace_misses = 0
+        # insertion ordered keys that SCAN cursors walk
+        self.key_index = KeyIndex()
+        self.used_memory = 0
+        # per key LRU clock or LFU counter, kept only when the eviction policy needs them, see Eviction
+        self.access = None
+        self.access_lfu = False
+        self.access_clock = 0
+        # version and watcher count of each key a client WATCHes, see Transactions
+        self.watched_keys = {}
+        # set while a snapshot or the AOF loads, see Persistence: keys do not expire and commands
+        # without the loading flag are refused
+        self.loading = False
+
+    @staticmethod
+    def encode_value(value):
+        if isinstance(value, bytes) and len(value) <= 20 and (number := parse_int(value)) is not None:
+            return Store.shared_integer(number)
+        return value
+
+    @staticmethod
+    def shared_integer(number: int) -> int:
+        return Store.SHARED_INTEGERS[number] if 0 <= number < len(Store.SHARED_INTEGERS) else number
+
+    def save(self, key: bytes, value: bytes, ttl: int = None):
+        # set_value() inlined, SET's whole path
+        value = Store.encode_value(value)
+        old = self.store.get(key)
+        size = len(value) + Store.BYTES_HEADER if value.__class__ is bytes else self.value_size(value)
+        if old is None:
+            self.key_index.add(key)
+            size += len(key) + Store.BYTES_HEADER + Store.KEY_OVERHEAD
+        else:
+            size -= len(old) + Store.BYTES_HEADER if old.__class__ is bytes else self.value_size(old)
+        self.used_memory += size
+        self.store[key] = value
+        if self.access is not None:
+            self.touch(key)
+        if ttl is None:
+            if self.expires.pop(key, None) is not None:
+                self.used_memory -= Store.EXPIRE_OVERHEAD
+            return
+
+        if self.expires.get(key) != ttl:
+            if key not in self.expires:
+                self.used_memory += Store.EXPIRE_OVERHEAD
+            self.expires[key] = ttl
+            with self.expires_lock:
+                heapq.heappush(self.expires_heap, (ttl, key))
+
+    def set_value(self, key: bytes, value) -> None:
+        """Store an already encoded value, keeping the key's TTL."""
+        old = self.store.get(key)
+        # strings are sized inline, through value_size() the accounting would cost as much as the write
+        size = len(value) + Store.BYTES_HEADER if value.__class__ is bytes else self.value_size(value)
+        if old is None:
+            self.key_index.add(key)
+            size += len(key) + Store.BYTES_HEADER + Store.KEY_OVERHEAD
+        else:
+            size -= len(old) + Store.BYTES_HEADER if old.__class__ is bytes else self.value_size(old)
+        self.used_memory += size
+        self.store[key] = value
+        if self.access is not None:
+            self.touch(key)
+
+    def get(self, key: bytes) -> bytes | int | None:
+        value = self.store.get(key)
+        if value is None:
+            return None
+        if self.expires and self.is_expired(key):
+            return None
+        if self.access is not None:
+            self.touch(key)
+        return value
+
+    def touch(self, key: bytes) -> None:
+        if self.access_lfu:
+            self.access[key] = lfu_access(self.access.get(key), self.access_clock)
+        else:
+            self.access[key] = self.access_clock
+
+    def lookup_read(self, key: bytes):
+        """get() for the commands that read a key, counting keyspace hits and misses."""
+        value = self.get(key)
+        if value is None:
+            self.keyspace_misses += 1
+        else:
+            self.keyspace_hits += 1
+        return value
+
+    def get_string(self, key: bytes) -> bytes | None:
+        # lookup_read inlined, this is GET's whole path
+        value = self.get(key)
+        if value is None:
+            self.keyspace_misses += 1
+            return None
+        self.keyspace_hits += 1
+        if value.__class__ is int:
+            return b'%d' % value
+        return value if value.__class__ is bytes else Constants.ERROR_WRONGTYPE
+
+    def get_many(self, keys: list) -> list:
+        """String values of keys, None for the missing ones and the ones holding another type."""
+        values = []
+        for key in keys:
+            value = self.lookup_read(key)
+            values.append(b'%d' % value if isinstance(value, int) else value if isinstance(value, bytes) else None)
+        return values
+
+    def save_many(self, keys: list, values: list) -> None:
+        for key, value in zip(keys, values):
+            self.save(key, value)
+
+    def signal_modified_key(self, key: bytes) -> None:
+        entry = self.watched_keys.get(key)
+        if entry is not None:
+            entry[0] += 1
+
+    def delete(self, key: bytes) -> None:
+        # expired and evicted keys are deleted here too, they abort the transactions watching them as well
+        if self.watched_keys:
+            self.signal_modified_key(key)
+        value = self.store.pop(key, None)
+        if self.expires.pop(key, None) is not None:
+            self.used_memory -= Store.EXPIRE_OVERHEAD
+        if value is None:
+            return
+        self.used_memory -= len(key) + Store.BYTES_HEADER + Store.KEY_OVERHEAD + self.value_size(value)
+        if self.access is not None:
+            self.access.pop(key, None)
+
+    def delete_many(self, keys: list) -> int:
+        """Delete keys, returning how many of them existed."""
+        deleted = 0
+        for key in keys:
+            if self.exists(key):
+                self.delete(key)
+                deleted += 1
+        return deleted
+
+    def is_expired(self, key: bytes) -> bool:
+        ttl = self.expires.get(key)
+        # as Redis's keyIsExpired, nothing expires while loading: replaying the AOF must give the same
+        # dataset whenever it runs, the commands after a key's expiry still find it
+        if ttl and ttl < time.time() * 1000 and not self.loading:
+            self.expire_key(key)
+            self.expired_keys += 1
             return True
         return False
 
-    def exists(self, key: str) -> bool:
+    def expire_key(self, key: bytes) -> None:
+        self.delete(key)
+        # as Redis does, the AOF and the replicas get a DEL: the commands after it are replayed on the
+        # keyspace without the key, whenever that happens
+        self.propagate([Constants.DEL, key])
+
+    def propagate(self, command: list) -> None:
+        """Feed a write to the AOF and the replicas, which only the State has."""
+
+    def exists(self, key: bytes) -> bool:
         return self.get(key) is not None
-    
-    def keys(self) -> list[str]:
-        return list(self.store.keys())
-    
+
+    def count_existing(self, keys: list) -> int:
+        # a key given twice counts twice, as in Redis
+        return sum(1 for key in keys if self.get(key) is not None)
+
+    def keys(self, pattern: bytes = b'*') -> list[bytes]:
+        if pattern == b'*':
+            return [key for key in list(self.store) if not self.is_expired(key)]
+        match = compile_glob(pattern).fullmatch
+        return [key for key in list(self.store) if match(key) and not self.is_expired(key)]
+
+    def scan(self, cursor: int, count: int, pattern: bytes = None) -> tuple[int, list[bytes]]:
+        """
+        Return the live keys of the next blocks of the key index, matching pattern if given.
+        Keys present during a whole iteration are returned at least once, some may be returned twice.
+        """
+        cursor, keys = self.key_index.scan(cursor, count)
+        match = compile_glob(pattern).fullmatch if pattern is not None and pattern != b'*' else None
+        return cursor, [key for key in keys if key in self.store and (match is None or match(key)) and not self.is_expired(key)]
+
+    def compact_key_index(self) -> None:
+        # deleted keys stay in the index until they outnumber the live ones, as in the expires heap
+        if self.key_index.compaction is not None or self.key_index.entries > 2 * len(self.store) + 1024:
+            self.key_index.compact(self.store, Store.KEY_INDEX_COMPACT_ENTRIES)
+
     def flush(self) -> None:
+        for entry in list(self.watched_keys.values()):
+            entry[0] += 1
         self.store.clear()
+        self.expires.clear()
+        self.key_index.clear()
+        self.used_memory = 0
+        if self.access is not None:
+            self.access.clear()
+        with self.expires_lock:
+            self.expires_heap.clear()
+
+    def bulk_load(self, items) -> int:
+        """
+        Insert keys straight into the keyspace, bypassing save(), then index their TTLs at once.
+        Keys whose expiry already passed are dropped instead of loaded.
+        :param items: (key, value, expiry in ms or None) triples.
+        :return: Number of keys skipped as expired.
+        """
+        store, expires = self.store, self.expires
+        now = time.time() * 1000
+        skipped = used = 0
+        for key, value, ttl in items:
+            if ttl is not None:
+                if ttl < now:
+                    skipped += 1
+                    continue
+                if key not in expires:
+                    used += Store.EXPIRE_OVERHEAD
+                expires[key] = ttl
+            elif expires.pop(key, None) is not None:
+                used -= Store.EXPIRE_OVERHEAD
+            value = Store.encode_value(value)
+            old = store.get(key)
+            if old is None:
+                self.key_index.add(key)
+                used += len(key) + Store.BYTES_HEADER + Store.KEY_OVERHEAD
+            else:
+                used -= self.value_size(old)
+            store[key] = value
+            used += self.value_size(value)
+        self.used_memory += used
+
+        with self.expires_lock:
+            self.expires_heap[:] = [(ttl, key) for key, ttl in expires.items()]
+            heapq.heapify(self.expires_heap)
+        return skipped
+
+    def memory_usage(self, key: bytes, samples: int = 5) -> int | None:
+        """
+        Estimate the bytes a key takes: its key and value objects, plus its share of the dict tables.
+        :param samples: Elements sampled to estimate the size of an aggregate value.
+        """
+        value = self.get(key)
+        if value is None:
+            return None
+        size = sys.getsizeof(key) + sys.getsizeof(self.store) // len(self.store) + self.value_memory_usage(value, samples)
+        if key in self.expires:
+            size += sys.getsizeof(self.expires) // len(self.expires) + sys.getsizeof(self.expires[key])
+        return size
+
+    def value_size(self, value) -> int:
+        """Bytes of a value as used_memory accounts them."""
+        if value.__class__ is bytes:
+            return len(value) + Store.BYTES_HEADER
+        if value.__class__ is int:
+            return 0 if 0 <= value < len(Store.SHARED_INTEGERS) else sys.getsizeof(value)
+        return self.aggregate_size(value)
+
+    def aggregate_size(self, value) -> int:
+        return sys.getsizeof(value)
+
+    def value_memory_usage(self, value, samples: int) -> int:
+        if isinstance(value, int) and 0 <= value < len(Store.SHARED_INTEGERS):
+            return 0
+        return sys.getsizeof(value)
+
+    def active_expire_cycle(self, time_limit: float) -> int:
+        """
+        Delete keys whose TTL has passed without waiting for them to be read.
+        :param time_limit: CPU time budget of this cycle in seconds.
+        :return: Number of keys expired.
+        """
+        start = time.perf_counter()
+        now = time.time() * 1000
+        heap = self.expires_heap
+        expired = 0
+
+        with self.expires_lock:
+            while heap and heap[0][0] <= now:
+                for _ in range(Store.ACTIVE_EXPIRE_KEYS_PER_LOOP):
+                    if not heap or heap[0][0] > now:
+                        break
+                    ttl, key = heapq.heappop(heap)
+                    if self.expires.get(key) == ttl:
+                        self.expire_key(key)
+                        expired += 1
+
+                if time.perf_counter() - start > time_limit:
+                    break
+
+            # rebuild once stale entries outnumber live ones, so the heap stays bounded by the keyspace
+            if len(heap) > 2 * len(self.expires) + 1024:
+                heap[:] = [(ttl, key) for key, ttl in list(self.expires.items())]
+                heapq.heapify(heap)
+
+        self.expired_keys += expired
+        return expired
@@ -0,0 +1,90 @@
+from array import array
+from bisect import bisect_left, bisect_right
+
+MAX_ID_PART = 2**64 - 1
+
+class Stream:
+    """
+    Entries of one stream ordered by ID.
+
+    IDs are stored as two parallel arrays of unsigned 64-bit integers, milliseconds and
+    sequence numbers, so a range is located with a binary search on the milliseconds
+    followed by one on the sequence numbers sharing them.
+    """
+
+    __slots__ = ('ms', 'seqs', 'fields')
+
+    def __init__(self) -> None:
+        self.ms = array('Q')
+        self.seqs = array('Q')
+        self.fields = []
+
+    def __len__(self) -> int:
+        return len(self.fields)
+
+    @property
+    def last_id(self) -> tuple[int, int]:
+        return (self.ms[-1], self.seqs[-1]) if self.fields else (0, 0)
+
+    def append(self, entry_id: tuple[int, int], fields: list) -> None:
+        self.ms.append(entry_id[0])
+        self.seqs.append(entry_id[1])
+        self.fields.append(fields)
+
+    def index(self, entry_id: tuple[int, int], after: bool = False) -> int:
+        """Position of the first entry whose ID is >= entry_id, or > entry_id when after is set."""
+        ms, seq = entry_id
+        lo = bisect_left(self.ms, ms)
+        hi = bisect_right(self.ms, ms, lo)
+        return bisect_right(self.seqs, seq, lo, hi) if after else bisect_left(self.seqs, seq, lo, hi)
+
+    def entry(self, i: int) -> list:
+        return [format_id((self.ms[i], self.seqs[i])), self.fields[i]]
+
+    def range(self, start: tuple[int, int], end: tuple[int, int], count: int = None) -> list:
+        lo, hi = self.index(start), self.index(end, after=True)
+        if count is not None:
+            hi = min(hi, lo + count)
+        return [self.entry(i) for i in range(lo, hi)]
+
+    def rev_range(self, end: tuple[int, int], start: tuple[int, int], count: int = None) -> list:
+        lo, hi = self.index(start), self.index(end, after=True)
+        if count is not None:
+            lo = max(lo, hi - count)
+        return [self.entry(i) for i in range(hi - 1, lo - 1, -1)]
+
+    def read_after(self, entry_id: tuple[int, int], count: int = None) -> list:
+        lo = self.index(entry_id, after=True)
+        hi = len(self.fields) if count is None else min(len(self.fields), lo + count)
+        return [self.entry(i) for i in range(lo, hi)]
+
+def format_id(entry_id: tuple[int, int]) -> bytes:
+    return b'%d-%d' % entry_id
+
+def parse_id(text: bytes, missing_seq: int = 0) -> tuple[int, int]:
+    """
+    Parse a stream ID argument.
+    :param missing_seq: Sequence number to use when text only gives the milliseconds.
+    :return: (ms, seq) pair. Raises ValueError for malformed IDs.
+    """
+    ms, _, seq = text.partition(b'-')
+    entry_id = (int(ms), int(seq) if seq else missing_seq)
+    if not 0 <= entry_id[0] <= MAX_ID_PART or not 0 <= entry_id[1] <= MAX_ID_PART:
+        raise ValueError(f"Invalid stream ID {text!r}")
+    return entry_id
+
+def parse_range_start(text: bytes) -> tuple[int, int]:
+    if text == b'-':
+        return (0, 0)
+    if text.startswith(b'('):
+        ms, seq = parse_id(text[1:])
+        return (ms, seq + 1) if seq < MAX_ID_PART else (ms + 1, 0)
+    return parse_id(text)
+
+def parse_range_end(text: bytes) -> tuple[int, int]:
+    if text == b'+':
+        return (MAX_ID_PART, MAX_ID_PART)
+    if text.startswith(b'('):
+        ms, seq = parse_id(text[1:], MAX_ID_PART)
+        return (ms, seq - 1) if seq > 0 else (ms - 1, MAX_ID_PART)
+    return parse_id(text, MAX_ID_PART)
@@ -1,77 +1,129 @@
+import sys
 import time
 
 from app.context.store import Store
+from app.context.waiter import Waiter
+from app.context.stream import Stream, format_id, parse_id, parse_range_start, parse_range_end
 from app.constants import Constants
 
 class StreamStore(Store):
+    # an empty Stream with its arrays and list
+    STREAM_SIZE = 272
+
     def __init__(self):
         super().__init__()
+        self.stream_waiters: dict[bytes, set[Waiter]] = {}
+
+    def add_stream_waiter(self, keys: list, waiter: Waiter) -> None:
+        for key in keys:
+            self.stream_waiters.setdefault(key, set()).add(waiter)
+
+    def remove_stream_waiter(self, keys: list, waiter: Waiter) -> None:
+        for key in keys:
+            waiters = self.stream_waiters.get(key)
+            if waiters is None:
+                continue
+            waiters.discard(waiter)
+            if not waiters:
+                del self.stream_waiters[key]
+
+    def aggregate_size(self, value) -> int:
+        # exact, as appends add each entry's size and a deleted stream must take back as much
+        if not isinstance(value, Stream):
+            return super().aggregate_size(value)
+        return StreamStore.STREAM_SIZE + sum(map(StreamStore.stream_entry_size, value.fields))
+
+    @staticmethod
+    def stream_entry_size(fields: list) -> int:
+        # its ID in the two arrays and its slot in the list, then its fields
+        return 24 + sys.getsizeof(fields) + sum(map(sys.getsizeof, fields))
+
+    def value_memory_usage(self, value, samples: int) -> int:
+        if not isinstance(value, Stream):
+            return super().value_memory_usage(value, samples)
+        size = sys.getsizeof(value) + sys.getsizeof(value.ms) + sys.getsizeof(value.seqs) + sys.getsizeof(value.fields)
+        # the entries' fields are sampled, all of them with SAMPLES 0
+        sampled = value.fields[:samples] if samples else value.fields
+        if sampled:
+            entries = sum(sys.getsizeof(fields) + sum(map(sys.getsizeof, fields)) for fields in sampled)
+            size += entries * len(value.fields) // len(sampled)
+        return size
+
+    def get_stream(self, key: bytes) -> Stream | None:
+        value = self.get(key)
+        return value if isinstance(value, Stream) else None
+
+    def read_stream(self, key: bytes) -> Stream | None:
+        value = self.lookup_read(key)
+        return value if isinstance(value, Stream) else None
+
+    def generate_stream_entry_id(self, key: bytes, id: bytes) -> bytes:
+        if b'*' not in id:
+            return id
+
+        stream = self.get_stream(key)
+        last_ms, last_seq = stream.last_id if stream else (0, 0)
+
+        if id == b'*':
+            now = int(time.time() * 1000)
+            # the clock may lag behind the top entry, IDs still have to grow
+            return format_id((now, 0) if now > last_ms else (last_ms, last_seq + 1))
 
-    def generate_stream_entry_id(self, key: str, id: str) -> str:
-        if '*' not in id:
+        time_part = id.split(b'-')[0]
+        if not time_part.isdigit():
             return id
 
-        if id == '*':
-            return str(int(time.time() * 1000)) + '-0'
-        
-        time_part = id.split('-')[0]
-        if self.get(key) is not None:
-            last_id = self.store[key][0][-1][0] if self.store[key][0] else '0-0'
-            parts = last_id.split('-')
-            
-            if parts[0] == time_part:
-                return f"{parts[0]}-{int(parts[1]) + 1}"
-        
-        return time_part + '-0' if int(time_part) > 0 else time_part + '-1'
-
-    def validate_stream(self, key: str, id: str) -> str:
-        last_id = self.get(key)[-1][0] if self.get(key) else '0-0'
-        
-        if id == '0-0':
+        time_part = int(time_part)
+        if stream and time_part == last_ms:
+            return format_id((time_part, last_seq + 1))
+
+        return format_id((time_part, 0 if time_part > 0 else 1))
+
+    def validate_stream(self, key: bytes, entry_id: tuple[int, int]) -> bytes | None:
+        stream = self.get_stream(key)
+        last_id = stream.last_id if stream else (0, 0)
+
+        if entry_id == (0, 0):
             return Constants.ERROR_MIN_STREAM_ID
-        if id <= last_id:
+        if entry_id <= last_id:
             return Constants.ERROR_STREAM_KEY
 
-    def save_stream(self, key: str, entry_id: str, fields: list) -> None:
-        if self.get(key) is None:
-            self.save(key, [])
+    def save_stream(self, key: bytes, entry_id: bytes, fields: list) -> bytes:
+        try:
+            parsed_id = parse_id(entry_id)
+        except ValueError:
+            return Constants.ERROR_STREAM_ID
 
-        if error:= self.validate_stream(key, entry_id):
+        stream = self.get(key)
+        if stream is not None and not isinstance(stream, Stream):
+            return Constants.ERROR_WRONGTYPE
+        if error := self.validate_stream(key, parsed_id):
             return error
 
-        current_time = int(time.time() * 1000)
-        self.store[key][0].append([entry_id, fields, current_time])
+        if stream is None:
+            stream = Stream()
+            self.save(key, stream)
+
+        stream.append(parsed_id, fields)
+        self.used_memory += StreamStore.stream_entry_size(fields)
+        for waiter in tuple(self.stream_waiters.get(key, ())):
+            waiter.wake()
         return entry_id
 
-    def get_stream_entries(self, key: str, start: str, end: str) -> list:
-        entries = self.get(key)
-        
-        if not entries:
-            return []
-
-        # Return all entries if both start and end are open ranges
-        if start == '-' and end == '+':
-            return entries
-
-        start_has_seq = '-' in start
-        end_has_seq = '-' in end
-
-        def within_start_range(entry_id: str) -> bool:
-            return start == '-' or (
-                start_has_seq and entry_id >= start
-            ) or (
-                not start_has_seq and entry_id.split('-')[0] > start
-            )
-
-        def within_end_range(entry_id: str) -> bool:
-            return end == '+' or (
-                end_has_seq and entry_id <= end
-            ) or (
-                not end_has_seq and entry_id.split('-')[0] <= end
-            )
-
-        return [
-            entry[:2] for entry in entries
-            if within_start_range(entry[0]) and within_end_range(entry[0])
-        ]
+    def get_stream_entries(self, key: bytes, start: bytes, end: bytes, count: int = None) -> list | bytes:
+        stream = self.read_stream(key)
+        try:
+            start_id, end_id = parse_range_start(start), parse_range_end(end)
+        except ValueError:
+            return Constants.ERROR_STREAM_ID
+
+        return stream.range(start_id, end_id, count) if stream else []
+
+    def get_stream_entries_reversed(self, key: bytes, end: bytes, start: bytes, count: int = None) -> list | bytes:
+        stream = self.read_stream(key)
+        try:
+            start_id, end_id = parse_range_start(start), parse_range_end(end)
+        except ValueError:
+            return Constants.ERROR_STREAM_ID
 
+        return stream.rev_range(end_id, start_id, count) if stream else []
@@ -0,0 +1,39 @@
+import threading
+
+class Transactions:
+    """
+    What makes MULTI/EXEC atomic and WATCH possible.
+
+    Commands run one at a time: the asyncio model runs them all on the event loop, the threaded
+    model has each client thread hold execution_lock around every command, the whole transaction
+    for EXEC, and the cron hold it while it changes the keyspace or forks a child snapshotting it.
+
+    WATCH is an optimistic lock: every watched key has a version counter, bumped by any change to
+    the key, and EXEC aborts the transaction if a key its client watches moved since WATCH. Keys
+    nobody watches have no counter, a write to them costs the check of an empty dict.
+    """
+
+    def __init__(self):
+        self.execution_lock = threading.Lock()
+
+    def watch_key(self, key: bytes) -> int:
+        """Count one more client watching key, returning its current version."""
+        entry = self.watched_keys.get(key)
+        if entry is None:
+            # [version, clients watching], dropped with the last client, none of which holds a version then
+            entry = self.watched_keys[key] = [0, 0]
+        entry[1] += 1
+        return entry[0]
+
+    def unwatch_key(self, key: bytes) -> None:
+        entry = self.watched_keys[key]
+        entry[1] -= 1
+        if not entry[1]:
+            del self.watched_keys[key]
+
+    def watched_key_version(self, key: bytes) -> int:
+        return self.watched_keys[key][0]
+
+    def signal_modified_keys(self, keys: list) -> None:
+        for key in keys:
+            self.signal_modified_key(key)
@@ -0,0 +1,45 @@
+import asyncio
+
+class Waiter:
+    """
+    A client blocked on a condition, such as new stream entries or replica acknowledgements, woken from whichever thread changes it.
+
+    The waiter binds to the loop of its first wait: a client of the threaded model registers it under the
+    execution lock, before the loop it blocks in exists, and a wake in between is kept for that first wait.
+    """
+
+    def __init__(self) -> None:
+        self.loop = None
+        self.future = None
+        self.woken = False
+
+    def wake(self) -> None:
+        self.woken = True
+        loop = self.loop
+        if loop is None:
+            return
+        # the caller already changed the condition, a write woken clients are waiting for must not fail here
+        try:
+            loop.call_soon_threadsafe(self._set_result)
+        except RuntimeError:
+            # a threaded client blocks in a loop of its own, closed once its command returned: nobody to wake
+            pass
+
+    def _set_result(self) -> None:
+        if not self.future.done():
+            self.future.set_result(None)
+
+    async def wait(self, timeout: float | None) -> bool:
+        if self.loop is None:
+            # bound before woken is read, so a wake after that schedules the future's result
+            self.loop = asyncio.get_running_loop()
+            self.future = self.loop.create_future()
+        if not self.woken:
+            try:
+                await asyncio.wait_for(self.future, timeout)
+            except asyncio.TimeoutError:
+                return False
+        self.woken = False
+        if self.future.done():
+            self.future = self.loop.create_future()
+        return True
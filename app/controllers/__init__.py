@@ -1,3 +1,5 @@
+from app.controllers.base_controller import BaseController
 from app.controllers.controller import Controller
+from app.controllers.async_controller import AsyncController
 
-__all__ = ['Controller']
\ No newline at end of file
+__all__ = ['BaseController', 'Controller', 'AsyncController']
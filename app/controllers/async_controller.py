@@ -0,0 +1,169 @@
+import time
+import asyncio
+import inspect
+
+from app.context import State
+from app.utils import RESPWriter
+from app.constants import Constants
+from app.controllers.base_controller import BaseController
+
+class AsyncController(BaseController):
+    """Serves one connection as a coroutine on the shared event loop."""
+
+    def __init__(self, state: State, reader: asyncio.StreamReader = None, writer: asyncio.StreamWriter = None) -> None:
+        super().__init__(state)
+        self.reader = reader
+        self.writer = writer
+        self.connection = writer
+        if writer is not None:
+            self.describe_connection(writer.get_extra_info('socket'))
+        self.replica_task = None
+        self.replica_ready = asyncio.Event()
+
+    async def run(self):
+        if self.writer is None:
+            # replica side: the handshake is blocking, a full resync loads the whole snapshot, so it runs
+            # in a thread and the event loop keeps answering clients, with -LOADING while the keyspace fills
+            connection = await asyncio.to_thread(self.handshake)
+            if connection is None:
+                return
+            self.reader, self.writer = await asyncio.open_connection(sock=connection)
+            self.connection = self.writer
+            self.describe_connection(connection)
+            self.state.master_link = self
+        else:
+            self.state.total_connections_received += 1
+            self.state.connected_clients += 1
+        self.state.link_client(self)
+
+        while True:
+            try:
+                await self.handle_commands()
+                if self.close_after_reply:
+                    break
+
+                # the replica keeps talking to us (REPLCONF ACK), so reading continues after PSYNC
+                if self.talking_to_replica and self.state.is_master() and self.replica_task is None:
+                    self.replica_task = asyncio.create_task(self.run_sync_replica())
+
+                raw_message = await self.reader.read(8000)
+                if not raw_message:
+                    break
+
+                self.last_interaction = time.monotonic()
+                self.state.net_input_bytes += len(raw_message)
+                self.parser.feed(raw_message)
+
+            except (ConnectionError, asyncio.IncompleteReadError):
+                break
+            except Exception as e:
+                print(f'Error processing command: {e}')
+                self.send(f'-Err: {e}')
+                self.flush()
+                break
+
+        if self.replica_task:
+            self.replica_task.cancel()
+        if self.is_master_link:
+            if self.state.master_link is self:
+                self.state.master_link = None
+        else:
+            self.state.connected_clients -= 1
+        self.unwatch_all_keys()
+        self.state.unlink_client(self)
+        self.writer.close()
+
+    async def handle_commands(self) -> None:
+        for args, bytes_processed in self.parser.read_commands():
+            command = self.decode_command(args)
+            result = self.process_command(command)
+            if inspect.isawaitable(result):
+                # replies to the commands pipelined before this one should not wait for it
+                self.flush()
+                await self.writer.drain()
+                result = await result
+
+            # a replica only ever answers its master's REPLCONF GETACK
+            if self.is_master_link and command[0] != Constants.REPL_CONF:
+                result = []
+
+            for message in result:
+                self.send(message)
+
+            if self.is_master_link:
+                self.state.increment_repl_offset(bytes_processed)
+            # the commands pipelined after CLIENT KILL of this client, or after it overcame its output buffer limits, are not run
+            if self.close_after_reply or self.killed:
+                break
+
+        self.flush()
+        # reading stops while the replies are above the transport's high water mark
+        await self.writer.drain()
+
+    def block(self, coroutine):
+        return coroutine
+
+    async def run_sync_replica(self):
+        buffer = self.state.buffers[self.connection]
+        try:
+            if buffer.waiting_snapshot or buffer.snapshot is not None:
+                while buffer.snapshot is None or not buffer.snapshot.done:
+                    await self.replica_ready.wait()
+                    self.replica_ready.clear()
+                await self.send_snapshot(buffer.snapshot)
+
+            while not self.writer.is_closing():
+                # the stream queued while the snapshot went out is already there, its wakeups were consumed
+                while not len(buffer) and not buffer.overflowed:
+                    await self.replica_ready.wait()
+                    self.replica_ready.clear()
+                if buffer.overflowed:
+                    # past the hard limit the stream stopped being queued, the replica has to resync
+                    self.state.check_output_buffer_limits(self)
+                    break
+                # everything queued since the last write goes out together
+                self.writer.writelines(buffer.drain())
+                await self.writer.drain()
+        except OSError as e:
+            print(f'Lost replica {self.connection}: {e}')
+            # ends the reading side too, the replica reconnects
+            self.writer.close()
+        finally:
+            if buffer.snapshot is not None:
+                buffer.snapshot.close()
+            self.state.remove_replica(self.connection)
+
+    async def send_snapshot(self, snapshot) -> None:
+        loop = asyncio.get_running_loop()
+        self.writer.write(snapshot.preamble())
+        # reading the pipe blocks until the child wrote more, so it is done off the event loop
+        while chunk := await loop.run_in_executor(None, snapshot.read):
+            self.writer.write(chunk)
+            await self.writer.drain()
+        self.writer.write(snapshot.trailer())
+        snapshot.close()
+
+    def wake_replica_writer(self) -> None:
+        # replication data is only queued from the event loop thread
+        self.replica_ready.set()
+
+    def send_replication_ack(self) -> None:
+        self.writer.write(RESPWriter.encode_command([Constants.REPL_CONF, Constants.ACK, str(self.state.master_repl_offset)]))
+
+    def kill(self) -> None:
+        self.killed = True
+        # drops what the transport still holds, the reading side then sees the end of the connection
+        self.writer.transport.abort()
+
+    def unsent_bytes(self) -> int:
+        return self.writer.transport.get_write_buffer_size() if self.writer else 0
+
+    def flush(self) -> None:
+        # replies acknowledge writes, so these must reach the AOF first
+        self.state.flush_append_only_file()
+        # over the output buffer limits of its class the client is disconnected instead
+        if self.killed or self.state.check_output_buffer_limits(self):
+            self.output.drain()
+            return
+        self.state.net_output_bytes += len(self.output)
+        self.writer.writelines(self.output.drain())
@@ -0,0 +1,836 @@
+import time
+import socket
+import itertools
+import collections
+
+from app.context import State
+from app.context.waiter import Waiter
+from app.utils import CLUSTER_SLOTS, RawReply, RESPReader, RESPWriter, key_hash_slot, parse_int
+from app.constants import Constants, CommandFlags
+from app.controllers.commands import COMMANDS, register_command, streams_keys
+
+perf_counter_ns = time.perf_counter_ns
+
+class BaseController:
+    """Command processing shared by the threaded and the asyncio connection handlers."""
+
+    def __init__(self, state: State) -> None:
+        self.state = state
+        self.talking_to_replica = False
+        self.is_master_link = False
+        # replays the AOF, so runs its commands while the server is loading
+        self.is_loader = False
+        self.is_multi_active = False
+        self.is_multi_dirty = False
+        self.is_executing_multi = False
+        # MULTI went to the AOF and the replicas ahead of the transaction's first write, EXEC must follow
+        self.is_multi_propagated = False
+        self.multi_commands_queue = collections.deque([])
+        # version of each WATCHed key when it was watched
+        self.watching: dict[bytes, int] = {}
+        self.parser = RESPReader()
+        self.output = RESPWriter()
+        # host:port of the client, as SLOWLOG reports it
+        self.address = ''
+        # replication offset right after this client's last write, the one WAIT waits for
+        self.write_offset = 0
+        # as CLIENT LIST reports it, the ID is assigned when the connection is linked to the state
+        self.id = 0
+        self.client_name = ''
+        self.local_address = ''
+        self.fd = -1
+        self.created = self.last_interaction = time.monotonic()
+        self.last_command = ''
+        self.killed = False
+        # set by CLIENT KILL of this very client, the connection closes once the reply is sent
+        self.close_after_reply = False
+        # when the output buffer was first seen over the soft limit of its class, 0 when it is not
+        self.obuf_soft_limit_reached_time = 0
+
+    @staticmethod
+    def decode_command(args: list) -> list:
+        # only the name is decoded, to look the command up, keys and values stay bytes
+        return [args[0].decode('utf-8', errors='replace').upper(), *args[1:]]
+
+    @staticmethod
+    def format_address(peername) -> str:
+        return f'{peername[0]}:{peername[1]}' if peername else ''
+
+    @staticmethod
+    def parse_client_type(arg: bytes) -> str | None:
+        """The class a TYPE argument of CLIENT LIST and KILL names, None when it is not one."""
+        client_type = arg.decode('utf-8', errors='replace').lower()
+        client_type = 'replica' if client_type == 'slave' else client_type
+        return client_type if client_type in ('normal', 'master', 'replica', 'pubsub') else None
+
+    @staticmethod
+    def keyword(arg: bytes) -> str:
+        """Decode an option or subcommand argument, uppercased to match it against Constants."""
+        return arg.decode('utf-8', errors='replace').upper()
+
+    def process_command(self, command: list) -> list:
+        spec = COMMANDS.get(command[0])
+        if spec is None:
+            args = ' '.join(f"'{arg.decode('utf-8', errors='replace')}'" for arg in command[1:])
+            return self.reject_command(f"ERR unknown command '{command[0]}', with args beginning with: {args}")
+        if not spec.check_arity(command):
+            (self.state.command_stats.get(spec.name) or self.state.add_command_stats(spec.name)).rejected_calls += 1
+            return self.reject_command(f"ERR wrong number of arguments for '{spec.name.lower()}' command")
+        self.last_command = spec.name
+
+        # a cluster node serves the keys of its own slots only, clients are sent to the node of the others
+        if self.state.cluster_slot_owner is not None and not self.is_master_link:
+            if redirect := self.state.cluster_redirect(spec.get_keys(command)):
+                return self.reject_command(redirect)
+
+        # until the dataset is loaded only the commands that do not need it are served
+        if self.state.loading and not spec.is_ok_loading and not self.is_loader:
+            (self.state.command_stats.get(spec.name) or self.state.add_command_stats(spec.name)).rejected_calls += 1
+            return self.reject_command(Constants.ERROR_LOADING)
+
+        if self.is_multi_active and spec.name not in (Constants.EXEC, Constants.DISCARD, Constants.MULTI, Constants.WATCH):
+            self.multi_commands_queue.append(command)
+            return [Constants.QUEUED]
+
+        # keys are evicted before any command runs, the ones that may grow the dataset are refused
+        # while it does not fit; a replica leaves eviction to its master, which sends the DELs
+        if self.state.config['maxmemory'] and not self.is_master_link and self.state.is_master():
+            if not self.state.free_memory_if_needed() and spec.is_denyoom:
+                (self.state.command_stats.get(spec.name) or self.state.add_command_stats(spec.name)).rejected_calls += 1
+                return self.reject_command(Constants.ERROR_OOM)
+
+        start = perf_counter_ns()
+        result = spec.handler(self, command)
+        usec = (perf_counter_ns() - start) // 1000
+
+        # accounted inline, on GET a method call would cost as much as the accounting itself
+        state = self.state
+        stats = state.command_stats.get(spec.name) or state.add_command_stats(spec.name)
+        stats.calls += 1
+        stats.usec += usec
+        stats.histogram[usec.bit_length()] += 1
+        reply = result[0] if result.__class__ is list and result else None
+        failed = reply.__class__ is RawReply and reply[:1] == b'-' or reply.__class__ is str and reply.startswith('ERR')
+        if failed:
+            stats.failed_calls += 1
+        if usec >= state.config['slowlog_log_slower_than'] >= 0:
+            state.slowlog_push(command, usec, self.address)
+
+        # a write refused with an error changed nothing: no snapshot is due, nothing to send, no WATCH to break
+        if spec.is_write and not failed:
+            self.state.dirty += 1
+            # as Redis does, the writes of a transaction are propagated in a MULTI/EXEC block of their own,
+            # so that a replica or an AOF replay never applies part of them
+            if self.is_executing_multi and not self.is_multi_propagated:
+                self.state.propagate([Constants.MULTI])
+                self.is_multi_propagated = True
+            self.state.propagate(command)
+            self.write_offset = self.state.master_repl_offset
+            if self.state.watched_keys:
+                self.state.signal_modified_keys(spec.get_keys(command))
+
+        return result
+
+    def execute_command(self, args: list) -> list:
+        """Run a command read from somewhere other than a client connection, such as the AOF."""
+        return self.process_command(self.decode_command(args))
+
+    def reject_command(self, error: str) -> list:
+        # a transaction with a command that could not be queued is refused by EXEC
+        if self.is_multi_active:
+            self.is_multi_dirty = True
+        return [error]
+
+    @register_command(Constants.PING, -1, (CommandFlags.FAST, CommandFlags.LOADING, CommandFlags.STALE))
+    def handle_ping(self, command: list) -> list:
+        return [command[1]] if len(command) > 1 else [Constants.PONG]
+
+    @register_command(Constants.ECHO, 2, (CommandFlags.FAST,))
+    def handle_echo(self, command: list) -> list:
+        return [command[1]]
+
+    @register_command(Constants.GET, 2, (CommandFlags.READONLY, CommandFlags.FAST), 1, 1, 1)
+    def handle_get(self, command: list) -> list:
+        return [self.state.get_string(command[1])]
+
+    @register_command(Constants.SET, -3, (CommandFlags.WRITE, CommandFlags.DENYOOM), 1, 1, 1)
+    def handle_set(self, command: list) -> list:
+        _, key, value, *options = command
+        ttl = None
+
+        if len(options) % 2:
+            return [Constants.ERROR_SYNTAX]
+        for option, amount in zip(options[::2], options[1::2]):
+            if not amount.isdigit():
+                return [Constants.ERROR_NON_INT]
+            option = self.keyword(option)
+            if option == Constants.PX:
+                ttl = int(amount) + time.time() * 1000
+            elif option == Constants.EX:
+                ttl = int(amount) * 1000 + time.time() * 1000
+            elif option == Constants.PXAT:
+                ttl = int(amount)
+            elif option == Constants.EXAT:
+                ttl = int(amount) * 1000
+            else:
+                return [Constants.ERROR_SYNTAX]
+
+        self.state.save(key, value, ttl)
+        if ttl is not None:
+            # the AOF and replicas get the absolute expiry, a replay later must not extend it
+            command[3:] = [Constants.PXAT, str(int(ttl))]
+        return [Constants.OK]
+
+    @register_command(Constants.TYPE, 2, (CommandFlags.READONLY, CommandFlags.FAST), 1, 1, 1)
+    def handle_type(self, command: list) -> list:
+        return [self.state.get_type(command[1])]
+
+    @register_command(Constants.MGET, -2, (CommandFlags.READONLY, CommandFlags.FAST), 1, -1, 1)
+    def handle_mget(self, command: list) -> list:
+        return [self.state.get_many(command[1:])]
+
+    @register_command(Constants.MSET, -3, (CommandFlags.WRITE, CommandFlags.DENYOOM), 1, -1, 2)
+    def handle_mset(self, command: list) -> list:
+        if len(command) % 2 == 0:
+            return ["ERR wrong number of arguments for 'mset' command"]
+        self.state.save_many(command[1::2], command[2::2])
+        return [Constants.OK]
+
+    @register_command(Constants.DEL, -2, (CommandFlags.WRITE,), 1, -1, 1)
+    def handle_del(self, command: list) -> list:
+        return [self.state.delete_many(command[1:])]
+
+    @register_command(Constants.EXISTS, -2, (CommandFlags.READONLY, CommandFlags.FAST), 1, -1, 1)
+    def handle_exists(self, command: list) -> list:
+        return [self.state.count_existing(command[1:])]
+
+    @register_command(Constants.CONFIG, -2, (CommandFlags.ADMIN, CommandFlags.LOADING, CommandFlags.STALE))
+    def handle_config(self, command: list) -> list:
+        if self.keyword(command[1]) != Constants.GET or len(command) != 3:
+            return [Constants.ERROR_SYNTAX]
+        key = command[2]
+        value = self.state.get_config(key.decode('utf-8', errors='replace'))
+        # an unknown option is an empty array, as in Redis
+        return [[] if value is None else [key, value.encode()]]
+
+    @register_command(Constants.KEYS, 2, (CommandFlags.READONLY,))
+    def handle_keys(self, command: list) -> list:
+        return [self.state.keys(command[1])]
+
+    @register_command(Constants.SCAN, -2, (CommandFlags.READONLY,))
+    def handle_scan(self, command: list) -> list:
+        cursor = parse_int(command[1])
+        if cursor is None or cursor < 0:
+            return [Constants.ERROR_INVALID_CURSOR]
+
+        options = command[2:]
+        if len(options) % 2:
+            return [Constants.ERROR_SYNTAX]
+        count, pattern, value_type = 10, None, None
+        for option, value in zip(options[::2], options[1::2]):
+            option = self.keyword(option)
+            if option == Constants.COUNT:
+                if not value.isdigit():
+                    return [Constants.ERROR_NON_INT]
+                count = int(value)
+                if count < 1:
+                    return [Constants.ERROR_SYNTAX]
+            elif option == Constants.MATCH:
+                pattern = value
+            elif option == Constants.TYPE:
+                value_type = value.decode('utf-8', errors='replace').lower()
+            else:
+                return [Constants.ERROR_SYNTAX]
+
+        cursor, keys = self.state.scan(cursor, count, pattern)
+        if value_type is not None:
+            keys = [key for key in keys if self.state.get_type(key) == value_type]
+        return [[b'%d' % cursor, keys]]
+
+    @register_command(Constants.INFO, -1, (CommandFlags.LOADING, CommandFlags.STALE))
+    def handle_info(self, command: list) -> list:
+        return [self.state.get_info(self.keyword(command[1]) if len(command) > 1 else None)]
+
+    @register_command(Constants.CLUSTER, -2, (CommandFlags.LOADING, CommandFlags.STALE))
+    def handle_cluster(self, command: list) -> list:
+        state = self.state
+        if state.cluster_slot_owner is None:
+            return [Constants.ERROR_CLUSTER_DISABLED]
+
+        subcommand, args = self.keyword(command[1]), command[2:]
+        if subcommand == Constants.KEYSLOT and len(args) == 1:
+            return [key_hash_slot(args[0])]
+        if subcommand == Constants.COUNTKEYSINSLOT and len(args) == 1 or subcommand == Constants.GETKEYSINSLOT and len(args) == 2:
+            slot = parse_int(args[0])
+            if slot is None or not 0 <= slot < CLUSTER_SLOTS:
+                return [Constants.ERROR_INVALID_SLOT]
+            keys = state.keys_in_slot(slot)
+            if subcommand == Constants.COUNTKEYSINSLOT:
+                return [len(keys)]
+            count = parse_int(args[1])
+            if count is None or count < 0:
+                return [Constants.ERROR_NON_INT]
+            return [keys[:count]]
+        if args:
+            return [Constants.ERROR_SYNTAX]
+
+        match subcommand:
+            case Constants.INFO:
+                return [state.get_cluster_info()]
+            case Constants.MYID:
+                return [state.cluster_myself.id.encode()]
+            case Constants.SLOTS:
+                return [state.get_cluster_slots()]
+            case Constants.SHARDS:
+                return [state.get_cluster_shards()]
+            case Constants.NODES:
+                return [state.get_cluster_nodes()]
+        return [Constants.ERROR_SYNTAX]
+
+    @register_command(Constants.COMMAND, -1, (CommandFlags.LOADING, CommandFlags.STALE))
+    def handle_command(self, command: list) -> list:
+        if len(command) == 1:
+            return [[spec.info() for spec in COMMANDS.values()]]
+
+        match [self.keyword(arg) for arg in command[1:]]:
+            case [Constants.COUNT]:
+                return [len(COMMANDS)]
+            case [Constants.INFO, *names]:
+                specs = [COMMANDS.get(name) for name in names] if names else COMMANDS.values()
+                return [[spec.info() if spec else None for spec in specs]]
+            case _:
+                return [Constants.ERROR_SYNTAX]
+
+    @register_command(Constants.CLIENT, -2, (CommandFlags.LOADING, CommandFlags.STALE))
+    def handle_client(self, command: list) -> list:
+        match [self.keyword(command[1]), *command[2:]]:
+            case [Constants.ID]:
+                return [self.id]
+            case [Constants.GETNAME]:
+                return [self.client_name.encode() if self.client_name else None]
+            case [Constants.SETNAME, name]:
+                # CLIENT LIST separates its fields with spaces
+                if any(byte <= 32 or byte > 126 for byte in name):
+                    return [Constants.ERROR_CLIENT_NAME]
+                self.client_name = name.decode()
+                return [Constants.OK]
+            case [Constants.INFO]:
+                return [(self.client_info() + '\n').encode()]
+            case [Constants.LIST, *filters]:
+                return self.client_list(filters)
+            case [Constants.KILL, address]:
+                # the old form, by address, replies OK rather than the number of clients killed
+                address = address.decode('utf-8', errors='replace')
+                for client in self.state.get_clients():
+                    if client.address == address:
+                        self.kill_client(client)
+                        return [Constants.OK]
+                return [Constants.ERROR_NO_SUCH_CLIENT]
+            case [Constants.KILL, *filters]:
+                return self.client_kill(filters)
+            case _:
+                return [Constants.ERROR_SYNTAX]
+
+    def client_list(self, filters: list) -> list:
+        clients = self.state.get_clients()
+        match [self.keyword(filters[0]), *filters[1:]] if filters else []:
+            case []:
+                pass
+            case [Constants.TYPE, client_type]:
+                if (client_type := self.parse_client_type(client_type)) is None:
+                    return [f"ERR Unknown client type '{filters[1].decode('utf-8', errors='replace')}'"]
+                clients = [client for client in clients if client.client_type() == client_type]
+            case [Constants.ID, *ids] if ids:
+                ids = {parse_int(id) for id in ids}
+                if None in ids or min(ids) < 1:
+                    return [Constants.ERROR_INVALID_CLIENT_ID]
+                clients = [client for client in clients if client.id in ids]
+            case _:
+                return [Constants.ERROR_SYNTAX]
+        return [''.join(client.client_info() + '\n' for client in clients).encode()]
+
+    def client_kill(self, filters: list) -> list:
+        """CLIENT KILL with <filter> <value> pairs, every one of which a client must match to be killed."""
+        if not filters or len(filters) % 2:
+            return [Constants.ERROR_SYNTAX]
+        clients, skip_me, now = self.state.get_clients(), True, time.monotonic()
+        for option, value in zip(filters[::2], filters[1::2]):
+            match self.keyword(option):
+                case Constants.ID:
+                    id = parse_int(value)
+                    if id is None or id < 1:
+                        return [Constants.ERROR_INVALID_CLIENT_ID]
+                    clients = [client for client in clients if client.id == id]
+                case Constants.TYPE:
+                    if (client_type := self.parse_client_type(value)) is None:
+                        return [f"ERR Unknown client type '{value.decode('utf-8', errors='replace')}'"]
+                    clients = [client for client in clients if client.client_type() == client_type]
+                case Constants.ADDR:
+                    clients = [client for client in clients if client.address == value.decode('utf-8', errors='replace')]
+                case Constants.LADDR:
+                    clients = [client for client in clients if client.local_address == value.decode('utf-8', errors='replace')]
+                case Constants.SKIPME if self.keyword(value) in (Constants.YES, Constants.NO):
+                    skip_me = self.keyword(value) == Constants.YES
+                case Constants.MAXAGE:
+                    max_age = parse_int(value)
+                    if max_age is None or max_age < 0:
+                        return [Constants.ERROR_NON_INT]
+                    clients = [client for client in clients if now - client.created > max_age]
+                case _:
+                    return [Constants.ERROR_SYNTAX]
+
+        if skip_me:
+            clients = [client for client in clients if client is not self]
+        for client in clients:
+            self.kill_client(client)
+        return [len(clients)]
+
+    def kill_client(self, client: 'BaseController') -> None:
+        if client is self:
+            self.close_after_reply = True
+        else:
+            client.kill()
+
+    @register_command(Constants.REPL_CONF, -1, (CommandFlags.ADMIN, CommandFlags.LOADING, CommandFlags.STALE))
+    def handle_replconf(self, command: list) -> list:
+        match [self.keyword(command[1]), *command[2:]]:
+            case [Constants.GETACK, _]:
+                return [[Constants.REPL_CONF, Constants.ACK, str(self.state.master_repl_offset)]]
+            case [Constants.ACK, offset, *_]:
+                if (offset := parse_int(offset)) is not None:
+                    self.state.acknowledge_replica(self.connection, offset)
+                return []
+            case _:
+                return [Constants.OK]
+
+    @register_command(Constants.PYSNC, 3, (CommandFlags.ADMIN,))
+    def handle_psync(self, command: list) -> list:
+        _, requested_replid, offset = command
+        requested_replid = requested_replid.decode('utf-8', errors='replace')
+        offset = int(offset) if offset.lstrip(b'-').isdigit() else -1
+
+        self.talking_to_replica = True
+        missing = self.state.add_new_replica(self.connection, self.wake_replica_writer, requested_replid, offset)
+        if missing is not None:
+            return [RawReply(f"+CONTINUE {self.state.config['master_replid']}\r\n".encode()), RawReply(missing)]
+        # the replica's writer sends FULLRESYNC and the snapshot once a child is writing it
+        self.state.start_full_sync()
+        return []
+
+    @register_command(Constants.SAVE, 1, (CommandFlags.ADMIN,))
+    def handle_save(self, command: list) -> list:
+        if self.state.rdb_child_pid is not None:
+            return [Constants.ERROR_BGSAVE_IN_PROGRESS]
+        return [Constants.OK if self.state.save_snapshot() else Constants.ERROR_SAVE]
+
+    @register_command(Constants.BGSAVE, 1, (CommandFlags.ADMIN,))
+    def handle_bgsave(self, command: list) -> list:
+        if self.state.rdb_child_pid is not None:
+            return [Constants.ERROR_BGSAVE_IN_PROGRESS]
+        if self.state.aof_child_pid is not None:
+            return [Constants.ERROR_BGSAVE_AOF_REWRITE]
+        return [Constants.BGSAVE_STARTED if self.state.bgsave() else Constants.ERROR_SAVE]
+
+    @register_command(Constants.BGREWRITEAOF, 1, (CommandFlags.ADMIN,))
+    def handle_bgrewriteaof(self, command: list) -> list:
+        if self.state.aof_child_pid is not None:
+            return [Constants.ERROR_BGREWRITEAOF_IN_PROGRESS]
+        if self.state.rdb_child_pid is not None:
+            # started by the cron once the snapshot is written
+            self.state.aof_rewrite_scheduled = True
+            return [Constants.BGREWRITEAOF_SCHEDULED]
+        return [Constants.BGREWRITEAOF_STARTED if self.state.bgrewriteaof() else Constants.ERROR_BGREWRITEAOF]
+
+    @register_command(Constants.LASTSAVE, 1, (CommandFlags.FAST, CommandFlags.LOADING, CommandFlags.STALE))
+    def handle_lastsave(self, command: list) -> list:
+        return [self.state.lastsave]
+
+    @register_command(Constants.XADD, -5, (CommandFlags.WRITE, CommandFlags.DENYOOM, CommandFlags.FAST), 1, 1, 1)
+    def handle_xadd(self, command: list) -> list:
+        _, stream_key, id, *fields = command
+        if len(fields) % 2:
+            return ["ERR wrong number of arguments for 'xadd' command"]
+
+        entry_id = self.state.generate_stream_entry_id(stream_key, id)
+        res = self.state.save_stream(stream_key, entry_id, fields)
+        # replicas must store the ID generated here rather than generate their own
+        command[2] = entry_id
+        return [res]
+
+    @register_command(Constants.XRANGE, -4, (CommandFlags.READONLY,), 1, 1, 1)
+    def handle_xrange(self, command: list) -> list:
+        _, stream_key, start, end, *options = command
+        match options:
+            case []:
+                count = None
+            case [option, count] if self.keyword(option) == Constants.COUNT and count.isdigit():
+                count = int(count)
+            case _:
+                return [Constants.ERROR_SYNTAX]
+        return [self.state.get_stream_entries(stream_key, start, end, count)]
+
+    @register_command(Constants.XREVRANGE, -4, (CommandFlags.READONLY,), 1, 1, 1)
+    def handle_xrevrange(self, command: list) -> list:
+        _, stream_key, end, start, *options = command
+        match options:
+            case []:
+                count = None
+            case [option, count] if self.keyword(option) == Constants.COUNT and count.isdigit():
+                count = int(count)
+            case _:
+                return [Constants.ERROR_SYNTAX]
+        return [self.state.get_stream_entries_reversed(stream_key, end, start, count)]
+
+    @register_command(Constants.XREAD, -4, (CommandFlags.READONLY, CommandFlags.BLOCKING, CommandFlags.MOVABLE_KEYS), keys_proc=streams_keys)
+    def handle_xread(self, command: list) -> list:
+        count, timeout, i = None, None, 1
+        while i < len(command) - 1:
+            option, value = self.keyword(command[i]), command[i + 1]
+            if option == Constants.STREAMS:
+                break
+            if option not in (Constants.COUNT, Constants.BLOCK) or not value.isdigit():
+                return [Constants.ERROR_SYNTAX]
+            if option == Constants.COUNT:
+                count = int(value)
+            else:
+                timeout = int(value)
+            i += 2
+
+        streams = command[i + 1:]
+        if self.keyword(command[i]) != Constants.STREAMS or not streams:
+            return [Constants.ERROR_SYNTAX]
+        if len(streams) % 2:
+            return [Constants.ERROR_XREAD_STREAMS]
+        keys, ids = streams[:len(streams) // 2], streams[len(streams) // 2:]
+
+        # blocking reads inside EXEC are served without blocking, as in Redis
+        if timeout is not None and not self.is_executing_multi:
+            blocked = self.state.block_on_streams(keys, ids)
+            if blocked.__class__ is not tuple:
+                return [blocked]
+            after, waiter = blocked
+            try:
+                return self.block(self.read_blocking_streams(keys, after, waiter, timeout, count))
+            except BaseException:
+                # the threaded model may fail before the coroutine, which unregisters the waiter, ever ran
+                self.state.remove_stream_waiter(keys, waiter)
+                raise
+        return [self.state.read_multiple_streams(keys, ids, count)]
+
+    @register_command(Constants.INCR, 2, (CommandFlags.WRITE, CommandFlags.DENYOOM, CommandFlags.FAST), 1, 1, 1)
+    def handle_incr(self, command: list) -> list:
+        return [self.state.incr(command[1])]
+
+    @register_command(Constants.INCRBY, 3, (CommandFlags.WRITE, CommandFlags.DENYOOM, CommandFlags.FAST), 1, 1, 1)
+    def handle_incrby(self, command: list) -> list:
+        amount = parse_int(command[2])
+        return [Constants.ERROR_NON_INT if amount is None else self.state.incr(command[1], amount)]
+
+    @register_command(Constants.DECR, 2, (CommandFlags.WRITE, CommandFlags.DENYOOM, CommandFlags.FAST), 1, 1, 1)
+    def handle_decr(self, command: list) -> list:
+        return [self.state.incr(command[1], -1)]
+
+    @register_command(Constants.DECRBY, 3, (CommandFlags.WRITE, CommandFlags.DENYOOM, CommandFlags.FAST), 1, 1, 1)
+    def handle_decrby(self, command: list) -> list:
+        amount = parse_int(command[2])
+        return [Constants.ERROR_NON_INT if amount is None else self.state.incr(command[1], -amount)]
+
+    @register_command(Constants.MEMORY, -3, (CommandFlags.READONLY,), 2, 2, 1)
+    def handle_memory(self, command: list) -> list:
+        match [self.keyword(command[1]), *command[2:]]:
+            case [Constants.USAGE, key]:
+                return [self.state.memory_usage(key)]
+            case [Constants.USAGE, key, option, samples] if self.keyword(option) == Constants.SAMPLES and samples.isdigit():
+                return [self.state.memory_usage(key, int(samples))]
+            case _:
+                return [Constants.ERROR_SYNTAX]
+
+    @register_command(Constants.SLOWLOG, -2, (CommandFlags.ADMIN, CommandFlags.LOADING, CommandFlags.STALE))
+    def handle_slowlog(self, command: list) -> list:
+        match [self.keyword(command[1]), *command[2:]]:
+            case [Constants.GET]:
+                return [list(itertools.islice(self.state.slowlog, 10))]
+            case [Constants.GET, count] if parse_int(count) is not None and parse_int(count) >= -1:
+                count = parse_int(count)
+                return [list(self.state.slowlog) if count == -1 else list(itertools.islice(self.state.slowlog, count))]
+            case [Constants.LEN]:
+                return [len(self.state.slowlog)]
+            case [Constants.RESET]:
+                self.state.slowlog.clear()
+                return [Constants.OK]
+            case _:
+                return [Constants.ERROR_SYNTAX]
+
+    @register_command(Constants.LATENCY, -2, (CommandFlags.ADMIN, CommandFlags.LOADING, CommandFlags.STALE))
+    def handle_latency(self, command: list) -> list:
+        if self.keyword(command[1]) != Constants.HISTOGRAM:
+            return [Constants.ERROR_SYNTAX]
+        names = [self.keyword(name) for name in command[2:]] or sorted(self.state.command_stats)
+        reply = []
+        for name in names:
+            stats = self.state.command_stats.get(name)
+            if stats is not None and stats.calls:
+                reply += [name.lower(), ['calls', stats.calls, 'histogram_usec', stats.cumulative_histogram()]]
+        return [reply]
+
+    @register_command(Constants.WAIT, 3, (CommandFlags.BLOCKING,))
+    def handle_wait_command(self, command: list) -> list:
+        count, timeout = parse_int(command[1]), parse_int(command[2])
+        if count is None or timeout is None:
+            return [Constants.ERROR_NON_INT]
+        if timeout < 0:
+            return [Constants.ERROR_NEGATIVE_TIMEOUT]
+
+        # nothing to wait for once enough replicas, or all of them, acknowledged this client's last write
+        acked = self.state.count_replica_acks(self.write_offset)
+        if acked >= count or acked == len(self.state.repl_connections) or self.is_executing_multi:
+            return [acked]
+        return self.block(self.wait_for_replicas(count, timeout))
+
+    @register_command(Constants.MULTI, 1, (CommandFlags.FAST, CommandFlags.LOADING, CommandFlags.STALE))
+    def handle_multi(self, command: list) -> list:
+        if self.is_multi_active:
+            return [Constants.ERROR_NESTED_MULTI]
+        self.is_multi_active = True
+        self.is_multi_dirty = False
+        self.multi_commands_queue.clear()
+        return [Constants.OK]
+
+    @register_command(Constants.EXEC, 1, (CommandFlags.LOADING, CommandFlags.STALE))
+    def handle_exec(self, command: list) -> list:
+        if not self.is_multi_active:
+            return [Constants.ERROR_EXEC]
+
+        self.is_multi_active = False
+        if self.is_multi_dirty:
+            self.multi_commands_queue.clear()
+            self.unwatch_all_keys()
+            return [Constants.ERROR_EXECABORT]
+        # another write to a watched key since WATCH, the transaction is not run
+        if self.watching and self.watched_keys_modified():
+            self.multi_commands_queue.clear()
+            self.unwatch_all_keys()
+            return [Constants.NULL_ARRAY]
+        self.unwatch_all_keys()
+
+        self.is_executing_multi = True
+        result = []
+        try:
+            for multi_command in self.multi_commands_queue:
+                for res in self.process_command(multi_command):
+                    result.append(res)
+        finally:
+            self.is_executing_multi = False
+            self.multi_commands_queue.clear()
+            if self.is_multi_propagated:
+                self.is_multi_propagated = False
+                self.state.propagate([Constants.EXEC])
+                self.write_offset = self.state.master_repl_offset
+
+        return [result]
+
+    @register_command(Constants.DISCARD, 1, (CommandFlags.FAST, CommandFlags.LOADING, CommandFlags.STALE))
+    def handle_discard(self, command: list) -> list:
+        if not self.is_multi_active:
+            return [Constants.ERROR_DISCARD]
+        self.is_multi_active = False
+        self.multi_commands_queue.clear()
+        self.unwatch_all_keys()
+        return [Constants.OK]
+
+    @register_command(Constants.WATCH, -2, (CommandFlags.FAST,), 1, -1, 1)
+    def handle_watch(self, command: list) -> list:
+        if self.is_multi_active:
+            return [Constants.ERROR_WATCH_IN_MULTI]
+        for key in command[1:]:
+            if key not in self.watching:
+                # a key past its TTL goes now, its deletion must not count as a change after WATCH
+                self.state.is_expired(key)
+                self.watching[key] = self.state.watch_key(key)
+        return [Constants.OK]
+
+    @register_command(Constants.UNWATCH, 1, (CommandFlags.FAST,))
+    def handle_unwatch(self, command: list) -> list:
+        self.unwatch_all_keys()
+        return [Constants.OK]
+
+    def watched_keys_modified(self) -> bool:
+        for key, version in self.watching.items():
+            # expired since WATCH counts as modified, even if no command read the key since
+            self.state.is_expired(key)
+            if self.state.watched_key_version(key) != version:
+                return True
+        return False
+
+    def unwatch_all_keys(self) -> None:
+        for key in self.watching:
+            self.state.unwatch_key(key)
+        self.watching.clear()
+
+    def block(self, coroutine):
+        """
+        Run a blocking command.
+        :param coroutine: Coroutine resolving to the command's list of replies.
+        :return: The replies, or an awaitable resolving to them.
+        """
+        raise NotImplementedError
+
+    def send(self, message) -> None:
+        # the replies of a killed client are never sent
+        if self.killed:
+            return
+        self.output.write(message)
+        # checked on every reply, as Redis does, the hard limit bounds the buffer itself and not only
+        # what is left of it once a batch of pipelined commands ran
+        self.state.check_output_buffer_limits(self)
+
+    def describe_connection(self, sock) -> None:
+        """Record the addresses and the descriptor of the connection, as CLIENT LIST reports them."""
+        self.address = self.format_address(sock.getpeername())
+        self.local_address = self.format_address(sock.getsockname())
+        self.fd = sock.fileno()
+
+    def client_type(self) -> str:
+        if self.is_master_link:
+            return 'master'
+        return 'replica' if self.talking_to_replica else 'normal'
+
+    def replica_buffer(self):
+        """The replication stream queued for this client, when it is a replica."""
+        return self.state.buffers.get(self.connection) if self.talking_to_replica else None
+
+    def output_buffer_size(self) -> int:
+        """Bytes written to this client and not sent yet: replies, socket writes in progress and queued replication stream."""
+        buffer = self.replica_buffer()
+        return len(self.output) + self.unsent_bytes() + (buffer.size if buffer else 0)
+
+    def client_info(self) -> str:
+        """The line of CLIENT LIST and CLIENT INFO describing this client, with the fields of Redis that apply."""
+        now = time.monotonic()
+        flags = ('M' if self.is_master_link else 'S' if self.talking_to_replica else '') + ('x' if self.is_multi_active else '')
+        flags += 'c' if self.close_after_reply else 'A' if self.killed else ''
+        buffer = self.replica_buffer()
+        omem = self.output_buffer_size()
+        return (
+            f'id={self.id} addr={self.address} laddr={self.local_address} fd={self.fd} name={self.client_name} '
+            f'age={int(now - self.created)} idle={int(now - self.last_interaction)} flags={flags or "N"} db=0 sub=0 psub=0 '
+            f'multi={len(self.multi_commands_queue) if self.is_multi_active else -1} watch={len(self.watching)} qbuf={self.parser.pending()} '
+            f'obl={len(self.output)} oll={len(buffer) if buffer else 0} omem={omem} tot-mem={len(self.parser.buffer) + omem} '
+            f'events=r{"w" if omem else ""} cmd={self.last_command.lower() or "NULL"} user=default'
+        )
+
+    def unsent_bytes(self) -> int:
+        """Bytes handed to the connection and not sent yet."""
+        raise NotImplementedError
+
+    def kill(self) -> None:
+        """Close the connection from any thread, without waiting for pending replies to be sent."""
+        raise NotImplementedError
+
+    def flush(self) -> None:
+        """Write out every reply buffered since the last flush."""
+        raise NotImplementedError
+
+    async def read_blocking_streams(self, keys: list, after: list, waiter: Waiter, timeout: int, count: int = None) -> list:
+        return [await self.state.read_blocking_streams(keys, after, waiter, timeout, count)]
+
+    async def wait_for_replicas(self, count: int, timeout: int) -> list:
+        # a timeout of 0 blocks until enough replicas acknowledged
+        return [await self.state.wait_for_replicas(count, self.write_offset, timeout / 1000 or None)]
+
+    def send_replication_ack(self) -> None:
+        """On the link to the master, report the offset processed so far."""
+        raise NotImplementedError
+
+    def wake_replica_writer(self) -> None:
+        """Signal the writer of this replica connection that replication data is queued."""
+        raise NotImplementedError
+
+    def handshake(self) -> socket.socket | None:
+        self.is_master_link = True
+        connection = None
+        pending = bytearray()
+
+        def receive(size: int):
+            while len(pending) < size:
+                data = connection.recv(65536)
+                if not data:
+                    raise ConnectionError('master closed the connection')
+                pending.extend(data)
+
+        def read_line() -> str:
+            while (end := pending.find(b'\r\n')) == -1:
+                receive(len(pending) + 1)
+            line = bytes(pending[:end])
+            del pending[:end + 2]
+            return line.decode()
+
+        def snapshot_chunks(header: str):
+            """
+            The snapshot following FULLRESYNC, as it is received: $<length> bytes, or with a diskless
+            master, whose length is not known in advance, $EOF:<mark> and the bytes up to that mark.
+            Whatever was received after it stays in pending.
+            """
+            if header.startswith('$EOF:'):
+                mark = header[5:].encode()
+                while (end := pending.find(mark)) == -1:
+                    # all but what could be the start of the mark
+                    if len(pending) > len(mark):
+                        chunk = bytes(pending[:-len(mark)])
+                        del pending[:-len(mark)]
+                        yield chunk
+                    receive(len(pending) + 1)
+                chunk = bytes(pending[:end])
+                del pending[:end + len(mark)]
+                yield chunk
+                return
+
+            remaining = int(header[1:])
+            while remaining:
+                if not pending:
+                    receive(1)
+                chunk = bytes(pending[:remaining])
+                del pending[:len(chunk)]
+                remaining -= len(chunk)
+                yield chunk
+
+        try:
+            connection = socket.create_connection((self.state.config['master_host'], self.state.config['master_port']))
+            connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+            for command in (['PING'], ['REPLCONF', 'listening-port', str(self.state.config['port'])], ['REPLCONF', 'capa', 'eof', 'capa', 'psync2']):
+                connection.sendall(RESPWriter.encode_command(command))
+                read_line()
+
+            # after a lost link, ask to continue from the last processed byte
+            replid = self.state.config['master_replid']
+            psync = ['PSYNC', replid, str(self.state.master_repl_offset + 1)] if replid else ['PSYNC', '?', '-1']
+            connection.sendall(RESPWriter.encode_command(psync))
+            reply = read_line()
+
+            if reply.startswith('+FULLRESYNC'):
+                _, replid, offset = reply.split()
+                header = read_line()
+                chunks = snapshot_chunks(header)
+                # the handshake runs beside the cron, which must not expire keys out of a dict being cleared
+                with self.state.execution_lock:
+                    self.state.flush()
+                self.state.load_rdb_stream(chunks, 0 if header.startswith('$EOF:') else int(header[1:]))
+                # the checksum after the end of file opcode, which the loader stops at
+                for _ in chunks:
+                    pass
+                self.state.config['master_replid'], self.state.master_repl_offset = replid, int(offset)
+            elif reply.startswith('+CONTINUE'):
+                _, *new_replid = reply.split()
+                if new_replid:
+                    self.state.config['master_replid'] = new_replid[0]
+            else:
+                raise ConnectionError(f'Unexpected PSYNC reply {reply}')
+
+            # commands the master sent right behind the snapshot
+            self.parser.feed(pending)
+            return connection
+        except Exception as e:
+            if connection:
+                connection.close()
+            print(f'Error during handshake: {e}')
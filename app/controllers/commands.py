@@ -0,0 +1,66 @@
+from app.utils import RawReply
+from app.constants import CommandFlags
+
+class Command:
+    """Static description of a command: its handler, arity, flags and key positions."""
+
+    __slots__ = ('name', 'handler', 'arity', 'flags', 'first_key', 'last_key', 'step', 'keys_proc', 'is_write', 'is_denyoom', 'is_ok_loading')
+
+    def __init__(self, name: str, handler, arity: int, flags: tuple, first_key: int, last_key: int, step: int, keys_proc=None) -> None:
+        self.name = name
+        self.handler = handler
+        self.arity = arity
+        self.flags = flags
+        self.first_key = first_key
+        self.last_key = last_key
+        self.step = step
+        # finds the keys of a command whose key positions depend on its arguments
+        self.keys_proc = keys_proc
+        self.is_write = CommandFlags.WRITE in flags
+        self.is_denyoom = CommandFlags.DENYOOM in flags
+        self.is_ok_loading = CommandFlags.LOADING in flags
+
+    def check_arity(self, command: list) -> bool:
+        # a positive arity is exact, a negative one is a minimum, both count the command name
+        if self.arity > 0:
+            return len(command) == self.arity
+        return len(command) >= -self.arity
+
+    def get_keys(self, command: list) -> list:
+        if self.keys_proc is not None:
+            return self.keys_proc(command)
+        if not self.first_key:
+            return []
+        last_key = self.last_key if self.last_key >= 0 else len(command) + self.last_key
+        return command[self.first_key:last_key + 1:self.step]
+
+    def info(self) -> list:
+        return [
+            self.name.lower(),
+            self.arity,
+            [RawReply(b'+%s\r\n' % flag.encode()) for flag in self.flags],
+            self.first_key,
+            self.last_key,
+            self.step,
+            [],
+            [],
+            [],
+            [],
+        ]
+
+COMMANDS: dict[str, Command] = {}
+
+def register_command(name: str, arity: int, flags: tuple = (), first_key: int = 0, last_key: int = 0, step: int = 0, keys_proc=None):
+    """Register the decorated controller method as the handler of a command."""
+    def register(handler):
+        COMMANDS[name] = Command(name, handler, arity, flags, first_key, last_key, step, keys_proc)
+        return handler
+    return register
+
+def streams_keys(command: list) -> list:
+    """Keys of XREAD: the first half of the arguments after STREAMS."""
+    for i, arg in enumerate(command[1:], 1):
+        if arg.upper() == b'STREAMS':
+            streams = command[i + 1:]
+            return streams[:len(streams) // 2]
+    return []
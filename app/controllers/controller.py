@@ -1,254 +1,205 @@
 import time
-import select
 import socket
 import asyncio
-import collections
-from threading import Thread
+from threading import Thread, Condition, Lock
 
 from app.context import State
-from app.utils import RESPParser
+from app.utils import RESPWriter
 from app.constants import Constants
+from app.controllers.base_controller import BaseController
 
-class Controller(Thread):
+class Controller(BaseController, Thread):
     def __init__(self, state: State, connection: socket.socket = None) -> None:
-        super().__init__()
-        self.state = state
+        BaseController.__init__(self, state)
+        Thread.__init__(self)
         self.connection = connection if connection or self.state.is_master() else self.handshake()
-        self.talking_to_replica = False
-        self.is_multi_active = False
-        self.multi_commands_queue = collections.deque([])
+        if self.connection is not None:
+            self.describe_connection(self.connection)
+        self.replica_ready = Condition()
+        self.replica_writer = None
+        self.closed = False
+        # on the link to the master, the cron thread sends the periodic ACKs too
+        self.send_lock = Lock()
+        # bytes of the replies and of the replication stream in the middle of a blocking send
+        self.pending_output = 0
+        self.pending_stream = 0
 
     def run(self):
-        buffer = b''
+        if self.connection is None:
+            return
+        if self.is_master_link:
+            self.state.master_link = self
+        else:
+            self.state.total_connections_received += 1
+            self.state.connected_clients += 1
+        self.state.link_client(self)
+
         while True:
             try:
-                if self.state.is_master() and self.talking_to_replica:
+                self.handle_commands()
+                if self.close_after_reply:
                     break
 
+                # the stream goes out from a thread of its own, this one keeps reading the replica's REPLCONF ACKs
+                if self.talking_to_replica and self.state.is_master() and self.replica_writer is None:
+                    self.replica_writer = Thread(target=self.run_sync_replica, daemon=True)
+                    self.replica_writer.start()
+
                 raw_message = self.connection.recv(8000)
                 if not raw_message:
                     break
 
-                buffer += raw_message
-                commands, buffer = RESPParser.decode(buffer)
-                
-                for command, bytes_processed in commands:
-                    result = self.process_command(command)
-                    
-                    for message in result:
-                        self.send(message)
-                    
-                    if not self.state.is_master():
-                        self.state.increment_repl_offset(bytes_processed)
+                self.last_interaction = time.monotonic()
+                self.state.net_input_bytes += len(raw_message)
+                self.parser.feed(raw_message)
 
+            except OSError:
+                # reset by the peer, or shut down by kill
+                break
             except Exception as e:
                 print(f'Error processing command: {e}')
-                self.connection.sendall(RESPParser.encode(f'-Err: {e}').encode())
+                self.send(f'-Err: {e}')
+                self.flush()
                 break
-        
-        if self.talking_to_replica and self.state.is_master():
-            self.run_sync_replica()
+
+        if self.is_master_link:
+            if self.state.master_link is self:
+                self.state.master_link = None
+        else:
+            self.state.connected_clients -= 1
+        with self.state.execution_lock:
+            self.unwatch_all_keys()
+        self.state.unlink_client(self)
+        if self.replica_writer is not None:
+            self.closed = True
+            self.wake_replica_writer()
+            self.replica_writer.join()
         self.connection.close()
-    
-    def process_command(self, command: list) -> list:
-        if self.is_multi_active:
-            if command[0] == Constants.EXEC:
-                self.is_multi_active = False
-                result = []
 
-                for multi_command in self.multi_commands_queue:
-                    for res in self.process_command(multi_command):
-                        result.append(res)
-
-                return [result]
-            elif command[0] == Constants.DISCARD:
-                self.is_multi_active = False
-                self.multi_commands_queue.clear()
-                return [Constants.OK]
-            else:
-                self.multi_commands_queue.append(command)
-                return [Constants.QUEUED]
-
-        if (
-            self.state.role == Constants.MASTER and
-            self.state.replica_present and
-            any(key in command for key in [Constants.SET, Constants.DEL, Constants.INCR])
-            ):
-            self.state.add_command_buffer(command)
-
-        match command:
-            case [Constants.PING]:
-                return ['PONG'] if self.state.is_master() else []
-
-            case [Constants.ECHO, message]:
-                return [message]
-            
-            case [Constants.GET, key]:
-                return [self.state.get(key)]
-            
-            case [Constants.SET, key, value]:
-                self.state.save(key, value)
-                return [Constants.OK] if self.state.is_master() else []
-            
-            case [Constants.SET, key, value, Constants.PX, ttl]:
-                self.state.save(key, value, int(ttl) + time.time() * 1000)
-                return [Constants.OK] if self.state.is_master() else []
-            
-            case [Constants.TYPE, key]:
-                return [self.state.get_type(key)]
-
-            case [Constants.DEL, key]:
-                self.state.delete(key)
-                return [Constants.OK] if self.state.is_master() else []
-            
-            case [Constants.CONFIG, Constants.GET, key]:
-                return [[key, self.state.config[key]]]
-            
-            case [Constants.KEYS, pattern]:
-                return [self.state.keys()]
-            
-            case [Constants.INFO, section]:
-                return [self.state.get_info()]
-            
-            case [Constants.REPL_CONF, Constants.GETACK, _]:
-                return [[Constants.REPL_CONF, Constants.ACK, str(self.state.master_repl_offset)]]
-            
-            case [Constants.REPL_CONF, key, val]:
-                if key == Constants.ACK: self.state.increment_ack_count()
-                else: return [Constants.OK]
-            
-            case [Constants.PYSNC, _, _]:
-                full_resync =f'FULLRESYNC {self.state.config['master_replid']} 0'
-                self.talking_to_replica = True
-                self.state.add_new_replica(self.connection)
-                return [full_resync, Constants.EMPTY_RDB]
-            
-            case [Constants.XADD, stream_key, id, *fields]:
-                entry_id = self.state.generate_stream_entry_id(stream_key, id)
-                res = self.state.save_stream(stream_key, entry_id, fields)
-                return [res]
-
-            case [Constants.XRANGE, stream_key, start, end]:
-                res = self.state.get_stream_entries(stream_key, start, end)
-                return [res]
-            
-            case [Constants.XREAD, *data]:
-                # default to empty list if no BLOCK is present
-                res = None if Constants.BLOCK in data else []
-                if Constants.BLOCK in data:
-                    res = asyncio.run(self.state.read_blocking_streams(data[3:], int(data[1])))
-                else:
-                    res = self.state.read_multiple_streams(data[1:])
-                return [res]
-
-            case [Constants.INCR, key]:
-                return [self.state.incr(key)]
-
-            case [Constants.WAIT, num_replicas, timeout]:
-                return asyncio.run(self.handle_wait([num_replicas, timeout]))
-
-            case [Constants.MULTI]:
-                self.is_multi_active = True
-                self.multi_commands_queue.clear()
-                return [Constants.OK]
-            
-            case [Constants.EXEC]:
-                return [Constants.ERROR_EXEC]
-            
-            case [Constants.DISCARD]:
-                return [Constants.ERROR_DISCARD]
-
-            case _:
-                return [Constants.NULL]
+    def handle_commands(self) -> None:
+        for args, bytes_processed in self.parser.read_commands():
+            command = self.decode_command(args)
+            # one command at a time across the client threads, EXEC's whole transaction included
+            with self.state.execution_lock:
+                result = self.process_command(command)
 
+            # a replica only ever answers its master's REPLCONF GETACK
+            if self.is_master_link and command[0] != Constants.REPL_CONF:
+                result = []
 
-    def run_sync_replica(self):
-        while True:
-            thread_queue = self.state.buffers[self.connection]
-            if len(thread_queue) > 0:
-                command = thread_queue[0]
-                self.connection.sendall(RESPParser.encode(command).encode())
-                thread_queue.popleft()
-    
-    def handshake(self):
-        try:
-            connection = socket.create_connection((self.state.config['master_host'], self.state.config['master_port']))
-            
-            connection.sendall(RESPParser.encode(['PING']).encode())
-            connection.recv(1024)
-            connection.sendall(RESPParser.encode(['REPLCONF', 'listening-port', str(self.state.config['port'])]).encode())
-            connection.recv(1024)
-            connection.sendall(RESPParser.encode(['REPLCONF', 'capa', 'psync2']).encode())
-            connection.recv(1024)
-            connection.sendall(RESPParser.encode(['PSYNC', '?', '-1']).encode())
-            r1 = connection.recv(149)
-            res, rdb = RESPParser.decode(r1)
-
-            if not rdb:
-                rdb = connection.recv(93)
-
-            self.state.load_rdb(rdb[5:])
-
-            return connection
-        except Exception as e:
-            connection.close()
-            print(f'Error during handshake: {e}')
-
-    async def handle_wait(self, args: list) -> list:
-        try:
-            num_replicas, timeout = int(args[0]), (int(args[1]) + 200) / 1000
-            start_time = time.time()
+            for message in result:
+                self.send(message)
 
-            await self.request_acks_from_replicas(timeout)
+            if self.is_master_link:
+                self.state.increment_repl_offset(bytes_processed)
+            # the commands pipelined after CLIENT KILL of this client, or after it overcame its output buffer limits, are not run
+            if self.close_after_reply or self.killed:
+                break
 
-            while time.time() - start_time < timeout:
-                if self.state.get_ack_count() >= num_replicas:
-                    break
-                await asyncio.sleep(0.01)
+        self.flush()
 
-            self.connection.sendall(RESPParser.encode(self.state.get_ack_count()).encode())
-            self.state.reset_ack_count()
-        except Exception as e:
-            print(f"Error in handle_wait: {e}")
-            try:
-                self.connection.sendall(RESPParser.encode("ERROR").encode())
-            except Exception:
-                pass  # Prevent cascading failure if send fails
-        return []
+    def block(self, coroutine) -> list:
+        # the other clients run while this one waits, the writes it waits for among them
+        self.state.execution_lock.release()
+        try:
+            # replies to the commands pipelined before this one should not wait for it
+            self.flush()
+            return asyncio.run(coroutine)
+        finally:
+            self.state.execution_lock.acquire()
 
-    async def request_acks_from_replicas(self, timeout: float) -> None:
-        async def send_ack_request(connection: socket.socket):
+    def run_sync_replica(self):
+        buffer = self.state.buffers[self.connection]
+        try:
+            if buffer.waiting_snapshot or buffer.snapshot is not None:
+                with self.replica_ready:
+                    self.replica_ready.wait_for(lambda: buffer.snapshot is not None and buffer.snapshot.done or self.closed)
+                if self.closed:
+                    return
+                self.send_snapshot(buffer.snapshot)
+
+            while True:
+                with self.replica_ready:
+                    self.replica_ready.wait_for(lambda: len(buffer) or buffer.overflowed or self.closed)
+                if self.closed:
+                    break
+                if buffer.overflowed:
+                    # past the hard limit the stream stopped being queued, the replica has to resync
+                    self.state.check_output_buffer_limits(self)
+                    break
+                # everything queued since the last write goes out together
+                data = b''.join(buffer.drain())
+                self.pending_stream = len(data)
+                self.connection.sendall(data)
+                self.pending_stream = 0
+        except OSError as e:
+            print(f'Lost replica {self.connection}: {e}')
+            # ends the reading side too, the replica reconnects
             try:
-                for _ in range(5):
-                    if len(self.state.buffers.get(connection, [])) == 0:
-                        break
-                    await asyncio.sleep(0.01)
-
-                connection.sendall(RESPParser.encode([Constants.REPL_CONF, Constants.GETACK, '*']).encode())
-
-                try:
-                    response = await asyncio.wait_for(self.read_response(connection), timeout + 0.25)
-                    if response and isinstance(response, list) and response[0] and Constants.ACK in response[0][0]:
-                        self.state.increment_ack_count()
-                except asyncio.TimeoutError:
-                    print(f"Timeout waiting for ACK from {connection.getpeername()}")
-            except (ConnectionResetError, BrokenPipeError) as e:
-                print(f"Connection error with replica {connection.getpeername()}: {e}")
-
-        await asyncio.gather(*(send_ack_request(conn) for conn in self.state.repl_connections if conn))
-
-    async def read_response(self, connection: socket.socket) -> list:
-        loop = asyncio.get_running_loop()
-        return await loop.run_in_executor(None, self._blocking_recv, connection)
-
-    def _blocking_recv(self, connection: socket.socket) -> list:
+                self.connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        finally:
+            if buffer.snapshot is not None:
+                buffer.snapshot.close()
+            self.state.remove_replica(self.connection)
+
+    def send_snapshot(self, snapshot) -> None:
+        self.connection.sendall(snapshot.preamble())
+        while chunk := snapshot.read():
+            self.connection.sendall(chunk)
+        self.connection.sendall(snapshot.trailer())
+        snapshot.close()
+
+    def wake_replica_writer(self) -> None:
+        with self.replica_ready:
+            self.replica_ready.notify()
+
+    def send_replication_ack(self) -> None:
+        with self.send_lock:
+            self.connection.sendall(RESPWriter.encode_command([Constants.REPL_CONF, Constants.ACK, str(self.state.master_repl_offset)]))
+
+    def kill(self) -> None:
+        self.killed = True
+        # wakes the client's thread from its read or its write, it then closes the connection
         try:
-            ready_to_read, _, _ = select.select([connection], [], [], 2)
-            if ready_to_read:
-                return RESPParser.decode(connection.recv(1024))[0]
-        except (ConnectionResetError, BrokenPipeError):
+            self.connection.shutdown(socket.SHUT_RDWR)
+        except OSError:
             pass
-        return []
-        
-    def send(self, message) -> None:
-        self.connection.sendall(message if isinstance(message, bytes) else RESPParser.encode(message).encode())
+
+    def unsent_bytes(self) -> int:
+        return self.pending_output + self.pending_stream
+
+    def flush(self) -> None:
+        # replies acknowledge writes, so these must reach the AOF first
+        self.state.flush_append_only_file()
+        # over the output buffer limits of its class the client is disconnected instead
+        if self.killed or self.state.check_output_buffer_limits(self):
+            self.output.drain()
+            return
+        self.state.net_output_bytes += len(self.output)
+        # a client that does not read keeps this thread in the send, the clients cron sees the bytes stuck there
+        self.pending_output = len(self.output)
+        try:
+            self.send_chunks(self.output.drain())
+        finally:
+            self.pending_output = 0
+
+    def send_chunks(self, chunks: list) -> None:
+        if self.is_master_link:
+            if chunks:
+                with self.send_lock:
+                    self.connection.sendall(b''.join(chunks))
+            return
+        if len(chunks) == 1:
+            self.connection.sendall(chunks[0])
+            return
+
+        views = [memoryview(chunk) for chunk in chunks]
+        while views:
+            sent = self.connection.sendmsg(views[:512])
+            while views and sent >= len(views[0]):
+                sent -= len(views[0])
+                views.pop(0)
+            if views and sent:
+                views[0] = views[0][sent:]
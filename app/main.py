@@ -1,26 +1,141 @@
+import os
+import sys
+import time
+import signal
 import socket
+import asyncio
+import threading
+import subprocess
 
 from app.constants import Constants
-from app.controllers import Controller
+from app.controllers import BaseController, Controller, AsyncController
 from app.context import State, load_config
 
-def main():
-    config = load_config()
-    state = State()
+def run_cron(state: State):
+    while True:
+        time.sleep(1 / State.CRON_HZ)
+        state.cron()
+
+async def run_cron_async(state: State):
+    while True:
+        await asyncio.sleep(1 / State.CRON_HZ)
+        state.cron()
+
+def run_master_link(state: State, loader: threading.Thread):
+    # the snapshot from the master replaces the dataset, it is not loaded over it
+    loader.join()
+    while True:
+        controller = Controller(state)
+        controller.start()
+        controller.join()
+        time.sleep(1)
+
+async def run_master_link_async(state: State, loader: asyncio.Task):
+    await loader
+    while True:
+        await AsyncController(state).run()
+        await asyncio.sleep(1)
+
+def load_append_only_file(state: State):
+    # replayed through the command table, as if sent by a client, while clients get -LOADING
+    controller = BaseController(state)
+    controller.is_loader = True
+    state.load_append_only_file(controller.execute_command)
+    state.dirty = 0
+    state.open_append_only_file()
+
+def load_data(state: State):
+    """Load the dataset, from the AOF when enabled, from the RDB file otherwise. Runs in a thread while the server is up."""
+    try:
+        if state.config['appendonly']:
+            load_append_only_file(state)
+        else:
+            state.load_rdb_file()
+    except Exception as e:
+        # as Redis, rather than serving a partial dataset
+        print(f'Fatal error loading the DB: {e}. Exiting.')
+        os._exit(1)
+    finally:
+        state.stop_loading()
+
+def serve_threaded(state: State, config: dict):
     server = socket.create_server((config['host'], config['port']), reuse_port=True)
+    threading.Thread(target=run_cron, args=(state,), daemon=True).start()
+    loader = threading.Thread(target=load_data, args=(state,), daemon=True)
+    loader.start()
+
+    if state.role == Constants.SLAVE:
+        threading.Thread(target=run_master_link, args=(state, loader), daemon=True).start()
 
+    while True:
+        connection, _ = server.accept()
+        # as asyncio's transports and Redis do, small replies and the replication stream are not held back
+        connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        Controller(state, connection).start()
+
+async def serve_asyncio(state: State, config: dict):
+    async def handle_connection(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        await AsyncController(state, reader, writer).run()
+
+    server = await asyncio.start_server(handle_connection, config['host'], config['port'], reuse_port=True)
+    # in a thread, the event loop keeps answering while the keyspace fills
+    loader = asyncio.create_task(asyncio.to_thread(load_data, state))
+    # the loop only keeps weak references to its tasks, these live as long as the server
+    tasks = [asyncio.create_task(run_cron_async(state)), loader]
 
     if state.role == Constants.SLAVE:
-       Controller(state).start()
-       while True:
-            connection, _ = server.accept()
-            Controller(state, connection).start()
-    
+        tasks.append(asyncio.create_task(run_master_link_async(state, loader)))
+
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        for task in tasks:
+            task.cancel()
+
+def node_filename(filename: str, port: int) -> str:
+    # nodes may share a directory, each keeps its own files
+    stem, extension = os.path.splitext(filename)
+    return f'{stem}-{port}{extension}'
+
+def launch_cluster(config: dict):
+    """
+    Run each node of the local cluster as a process of its own, so the nodes use a core each,
+    node i on port + i with the same arguments, until they all exit.
+    """
+    workers = []
+    for i in range(config['cluster_workers']):
+        port = config['port'] + i
+        workers.append(subprocess.Popen([
+            sys.executable, '-m', 'app.main', *sys.argv[1:],
+            '--port', str(port), '--cluster-node', str(i),
+            '--dbfilename', node_filename(config['dbfilename'], port),
+            '--appendfilename', node_filename(config['appendfilename'], port),
+        ]))
+    # stopping the launcher stops the nodes
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        for worker in workers:
+            worker.wait()
+    finally:
+        for worker in workers:
+            if worker.poll() is None:
+                worker.terminate()
+
+def main():
+    config = load_config()
+    if config['cluster_enabled'] and config['cluster_node'] is None and config['cluster_workers'] > 1:
+        launch_cluster(config)
+        return
+    state = State()
+    # set before the port opens, so no client sees the dataset half loaded
+    state.start_loading()
+
+    if config['io_model'] == Constants.THREADED:
+        serve_threaded(state, config)
     else:
-        while True:
-            connection, _ = server.accept()
-            Controller(state, connection).start()
+        asyncio.run(serve_asyncio(state, config))
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -1,5 +1,9 @@
-from app.utils.helpers import generate_alphanumeric_string, is_numeric
+from app.utils.glob import compile_glob
+from app.utils.helpers import CLUSTER_SLOTS, format_memory, generate_alphanumeric_string, is_numeric, key_hash_slot, parse_int, parse_memory, process_rss
 from app.utils.rdb_parser import RDBParser
+from app.utils.rdb_writer import RDBWriter
 from app.utils.resp_parser import RESPParser
+from app.utils.resp_reader import RESPReader
+from app.utils.resp_writer import RawReply, RESPWriter
 
-__all__ = ['generate_alphanumeric_string', 'is_numeric', 'RDBParser', 'RESPParser']
\ No newline at end of file
+__all__ = ['CLUSTER_SLOTS', 'compile_glob', 'format_memory', 'generate_alphanumeric_string', 'is_numeric', 'key_hash_slot', 'parse_int', 'parse_memory', 'process_rss', 'RDBParser', 'RDBWriter', 'RESPParser', 'RESPReader', 'RawReply', 'RESPWriter']
\ No newline at end of file
@@ -0,0 +1,45 @@
+import re
+from functools import lru_cache
+
+@lru_cache(maxsize=256)
+def compile_glob(pattern: bytes) -> re.Pattern:
+    """
+    Compile a Redis glob pattern to a regex to fullmatch keys against.
+    Supports *, ?, [abc], [^abc], [a-z] and backslash escapes, as Redis's stringmatchlen.
+    """
+    regex, i, n = [], 0, len(pattern)
+    while i < n:
+        char = pattern[i:i + 1]
+        i += 1
+        if char == b'*':
+            regex.append(b'.*')
+        elif char == b'?':
+            regex.append(b'.')
+        elif char == b'\\' and i < n:
+            regex.append(re.escape(pattern[i:i + 1]))
+            i += 1
+        elif char == b'[':
+            negate = pattern[i:i + 1] == b'^'
+            if negate:
+                i += 1
+            items = []
+            # an unterminated set ends with the pattern
+            while i < n and pattern[i:i + 1] != b']':
+                if pattern[i:i + 1] == b'\\' and i + 1 < n:
+                    items.append(re.escape(pattern[i + 1:i + 2]))
+                    i += 2
+                elif i + 2 < n and pattern[i + 1:i + 2] == b'-' and pattern[i + 2:i + 3] != b']':
+                    low, high = sorted((pattern[i], pattern[i + 2]))
+                    items.append(re.escape(bytes((low,))) + b'-' + re.escape(bytes((high,))))
+                    i += 3
+                else:
+                    items.append(re.escape(pattern[i:i + 1]))
+                    i += 1
+            i += 1
+            if items:
+                regex.append(b'[%s%s]' % (b'^' if negate else b'', b''.join(items)))
+            else:
+                regex.append(b'.' if negate else b'(?!)')
+        else:
+            regex.append(re.escape(char))
+    return re.compile(b''.join(regex), re.DOTALL)
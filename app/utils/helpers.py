@@ -1,5 +1,10 @@
+import os
 import random
+import binascii
 import string
+import resource
+
+CLUSTER_SLOTS = 16384
 
 def generate_alphanumeric_string(length):
     return ''.join(random.choice(string.ascii_uppercase + string.digits) for _ in range(length))
@@ -9,4 +14,49 @@ def is_numeric(s):
         float(s)  # Convert to float
         return True
     except ValueError:
-        return False
\ No newline at end of file
+        return False
+
+def parse_int(value: bytes) -> int | None:
+    """Parse a signed 64-bit integer written exactly as b'%d' writes it, without sign, spaces or leading zeros."""
+    digits = value[1:] if value[:1] == b'-' else value
+    if not digits.isdigit() or len(digits) > 19 or (digits[0] == 48 and len(value) > 1):
+        return None
+    number = int(value)
+    return number if -2**63 <= number < 2**63 else None
+
+def parse_memory(value) -> int:
+    """Parse a byte count given as a plain number or with a k/kb/m/mb/g/gb suffix."""
+    units = {'k': 1000, 'kb': 1024, 'm': 1000**2, 'mb': 1024**2, 'g': 1000**3, 'gb': 1024**3}
+    text = str(value).strip().lower()
+    for unit in sorted(units, key=len, reverse=True):
+        if text.endswith(unit):
+            return int(text[:-len(unit)]) * units[unit]
+    return int(text)
+
+def format_memory(value: int) -> str:
+    """Format a byte count as Redis does in INFO, e.g. 1.50M."""
+    for unit in ('B', 'K', 'M', 'G', 'T'):
+        if value < 1024 or unit == 'T':
+            return f'{value}{unit}' if unit == 'B' else f'{value:.2f}{unit}'
+        value /= 1024
+
+def key_hash_slot(key: bytes) -> int:
+    """
+    Cluster slot of a key: CRC16 (XMODEM, as binascii.crc_hqx computes it) of the key modulo 16384.
+    Only the part between the first '{' and the next '}' is hashed when not empty, so keys sharing
+    such a hash tag share a slot.
+    """
+    start = key.find(b'{')
+    if start != -1:
+        end = key.find(b'}', start + 1)
+        if end > start + 1:
+            key = key[start + 1:end]
+    return binascii.crc_hqx(key, 0) & (CLUSTER_SLOTS - 1)
+
+def process_rss() -> int:
+    """Resident set size of this process in bytes, the peak one where /proc is not available."""
+    try:
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
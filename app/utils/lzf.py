@@ -0,0 +1,36 @@
+def lzf_decompress(data: bytes, length: int) -> bytes:
+    """
+    Decompress an LZF block, the compression RDB files use for long strings.
+    :param length: Uncompressed length stored next to the block.
+    """
+    output = bytearray()
+    pos, end = 0, len(data)
+    while pos < end:
+        ctrl = data[pos]
+        pos += 1
+        if ctrl < 32:
+            # literal run of ctrl + 1 bytes
+            output += data[pos:pos + ctrl + 1]
+            pos += ctrl + 1
+            continue
+
+        # back reference: 3 bits of length (7 means a length byte follows) and 13 bits of offset
+        size = ctrl >> 5
+        if size == 7:
+            size += data[pos]
+            pos += 1
+        ref = len(output) - ((ctrl & 0x1F) << 8) - data[pos] - 1
+        pos += 1
+        size += 2
+        if ref < 0:
+            raise ValueError('Invalid LZF back reference')
+        if ref + size <= len(output):
+            output += output[ref:ref + size]
+        else:
+            # the copy overlaps the bytes it produces
+            for i in range(ref, ref + size):
+                output.append(output[i])
+
+    if len(output) != length:
+        raise ValueError(f'LZF data decompressed to {len(output)} bytes, expected {length}')
+    return bytes(output)
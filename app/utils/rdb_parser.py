@@ -1,9 +1,27 @@
 import os
-from typing import Dict, Tuple, Optional
+import mmap
+import struct
+from typing import Iterable, Iterator, List, Tuple, Optional
+
+from app.utils.lzf import lzf_decompress
 
 class RDBParser:
+    """
+    Streaming RDB decoder.
+
+    `parse` yields keys one at a time as it walks the data, so a file mapped with `read_rdb`
+    is paged in by the OS as it is read and no intermediate copy of the keyspace is built.
+    """
+
+    ENCODING_INT8 = 0
+    ENCODING_INT16 = 1
+    ENCODING_INT32 = 2
+    ENCODING_LZF = 3
+
     def __init__(self):
-        self.store: Dict[str, Tuple[str, Optional[int]]] = {}
+        self.keys = 0
+        # bytes decoded so far, the progress INFO reports while loading
+        self.loaded_bytes = 0
 
     def _parse_db_len(self, data: bytes, pos: int) -> Tuple[int, int]:
         first = data[pos]
@@ -16,45 +34,173 @@ class RDBParser:
             second = data[pos]
             pos += 1
             length = (first << 8) + second
-        elif start == 0b10:
-            length = int.from_bytes(data[pos:pos + 4], "little")
+        elif first == 0x80:
+            length = int.from_bytes(data[pos:pos + 4], "big")
             pos += 4
-        elif start == 0b11:
-            first &= 0b00111111
-            length = 2**first
+        elif first == 0x81:
+            length = int.from_bytes(data[pos:pos + 8], "big")
+            pos += 8
         else:
             raise ValueError(f"Unknown DB length type {start} at position {pos}")
         return length, pos
 
-    def _parse_db_string(self, data: bytes, pos: int) -> Tuple[str, int]:
-        length, pos = self._parse_db_len(data, pos)
-        value = (data[pos:pos + length]).decode('utf-8', errors='replace')
-        pos += length
-        return value, pos
+    def _parse_db_string(self, data: bytes, pos: int) -> Tuple[bytes, int]:
+        first = data[pos]
+        if first < 0x40:  # 6 bit length, the common case of short keys and values
+            return data[pos + 1:pos + 1 + first], pos + 1 + first
+        if first >> 6 != 0b11:
+            length, pos = self._parse_db_len(data, pos)
+            return data[pos:pos + length], pos + length
+
+        # special encodings: integers stored in binary and LZF-compressed strings
+        encoding = first & 0b00111111
+        pos += 1
+        if encoding == RDBParser.ENCODING_INT8:
+            return str(struct.unpack_from("<b", data, pos)[0]).encode(), pos + 1
+        if encoding == RDBParser.ENCODING_INT16:
+            return str(struct.unpack_from("<h", data, pos)[0]).encode(), pos + 2
+        if encoding == RDBParser.ENCODING_INT32:
+            return str(struct.unpack_from("<i", data, pos)[0]).encode(), pos + 4
+        if encoding == RDBParser.ENCODING_LZF:
+            compressed_length, pos = self._parse_db_len(data, pos)
+            length, pos = self._parse_db_len(data, pos)
+            return lzf_decompress(data[pos:pos + compressed_length], length), pos + compressed_length
+        raise ValueError(f"Unknown string encoding {encoding} at position {pos}")
 
-    def _parse_keyvalue(self, data: bytes, pos: int) -> Tuple[str, str, int]:
+    def _parse_keyvalue(self, data: bytes, pos: int) -> Tuple[bytes, bytes | List, int]:
         vtype = data[pos]
-        if vtype not in (0, 9, 10, 11, 12, 13):
+        if vtype not in (0, 9, 10, 11, 12, 13, 15, 19, 21):
             raise ValueError(f"Unsupported value type {vtype} at position {pos}")
         pos += 1
         key, pos = self._parse_db_string(data, pos)
-        val, pos = self._parse_db_string(data, pos)
+        if vtype in (15, 19, 21):
+            val, pos = self._parse_stream(data, pos, vtype)
+        else:
+            val, pos = self._parse_db_string(data, pos)
         return key, val, pos
-    
+
+    def _parse_stream(self, data: bytes, pos: int, vtype: int) -> Tuple[List, int]:
+        """Decode a stream stored as listpack nodes into a list of ((ms, seq), fields) entries."""
+        entries = []
+        nodes, pos = self._parse_db_len(data, pos)
+        for _ in range(nodes):
+            master_id, pos = self._parse_db_string(data, pos)
+            master_ms, master_seq = struct.unpack(">QQ", master_id)
+            node, pos = self._parse_db_string(data, pos)
+            elements = self._parse_listpack(node)
+
+            count, deleted, num_fields = int(elements[0]), int(elements[1]), int(elements[2])
+            master_fields = elements[3:3 + num_fields]
+            i = 4 + num_fields  # skip the master entry terminator
+            for _ in range(count + deleted):
+                flags, ms, seq = int(elements[i]), int(elements[i + 1]), int(elements[i + 2])
+                i += 3
+                if flags & 2:  # same fields as the master entry
+                    fields = [item for pair in zip(master_fields, elements[i:i + num_fields]) for item in pair]
+                    i += num_fields
+                else:
+                    fields_count = int(elements[i])
+                    fields = elements[i + 1:i + 1 + 2 * fields_count]
+                    i += 1 + 2 * fields_count
+                i += 1  # lp-count
+                if not flags & 1:  # deleted entries are skipped
+                    entries.append(((master_ms + ms, master_seq + seq), [b'%d' % item if isinstance(item, int) else item for item in fields]))
+
+        _, pos = self._parse_db_len(data, pos)  # length
+        _, pos = self._parse_db_len(data, pos)  # last ID ms
+        _, pos = self._parse_db_len(data, pos)  # last ID seq
+        if vtype != 15:
+            # first ID, max deleted ID and entries added
+            for _ in range(5):
+                _, pos = self._parse_db_len(data, pos)
+        groups, pos = self._parse_db_len(data, pos)
+        if groups:
+            raise ValueError(f"Stream consumer groups are not supported at position {pos}")
+        return entries, pos
+
+    def _parse_listpack(self, data: bytes) -> List:
+        elements = []
+        pos = 6  # total bytes and number of elements
+        while data[pos] != 0xFF:
+            first, start = data[pos], pos
+            if first < 0x80:
+                value, pos = first, pos + 1
+            elif first < 0xC0:
+                size = first & 0x3F
+                value, pos = data[pos + 1:pos + 1 + size], pos + 1 + size
+            elif first < 0xE0:
+                value = ((first & 0x1F) << 8) | data[pos + 1]
+                value, pos = value - (1 << 13) if value >= 1 << 12 else value, pos + 2
+            elif first < 0xF0:
+                size = ((first & 0x0F) << 8) | data[pos + 1]
+                value, pos = data[pos + 2:pos + 2 + size], pos + 2 + size
+            elif first == 0xF0:
+                size = int.from_bytes(data[pos + 1:pos + 5], "little")
+                value, pos = data[pos + 5:pos + 5 + size], pos + 5 + size
+            else:
+                width = {0xF1: 2, 0xF2: 3, 0xF3: 4, 0xF4: 8}[first]
+                value = int.from_bytes(data[pos + 1:pos + 1 + width], "little", signed=True)
+                pos += 1 + width
+            elements.append(value)
+            entry_length = pos - start
+            pos += 1 if entry_length < 128 else 2 if entry_length < 16384 else 3 if entry_length < 2097152 else 4 if entry_length < 268435456 else 5
+        return elements
+
     @staticmethod
-    def read_rdb(file_path):
+    def read_rdb(file_path) -> Optional[mmap.mmap | bytes]:
+        """Map the file read-only, the caller closes the returned mapping once parsed."""
         if not os.path.exists(file_path):
             print(f"Error: File {file_path} not found")
             return None
         with open(file_path, "rb") as db_file:
-            data = db_file.read()
+            if os.fstat(db_file.fileno()).st_size == 0:
+                return b''
+            data = mmap.mmap(db_file.fileno(), 0, access=mmap.ACCESS_READ)
 
+        # the file is read front to back once, let the kernel read ahead aggressively
+        if hasattr(mmap, "MADV_SEQUENTIAL"):
+            data.madvise(mmap.MADV_SEQUENTIAL)
         return data
 
-    def parse(self, data) -> Dict[str, Tuple[str, Optional[int]]]:
+    def _parse_entry(self, data, pos: int) -> Tuple[Optional[Tuple[bytes, bytes | List, Optional[int]]], Optional[int]]:
+        """
+        Decode the opcode at pos, with the key that follows it if any.
+        :return: (key, value, expiry in ms or None) or None for the other opcodes, and the position
+                 after them, None once the end of file opcode is reached.
+        """
+        op = data[pos]
+        pos += 1
+        exp = None
+        if op == 0xFA:  # Auxiliary data
+            _, pos = self._parse_db_string(data, pos)
+            _, pos = self._parse_db_string(data, pos)
+            return None, pos
+        elif op == 0xFE:  # Select DB
+            _, pos = self._parse_db_len(data, pos)
+            return None, pos
+        elif op == 0xFB:  # Resize DB
+            _, pos = self._parse_db_len(data, pos)
+            _, pos = self._parse_db_len(data, pos)
+            return None, pos
+        elif op == 0xFD:  # Expire time in seconds
+            exp = int.from_bytes(data[pos:pos + 4], "little") * 1_000
+            pos += 4
+        elif op == 0xFC:  # Expire time in milliseconds
+            exp = int.from_bytes(data[pos:pos + 8], "little")
+            pos += 8
+        elif op == 0xFF:  # End of file
+            return None, None
+        else:  # Default parsing for unknown types
+            pos -= 1  # Backtrack
+
+        key, val, pos = self._parse_keyvalue(data, pos)
+        return (key, val, exp), pos
+
+    def parse(self, data) -> Iterator[Tuple[bytes, bytes | List, Optional[int]]]:
+        """Yield (key, value, expiry in ms or None) for every key stored in data."""
         if not data:
             print("Error: Empty RDB file")
-            return {}
+            return
 
         if data[:5] != b"REDIS":
             raise ValueError("Incorrect RDB format")
@@ -62,32 +208,59 @@ class RDBParser:
         pos = 9  # Skip "REDIS" magic and version
 
         while pos < len(data):
-            op = data[pos]
-            pos += 1
-            if op == 0xFA:  # Auxiliary data
-                key, pos = self._parse_db_string(data, pos)
-                val, pos = self._parse_db_string(data, pos)
-            elif op == 0xFE:  # Select DB
-                db_num, pos = self._parse_db_len(data, pos)
-            elif op == 0xFB:  # Resize DB
-                _, pos = self._parse_db_len(data, pos)
-                _, pos = self._parse_db_len(data, pos)
-            elif op == 0xFD:  # Expire time in seconds
-                exp = int.from_bytes(data[pos:pos + 4], "little") * 1_000
-                pos += 4
-                key, val, pos = self._parse_keyvalue(data, pos)
-                self.store[key] = (val, exp)
-            elif op == 0xFC:  # Expire time in milliseconds
-                exp = int.from_bytes(data[pos:pos + 8], "little")
-                pos += 8
-                key, val, pos = self._parse_keyvalue(data, pos)
-                self.store[key] = (val, exp)
-            elif op == 0xFF:  # End of file
+            entry, pos = self._parse_entry(data, pos)
+            if pos is None:
                 break
-            else:  # Default parsing for unknown types
-                pos -= 1  # Backtrack
-                key, val, pos = self._parse_keyvalue(data, pos)
-                self.store[key] = (val, None)
+            self.loaded_bytes = pos
+            if entry is not None:
+                self.keys += 1
+                yield entry
+
+    def parse_stream(self, chunks: Iterable[bytes]) -> Iterator[Tuple[bytes, bytes | List, Optional[int]]]:
+        """
+        As parse, for data arriving in chunks of any size, as a snapshot read from a socket.
+
+        Only the entry being decoded and the rest of the last chunk are held: an entry that runs past
+        the data received so far is decoded again once more arrived, reading at least as much again
+        as was held each time, so that a large value is not decoded once per chunk.
+        """
+        chunks = iter(chunks)
+        data = b''
+        while len(data) < 9 and (chunk := next(chunks, b'')):
+            data += chunk
+        if not data:
+            print("Error: Empty RDB data")
+            return
+        if data[:5] != b"REDIS":
+            raise ValueError("Incorrect RDB format")
+
+        # bytes of the data dropped from the front of the window
+        pos, base = 9, 0
+        while True:
+            error = None
+            try:
+                entry, end = self._parse_entry(data, pos)
+                complete = end is None or end <= len(data)
+            except (IndexError, ValueError, struct.error) as e:
+                # most likely cut short, otherwise raised again once there is no more data
+                error, end, complete = e, None, False
+
+            if not complete:
+                held = len(data) - pos
+                wanted = end - pos if end is not None else 2 * held + 1
+                parts = [data[pos:]]
+                while held < wanted and (chunk := next(chunks, b'')):
+                    parts.append(chunk)
+                    held += len(chunk)
+                if len(parts) == 1:
+                    raise error or ValueError("RDB data ended in the middle of an entry")
+                data, pos, base = b''.join(parts), 0, base + pos
+                continue
 
-        print(f"Finished parsing RDB with {len(self.store)} keys")
-        return self.store
+            if end is None:
+                return
+            pos = end
+            self.loaded_bytes = base + pos
+            if entry is not None:
+                self.keys += 1
+                yield entry
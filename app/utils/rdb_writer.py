@@ -0,0 +1,198 @@
+import os
+import struct
+
+from app.utils.crc64 import crc64
+
+class RDBWriter:
+    """
+    Serializes a keyspace into the RDB format, version 11.
+
+    Output is buffered and written to the file in blocks of BUFFER_SIZE bytes, updating
+    the CRC64 trailer as each block goes out, so a dump never holds the whole file in memory.
+    """
+
+    VERSION = b'REDIS0011'
+    BUFFER_SIZE = 64 * 1024
+    # entries per listpack node of a stream, as Redis's stream-node-max-entries
+    STREAM_NODE_MAX_ENTRIES = 100
+
+    TYPE_STRING = 0
+    TYPE_STREAM_LISTPACKS = 15
+    OPCODE_AUX = 0xFA
+    OPCODE_RESIZEDB = 0xFB
+    OPCODE_EXPIRETIME_MS = 0xFC
+    OPCODE_SELECTDB = 0xFE
+    OPCODE_EOF = 0xFF
+
+    def __init__(self, file, checksum: bool = True) -> None:
+        self.file = file
+        self.checksum = checksum
+        self.crc = 0
+        self.buffer = bytearray()
+
+    def write(self, data: bytes) -> None:
+        self.buffer += data
+        if len(self.buffer) >= RDBWriter.BUFFER_SIZE:
+            self.flush()
+
+    def flush(self) -> None:
+        if self.checksum:
+            self.crc = crc64(self.buffer, self.crc)
+        self.file.write(self.buffer)
+        self.buffer = bytearray()
+
+    @staticmethod
+    def encode_length(length: int) -> bytes:
+        if length < 1 << 6:
+            return bytes((length,))
+        if length < 1 << 14:
+            return bytes((0x40 | length >> 8, length & 0xff))
+        if length < 1 << 32:
+            return b'\x80' + struct.pack('>I', length)
+        return b'\x81' + struct.pack('>Q', length)
+
+    @staticmethod
+    def encode_string(value) -> bytes:
+        if isinstance(value, str):
+            value = value.encode()
+        return RDBWriter.encode_length(len(value)) + value
+
+    @staticmethod
+    def encode_integer(value: int) -> bytes:
+        """Encode an integer value in the 8, 16 or 32 bit string encodings, larger ones as their digits."""
+        if -2**7 <= value < 2**7:
+            return b'\xc0' + struct.pack('<b', value)
+        if -2**15 <= value < 2**15:
+            return b'\xc1' + struct.pack('<h', value)
+        if -2**31 <= value < 2**31:
+            return b'\xc2' + struct.pack('<i', value)
+        return RDBWriter.encode_string(b'%d' % value)
+
+    def write_header(self, aux: dict, keys: int, expires: int) -> None:
+        self.write(RDBWriter.VERSION)
+        for field, value in aux.items():
+            self.write(bytes((RDBWriter.OPCODE_AUX,)) + RDBWriter.encode_string(field) + RDBWriter.encode_string(str(value)))
+        self.write(bytes((RDBWriter.OPCODE_SELECTDB, 0, RDBWriter.OPCODE_RESIZEDB)))
+        self.write(RDBWriter.encode_length(keys) + RDBWriter.encode_length(expires))
+
+    def write_key(self, key, value, ttl: int | None) -> None:
+        if ttl is not None:
+            self.write(bytes((RDBWriter.OPCODE_EXPIRETIME_MS,)) + struct.pack('<Q', int(ttl)))
+
+        # a single buffer append per key
+        if isinstance(value, (str, bytes)):
+            self.write(bytes((RDBWriter.TYPE_STRING,)) + RDBWriter.encode_string(key) + RDBWriter.encode_string(value))
+        elif isinstance(value, int):
+            self.write(bytes((RDBWriter.TYPE_STRING,)) + RDBWriter.encode_string(key) + RDBWriter.encode_integer(value))
+        else:
+            self.write(bytes((RDBWriter.TYPE_STREAM_LISTPACKS,)) + RDBWriter.encode_string(key))
+            self.write_stream(value)
+
+    def write_stream(self, stream) -> None:
+        """
+        Write a stream as Redis does: listpack nodes keyed by their master ID, each node
+        storing entry IDs as deltas from it and omitting the field names it shares.
+        """
+        nodes = range(0, len(stream), RDBWriter.STREAM_NODE_MAX_ENTRIES)
+        self.write(RDBWriter.encode_length(len(nodes)))
+        for start in nodes:
+            end = min(start + RDBWriter.STREAM_NODE_MAX_ENTRIES, len(stream))
+            self.write(RDBWriter.encode_string(struct.pack('>QQ', stream.ms[start], stream.seqs[start])))
+            self.write(RDBWriter.encode_string(RDBWriter.encode_stream_node(stream, start, end)))
+
+        last_ms, last_seq = stream.last_id
+        # length, last ID and no consumer groups
+        self.write(b''.join(map(RDBWriter.encode_length, (len(stream), last_ms, last_seq, 0))))
+
+    @staticmethod
+    def encode_stream_node(stream, start: int, end: int) -> bytes:
+        master_ms, master_seq = stream.ms[start], stream.seqs[start]
+        master_fields = stream.fields[start][::2]
+
+        elements = [end - start, 0, len(master_fields), *master_fields, 0]
+        for i in range(start, end):
+            fields = stream.fields[i]
+            same_fields = fields[::2] == master_fields
+            # flags: 2 marks an entry whose field names are the master entry's
+            elements += [2 if same_fields else 0, stream.ms[i] - master_ms, stream.seqs[i] - master_seq]
+            if same_fields:
+                elements += fields[1::2]
+                count = len(fields) // 2 + 3
+            else:
+                elements += [len(fields) // 2, *fields]
+                count = len(fields) + 4
+            elements.append(count)
+        return RDBWriter.encode_listpack(elements)
+
+    @staticmethod
+    def encode_listpack(elements: list) -> bytes:
+        body = bytearray()
+        for element in elements:
+            if isinstance(element, int):
+                element = str(element)
+            if isinstance(element, str):
+                element = element.encode()
+
+            # every element is written as a string, readers parse the integers back
+            size = len(element)
+            if size < 64:
+                entry = bytes((0x80 | size,)) + element
+            elif size < 4096:
+                entry = bytes((0xE0 | size >> 8, size & 0xff)) + element
+            else:
+                entry = b'\xF0' + struct.pack('<I', size) + element
+            body += entry
+            body += RDBWriter.encode_backlen(len(entry))
+
+        return struct.pack('<IH', len(body) + 7, min(len(elements), 0xFFFF)) + body + b'\xFF'
+
+    @staticmethod
+    def encode_backlen(length: int) -> bytes:
+        # 7 bits per byte, read right to left, the high bit marks that more bytes follow
+        digits = []
+        while length > 0x7F:
+            digits.append(length & 0x7F | 0x80)
+            length >>= 7
+        digits.append(length)
+        return bytes(reversed(digits))
+
+    def finish(self) -> None:
+        self.write(bytes((RDBWriter.OPCODE_EOF,)))
+        self.flush()
+        self.file.write(struct.pack('<Q', self.crc))
+
+    @staticmethod
+    def dump(path: str, items, expires: dict, aux: dict = None, checksum: bool = True) -> int:
+        """
+        Write a snapshot to a temporary file and rename it over path once it is complete.
+        :param items: (key, value) pairs of the keyspace.
+        :param expires: Expiry time in ms of the keys that have one.
+        :return: Number of keys written.
+        """
+        temp_path = f'{path}.temp-{os.getpid()}.rdb'
+        try:
+            with open(temp_path, 'wb') as file:
+                count = RDBWriter.write_snapshot(file, items, expires, aux, checksum)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return count
+
+    @staticmethod
+    def write_snapshot(file, items, expires: dict, aux: dict = None, checksum: bool = True) -> int:
+        """
+        Write a snapshot to any object with a write method, as the pipe of a diskless replica sync.
+        :return: Number of keys written.
+        """
+        count = 0
+        writer = RDBWriter(file, checksum)
+        writer.write_header(aux or {}, len(items), len(expires))
+        for key, value in items:
+            writer.write_key(key, value, expires.get(key))
+            count += 1
+        writer.finish()
+        return count
@@ -9,26 +9,25 @@ class RESPParser:
     def encode(data):
         """
         Encode data in RESP format.
-        :param data: Data to encode (str, int, list, or Exception).
-        :return: RESP-encoded string.
+        :param data: Data to encode (bytes, str, int, list, or Exception).
+        :return: RESP-encoded bytes.
         """
         if data is None:
-            return '$-1\r\n'
+            return b'$-1\r\n'
         if isinstance(data, bytes):
-            # Decode and re-encode to ensure consistency
-            # first element is the commands list, each element within the list is a tuple of command and its byte size
-            return RESPParser.encode(RESPParser.decode(data)[0][0][0])
+            # lengths count bytes, so values are never transcoded
+            return b'$%d\r\n%s\r\n' % (len(data), data)
         if isinstance(data, str) and data.startswith('ERR'):
-            return f'-{data}\r\n'
+            return b'-%s\r\n' % data.encode()
         if isinstance(data, str):
-            return f'${len(data)}\r\n{data}\r\n' if data else '$-1\r\n'
+            return RESPParser.encode(data.encode()) if data else b'$-1\r\n'
         if isinstance(data, int):
-            return f':{data}\r\n'
+            return b':%d\r\n' % data
         if isinstance(data, list):
-            elements = ''.join(RESPParser.encode(item) for item in data)
-            return f'*{len(data)}\r\n{elements}'
+            elements = b''.join(RESPParser.encode(item) for item in data)
+            return b'*%d\r\n%s' % (len(data), elements)
         if isinstance(data, Exception):
-            return f'-{str(data)}\r\n'
+            return b'-%s\r\n' % str(data).encode()
         
         raise ValueError('Unsupported type for RESP encoding')
 
@@ -46,7 +45,7 @@ class RESPParser:
             try:
                 inital = current_index
                 message, current_index = RESPParser._parse_value(buffer, current_index)
-                if isinstance(message, list) and message and isinstance(message[0], str):
+                if isinstance(message, list) and message and isinstance(message[0], bytes):
                     message[0] = message[0].upper()  # Normalize the command name
                 decoded_messages.append((message, current_index - inital))
             except RESPParser.IncompleteRESPError:
@@ -107,12 +106,7 @@ class RESPParser:
         if len(buffer) < string_end + 2:
             raise RESPParser.IncompleteRESPError()
 
-        try:
-            return buffer[string_start:string_end].decode('utf-8'), string_end + 2
-        except UnicodeDecodeError:
-            # Handle invalid UTF-8 sequences gracefully
-            decoded_string = buffer[string_start:string_end].decode('utf-8', errors='replace')  # Replace invalid bytes
-            return decoded_string, string_end + 2
+        return bytes(buffer[string_start:string_end]), string_end + 2
     
     @staticmethod
     def _parse_array(buffer, index):
@@ -0,0 +1,106 @@
+class RESPReader:
+    """
+    Incremental, bytes-native decoder for the RESP commands of one connection.
+
+    Received bytes are appended to a single bytearray and consumed through a read offset,
+    so a pipeline is scanned once however many reads it arrives in. An array that is only
+    partially received keeps the arguments parsed so far and resumes where it stopped.
+    """
+
+    class ProtocolError(Exception):
+        """Raised when the client sends something that is not a RESP command."""
+        pass
+
+    def __init__(self) -> None:
+        self.buffer = bytearray()
+        self.offset = 0
+        self._command_start = 0
+        self._args = None
+        self._remaining = 0
+        self._bulk_length = None
+
+    def feed(self, data: bytes) -> None:
+        """Append bytes received from the socket."""
+        self.buffer += data
+
+    def pending(self) -> int:
+        """Number of received bytes not consumed yet."""
+        return len(self.buffer) - self.offset
+
+    def read_commands(self) -> list:
+        """
+        Parse every complete command available in the buffer.
+        :return: List of (arguments, bytes_processed) tuples, arguments being a list of bytes.
+        """
+        commands = []
+        with memoryview(self.buffer) as view:
+            while (command := self._parse_command(view)) is not None:
+                if command:
+                    commands.append(command)
+
+        # deleting from the front of a bytearray only moves its start pointer
+        if self.offset:
+            del self.buffer[:self.offset]
+            self._command_start -= self.offset
+            self.offset = 0
+        return commands
+
+    def _parse_command(self, view: memoryview):
+        buffer = self.buffer
+        find = buffer.find
+        size = len(buffer)
+        offset = self.offset
+        args = self._args
+
+        if args is None:
+            while buffer.startswith(b'\r\n', offset):
+                offset += 2
+            if offset >= size or offset == size - 1 and buffer[offset] == 0x0d:  # a lone '\r' of a split CRLF
+                return None
+            if buffer[offset] != 0x2a:  # '*'
+                raise RESPReader.ProtocolError(f"Expected '*', got {bytes(buffer[offset:offset + 10])}")
+
+            end = find(b'\r\n', offset)
+            if end == -1:
+                return None
+            remaining = int(buffer[offset + 1:end])
+            offset = end + 2
+            args = []
+        else:
+            remaining = self._remaining
+
+        bulk_length = self._bulk_length
+        while remaining > 0:
+            if bulk_length is None:
+                if offset >= size:
+                    break
+                if buffer[offset] != 0x24:  # '$'
+                    raise RESPReader.ProtocolError(f"Expected '$', got {bytes(buffer[offset:offset + 10])}")
+                end = find(b'\r\n', offset)
+                if end == -1:
+                    break
+                bulk_length = int(buffer[offset + 1:end])
+                offset = end + 2
+
+            if bulk_length >= 0:
+                if size < offset + bulk_length + 2:
+                    break
+                args.append(bytes(view[offset:offset + bulk_length]))
+                offset += bulk_length + 2
+            else:
+                args.append(None)
+            bulk_length = None
+            remaining -= 1
+
+        self.offset = offset
+        if remaining > 0:
+            # keep what was parsed so far and resume from here on the next read
+            self._args, self._remaining, self._bulk_length = args, remaining, bulk_length
+            return None
+
+        self._args, self._bulk_length = None, None
+        if not args:
+            # empty and null arrays carry no command, their bytes count towards the next one
+            return ()
+        command_start, self._command_start = self._command_start, offset
+        return args, offset - command_start
@@ -0,0 +1,79 @@
+class RawReply(bytes):
+    """Bytes that are already RESP-encoded, written out as they are. Plain bytes are bulk strings."""
+
+class RESPWriter:
+    """
+    Output buffer of one connection that replies are RESP-encoded straight into.
+
+    Replies accumulate as bytes until the connection flushes them with a single write.
+    Bulk strings at least LARGE_VALUE bytes long are kept as chunks of their own instead
+    of being copied into the buffer, and go out through scatter-gather writes.
+    """
+
+    LARGE_VALUE = 16 * 1024
+
+    def __init__(self) -> None:
+        self.chunks = []
+        self.buffer = bytearray()
+        self.size = 0
+
+    def __len__(self) -> int:
+        return self.size + len(self.buffer)
+
+    def write(self, data) -> None:
+        """
+        Encode data in RESP format into the buffer.
+        :param data: Data to encode (None, RawReply, bytes, str, int, list, or Exception). A RawReply is written verbatim.
+        """
+        if data is None:
+            self.buffer += b'$-1\r\n'
+        elif isinstance(data, RawReply):
+            self.buffer += data
+        elif isinstance(data, bytes):
+            self.write_bulk(data)
+        elif isinstance(data, str):
+            if data.startswith('ERR'):
+                self.buffer += b'-%s\r\n' % data.encode()
+            elif data:
+                self.write_bulk(data.encode())
+            else:
+                self.buffer += b'$-1\r\n'
+        elif isinstance(data, int):
+            self.buffer += b':%d\r\n' % data
+        elif isinstance(data, list):
+            self.buffer += b'*%d\r\n' % len(data)
+            for item in data:
+                self.write(item)
+        elif isinstance(data, Exception):
+            self.buffer += b'-%s\r\n' % str(data).encode()
+        else:
+            raise ValueError('Unsupported type for RESP encoding')
+
+    def write_bulk(self, value: bytes) -> None:
+        self.buffer += b'$%d\r\n' % len(value)
+        if len(value) < RESPWriter.LARGE_VALUE:
+            self.buffer += value
+            self.buffer += b'\r\n'
+            return
+
+        self.chunks.append(self.buffer)
+        self.chunks.append(value)
+        self.size += len(self.buffer) + len(value)
+        self.buffer = bytearray(b'\r\n')
+
+    @staticmethod
+    def encode_command(args: list) -> bytes:
+        """Encode a command as the RESP array of bulk strings a client would send."""
+        encoded = [arg.encode() if isinstance(arg, str) else b'%d' % arg if isinstance(arg, int) else arg for arg in args]
+        return b''.join([b'*%d\r\n' % len(encoded), *(b'$%d\r\n%s\r\n' % (len(arg), arg) for arg in encoded)])
+
+    def drain(self) -> list:
+        """
+        Take everything buffered so far.
+        :return: List of bytes-like chunks to write in order.
+        """
+        chunks = self.chunks
+        if self.buffer:
+            chunks.append(self.buffer)
+        self.chunks, self.buffer, self.size = [], bytearray(), 0
+        return chunks